@@ -23,6 +23,9 @@ from metavision_core.event_io.raw_reader import RawReader
 from metavision_core.event_io import EventsIterator
 from metavision_hal import I_TriggerIn
 from metavision_core.event_io.raw_reader import initiate_device
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sync'))
+from lib.pipeline_writer import PipelinedRecorder
+from lib.video_stream import StreamingVideoWriter, VIDEO_TYPES
 
 #  flir camera set
 #prophesee first trigger is incompelete, so we save one more image
@@ -41,6 +44,16 @@ class AviType:
     H264 = 2
 
 chosenAviType = AviType.UNCOMPRESSED  # change me!
+# 流水线录制: 采集线程只拷贝 Bayer 数据, 解马赛克和编码放到写盘进程
+PIPELINE_MODE = False  # 在实际设备上验证之前默认仍用原来的逐帧保存
+PIPELINE_WORKERS = 3    # 写盘进程数
+PIPELINE_SLOTS = 32     # 共享内存槽数, 决定队列长度
+PIPELINE_POLICY = 'drop'  # 'drop' 队列满时丢帧并计数, 'block' 阻塞采集线程
+SAVE_FORMAT = 'png'     # 'png' 或 'raw'
+STREAM_VIDEO = False    # 采集的同时按 chosenAviType 编码视频 (acquire_images 和 acquire_images_pipelined 都支持)
+VIDEO_BACKEND = 'opencv'  # 'opencv' 或 'spinvideo'
+VIDEO_MAX_SECONDS = 600   # 单个视频文件最长时长 s, 超过后切换到新文件
+VIDEO_MAX_BYTES = 4 * 1024 ** 3  # 单个视频文件最大字节数
 # prophesee camera set
 stc_filter_ths = 10000  # Length of the time window for filtering (in us)
 stc_cut_trail = True  # If true, after an event goes through, it removes all events until change of polarity
@@ -603,6 +616,11 @@ def acquire_images(cam, nodemap,path):
         print('start saving images...')
         et_txt = open(os.path.join(path, 'exposure_times.txt'), 'w')
         ts_txt = open(os.path.join(path, 'timestamps.txt'), 'w')
+        video = None
+        if STREAM_VIDEO:
+            video = StreamingVideoWriter(path, WIDTH, HEIGHT, FRAMERATE, video_type=VIDEO_TYPES[chosenAviType],
+                                         backend=VIDEO_BACKEND, max_bytes=VIDEO_MAX_BYTES,
+                                         max_seconds=VIDEO_MAX_SECONDS)
         while(1):
             try:
                 # Retrieve next received image and ensure image completion
@@ -627,6 +645,9 @@ def acquire_images(cam, nodemap,path):
                     
                     # Convert image to RGB8
                     image = processor.Convert(image_result, PySpin.PixelFormat_RGB8).GetNDArray()
+                    # 丢弃第一张图片, 与保存的 PNG 一致
+                    if video is not None and i > 0:
+                        video.submit(image_result.GetNDArray())
 
                     
                     
@@ -642,7 +663,16 @@ def acquire_images(cam, nodemap,path):
                 i += 1
             except PySpin.SpinnakerException as ex:
                 print('Error: %s' % ex)
+                if video is not None:
+                    video.close()
                 return False
+            except KeyboardInterrupt:
+                # 原来的行为不变 (中断向上抛出), 只是先把视频文件收尾
+                if video is not None:
+                    video.close()
+                raise
+        if video is not None:
+            video.close()
         et_txt.close()
         ts_txt.close()
         print('end saving images...')
@@ -658,6 +688,66 @@ def acquire_images(cam, nodemap,path):
 
     return result
 
+def acquire_images_pipelined(cam, nodemap, path):
+    """
+    This function acquires images until interrupted and hands the Bayer data to
+    a pool of writer processes, see PipelinedRecorder.
+
+    :param cam: Camera to acquire images from.
+    :param nodemap: Device nodemap.
+    :type cam: CameraPtr
+    :type nodemap: INodeMap
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+
+    print('*** IMAGE ACQUISITION (PIPELINED) ***\n')
+    result = True
+    recorder = PipelinedRecorder(path, HEIGHT, WIDTH, num_workers=PIPELINE_WORKERS,
+                                 num_slots=PIPELINE_SLOTS, save_format=SAVE_FORMAT,
+                                 policy=PIPELINE_POLICY)
+    video = None
+    if STREAM_VIDEO:
+        video = StreamingVideoWriter(path, WIDTH, HEIGHT, FRAMERATE, video_type=VIDEO_TYPES[chosenAviType],
+                                     backend=VIDEO_BACKEND, policy=PIPELINE_POLICY,
+                                     max_bytes=VIDEO_MAX_BYTES, max_seconds=VIDEO_MAX_SECONDS)
+    i = 0
+    print('start saving images...')
+    try:
+        while(1):
+            image_result = cam.GetNextImage()
+            if image_result.IsIncomplete():
+                print('Image incomplete with image status %d...' % image_result.GetImageStatus())
+                image_result.Release()
+                continue
+            # 丢弃第一张图片
+            if i > 0:
+                chunk_data = image_result.GetChunkData()
+                recorder.submit(i, image_result.GetNDArray(),
+                                chunk_data.GetExposureTime(), chunk_data.GetTimestamp(),
+                                frame_id=chunk_data.GetFrameID(), gain=chunk_data.GetGain())
+                if video is not None:
+                    video.submit(image_result.GetNDArray())
+            image_result.Release()
+            i += 1
+            if i % 100 == 0:
+                submitted, written, dropped = recorder.status()
+                print('Grabbed %d, written %d, dropped %d' % (submitted, written, dropped))
+
+    except PySpin.SpinnakerException as ex:
+        print('Error: %s' % ex)
+        result = False
+    except KeyboardInterrupt:
+        print('stop recording...')
+
+    print(f'we acquiring {i} images')
+    cam.EndAcquisition()
+    recorder.close()
+    if video is not None:
+        video.close()
+    print('end saving images...')
+    return result
+
 def save_images(images, exposure_times, timestamps, path):
     print('start saving images...')
     et_txt = open(os.path.join(path, 'exposure_times.txt'), 'w')
@@ -895,7 +985,10 @@ def main():
             # GPIO.setup(trigger_io, GPIO.OUT, initial=GPIO.LOW)
             # pwm = GPIO.PWM(trigger_io, frequency)	# 50Hz
             # pwm.start(duty_cycle)	# 占空比为50%
-            result = acquire_images(cam, nodemap,path)
+            if PIPELINE_MODE:
+                result = acquire_images_pipelined(cam, nodemap, path)
+            else:
+                result = acquire_images(cam, nodemap,path)
             # pwm.stop()
             # GPIO.cleanup()
 
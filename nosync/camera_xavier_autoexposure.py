@@ -23,6 +23,8 @@ from metavision_core.event_io.raw_reader import RawReader
 from metavision_core.event_io import EventsIterator
 from metavision_hal import I_TriggerIn
 from metavision_core.event_io.raw_reader import initiate_device
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sync'))
+from lib.auto_exposure import HostAutoExposure
 
 #  flir camera set
 #prophesee first trigger is incompelete, so we save one more image
@@ -30,6 +32,10 @@ from metavision_core.event_io.raw_reader import initiate_device
 ## flir camera set
 FRAMERATE = int(15) # fps
 EXPOSURE_TIME = 50000 # us
+HOST_AUTO_EXPOSURE = True # True 时在主机端逐帧调节曝光和增益, False 时使用相机的 ExposureAuto Continuous
+AE_TARGET = 0.45 # 目标归一化亮度 (G 通道均值)
+AE_MAX_EXPOSURE = 1e6 / FRAMERATE * 0.9 # us, 曝光不超过帧周期
+AE_MAX_GAIN = 18.0 # dB
 OFFSET_X = 223
 OFFSET_Y = 523
 WIDTH = 2000
@@ -244,23 +250,24 @@ def config_camera(nodemap):
         node_exposure_limit.SetValue(FRAMERATE)
 
         """ -------------------- 设置曝光时间 -------------------- """
-        # Turn ON auto exposure
-        node_exposure_auto = PySpin.CEnumerationPtr(nodemap.GetNode('ExposureAuto'))
-        if not PySpin.IsReadable(node_exposure_auto) or not PySpin.IsWritable(node_exposure_auto):
-            print('\nUnable to set Exposure Auto (enumeration retrieval). Aborting...\n')
-            return False
-        entry_exposure_auto_on = node_exposure_auto.GetEntryByName('Continuous')
-        if not PySpin.IsReadable(entry_exposure_auto_on):
-            print('\nUnable to set Exposure Auto (entry retrieval). Aborting...\n')
-            return False
-        exposure_auto_on = entry_exposure_auto_on.GetValue()
-        node_exposure_auto.SetIntValue(exposure_auto_on)
+        if not HOST_AUTO_EXPOSURE:
+            # Turn ON auto exposure
+            node_exposure_auto = PySpin.CEnumerationPtr(nodemap.GetNode('ExposureAuto'))
+            if not PySpin.IsReadable(node_exposure_auto) or not PySpin.IsWritable(node_exposure_auto):
+                print('\nUnable to set Exposure Auto (enumeration retrieval). Aborting...\n')
+                return False
+            entry_exposure_auto_on = node_exposure_auto.GetEntryByName('Continuous')
+            if not PySpin.IsReadable(entry_exposure_auto_on):
+                print('\nUnable to set Exposure Auto (entry retrieval). Aborting...\n')
+                return False
+            exposure_auto_on = entry_exposure_auto_on.GetValue()
+            node_exposure_auto.SetIntValue(exposure_auto_on)
 
-        node_exposure_limit = PySpin.CFloatPtr(nodemap.GetNode('ExposureTimeLowerLimit'))
-        if not PySpin.IsReadable(node_exposure_limit) or not PySpin.IsWritable(node_exposure_limit):
-            print('\nUnable to set ExposureTimeLowerLimit . Aborting...\n')
-            return False
-        node_exposure_limit.SetValue(13529234)
+            node_exposure_limit = PySpin.CFloatPtr(nodemap.GetNode('ExposureTimeLowerLimit'))
+            if not PySpin.IsReadable(node_exposure_limit) or not PySpin.IsWritable(node_exposure_limit):
+                print('\nUnable to set ExposureTimeLowerLimit . Aborting...\n')
+                return False
+            node_exposure_limit.SetValue(13529234)
 
        # timed mode 
         node_exposure_mode = PySpin.CEnumerationPtr(nodemap.GetNode('ExposureMode'))
@@ -605,6 +612,11 @@ def acquire_images(cam, nodemap,path):
         # processor will default to NEAREST_NEIGHBOR method.
         processor.SetColorProcessing(PySpin.SPINNAKER_COLOR_PROCESSING_ALGORITHM_HQ_LINEAR)
         
+        ae = None
+        if HOST_AUTO_EXPOSURE:
+            ae = HostAutoExposure(nodemap, target=AE_TARGET, max_exposure=AE_MAX_EXPOSURE, max_gain=AE_MAX_GAIN)
+            ae.start(EXPOSURE_TIME)
+
         i = 0
         print('start saving images...')
         et_txt = open(os.path.join(path, 'exposure_times.txt'), 'w')
@@ -630,6 +642,9 @@ def acquire_images(cam, nodemap,path):
                     
                     # Read chunk data
                     result, exposure_time, timestamp = read_chunk_data(image_result)
+                    if ae is not None:
+                        # 用 Bayer 原始数据和该帧 chunk 中的实际曝光/增益计算下一次设置
+                        ae.update(image_result.GetNDArray(), exposure_time, image_result.GetChunkData().GetGain())
                     
                     # Convert image to RGB8
                     image = processor.Convert(image_result, PySpin.PixelFormat_RGB8).GetNDArray()
@@ -652,6 +667,8 @@ def acquire_images(cam, nodemap,path):
         et_txt.close()
         ts_txt.close()
         print('end saving images...')
+        if ae is not None:
+            print('auto exposure: %s' % ae.report())
         
         # End acquisition
         print(f'we acquiring {i} images')
@@ -0,0 +1,315 @@
+'''
+常驻采集服务: FLIR 和 EVK4 只初始化一次, 通过本地 Unix socket 接收采集任务.
+
+启动服务:   python capture_daemon.py
+提交任务:   python capture_daemon.py --client --frames 5 --fps 10 --exposure 50000 --path ./data/test
+每个请求和应答都是一行 JSON, 例如
+    {"cmd": "capture", "frames": 5, "fps": 10, "exposure": 50000, "path": "./data/test", "codec": "zlib"}
+    {"cmd": "status"}
+    {"cmd": "shutdown"}
+'''
+import PySpin
+import sys
+import os
+import time
+import json
+import socket
+import signal
+import argparse
+import socketserver
+from threading import Thread
+import serial
+import numpy as np
+
+from lib.frame_pool import FramePool, AcquisitionEngine
+from lib.frame_container import ContainerSink
+from lib.frame_compress import CompressedSink, CODECS
+from lib.frame_meta import FrameMetaWriter, FrameMeta
+from lib.camera_profile import NodeMapConfigurator
+from lib.stream_tuning import tune_stream, StreamMonitor
+from lib.evk4 import EventCamera, extract_triggers, save_trigger_timestamps
+from lib.frame_accounting import FrameAccounting, map_triggers
+from lib.timebase import fit_trigger_map
+from lib.packed_pixels import frame_layout, is_packed
+
+SOCKET_PATH = '/tmp/camera_sync.sock'
+SERIAL_PORT = '/dev/ttyTHS1'
+## flir camera set
+FRAMERATE = 10.0 # fps
+EXPOSURE_TIME = 50000.0 # us
+EX_Trigger = True
+PIXEL_FORMAT = 'BayerRG8'  # 'BayerRG10p' / 'BayerRG12p' 按原始字节保存, 离线解包
+OFFSET_X = 224
+OFFSET_Y = 524
+WIDTH = 2000
+HEIGHT = 1000
+POOL_SLOTS = 16
+COMPRESS_CODEC = None  # 'zlib' / 'lz4' / 'zstd' 时无损压缩写入 frames.cfz
+STREAM_LATENCY_BUDGET = 2.0  # s
+MAX_FRAMES = 1000  # 单个任务最多帧数
+# FLIR 触发序号 = EVK4 触发序号 + TRIGGER_OFFSET. EVK4 收不到第一个脉冲 (原来保留 triggers[:NUM_IMAGES-1],
+# V2 丢弃 images[0]), 所以 FLIR 第 k 帧对应 EVK4 第 k-1 个触发, 第 0 帧没有触发
+TRIGGER_OFFSET = 1
+EVENT_LOW_CPU = True  # True 时 EVK4 只取原始缓冲区写盘, 不解码事件
+EVENT_POLL_INTERVAL = 0.05  # s
+
+
+def camera_profile(fps, exposure):
+    profile = {'PixelFormat': PIXEL_FORMAT,
+               'Width': WIDTH, 'Height': HEIGHT, 'OffsetX': OFFSET_X, 'OffsetY': OFFSET_Y,
+               'ExposureAuto': 'Off', 'ExposureMode': 'Timed', 'ExposureTime': float(exposure),
+               'GainAuto': 'Off', 'BalanceWhiteAuto': 'Off',
+               'DeviceLinkThroughputLimit': 43000000,
+               'TriggerSelector': 'FrameStart'}
+    if EX_Trigger:
+        profile.update({'TriggerSource': 'Line3', 'TriggerMode': 'On',
+                        'TriggerActivation': 'RisingEdge', 'TriggerOverlap': 'ReadOut'})
+    else:
+        profile.update({'TriggerMode': 'Off', 'TriggerSource': 'Software'})
+    profile.update({'AcquisitionMode': 'Continuous', 'AcquisitionFrameRateEnable': True,
+                    'AcquisitionFrameRate': float(fps), 'ChunkModeActive': True, 'chunks': 'all'})
+    return profile
+
+
+class CaptureDaemon:
+    """持有 PySpin 系统、FLIR 相机、EVK4 和串口, 逐个执行采集任务"""
+
+    def __init__(self):
+        self.system = None
+        self.cam_list = None
+        self.cam = None
+        self.configurator = None
+        self.event_cam = None
+        self.ser = None
+        self.jobs_done = 0
+
+    def open(self):
+        start = time.perf_counter()
+        self.system = PySpin.System.GetInstance()
+        self.cam_list = self.system.GetCameras()
+        if self.cam_list.GetSize() == 0:
+            print('Not enough cameras!')
+            return False
+        self.cam = self.cam_list[0]
+        self.cam.Init()
+        self.configurator = NodeMapConfigurator(self.cam.GetNodeMap())
+        if not self.configurator.apply(camera_profile(FRAMERATE, EXPOSURE_TIME)):
+            return False
+
+        self.event_cam = EventCamera(low_cpu=EVENT_LOW_CPU, poll_interval=EVENT_POLL_INTERVAL)
+        if not self.event_cam.open():
+            return False
+        self.ser = serial.Serial(SERIAL_PORT, 115200, timeout=1)
+        print('daemon ready in %.2f s' % (time.perf_counter() - start))
+        return True
+
+    def close(self):
+        if self.event_cam is not None:
+            self.event_cam.close()
+        if self.ser is not None:
+            self.ser.close()
+        if self.cam is not None:
+            self.cam.DeInit()
+            del self.cam
+            self.cam = None
+        if self.cam_list is not None:
+            self.cam_list.Clear()
+        if self.system is not None:
+            self.system.ReleaseInstance()
+
+    def send_pulse_command(self, num_pulses, frequency):
+        command = f"PULSE,{num_pulses},{frequency}\n"
+        self.ser.write(command.encode())
+
+    def capture(self, frames, fps, exposure, path, codec=None):
+        """执行一次采集, 返回结果 dict"""
+        start = time.perf_counter()
+        frames = int(frames)
+        if frames < 1 or frames > MAX_FRAMES:
+            return {'ok': False, 'error': 'frames must be in [1, %d]' % MAX_FRAMES}
+        if float(fps) <= 0:
+            return {'ok': False, 'error': 'fps must be positive'}
+        if not 0 < float(exposure) < 1e6 / float(fps):
+            return {'ok': False, 'error': 'exposure must be in (0, %d) us at %s fps' % (1e6 / float(fps), fps)}
+        if codec is None:
+            codec = COMPRESS_CODEC
+        if codec and codec not in CODECS:
+            return {'ok': False, 'error': 'codec must be one of %s' % ', '.join(CODECS)}
+        path = os.path.abspath(path)
+        os.makedirs(os.path.join(path, 'event'), exist_ok=True)
+
+        if not self.configurator.apply(camera_profile(fps, exposure)):
+            return {'ok': False, 'error': 'unable to configure camera'}
+        config_ms = self.configurator.last_report['elapsed_ms']
+
+        raw_path = os.path.join(path, 'event', 'event.raw')
+        (height, row), dtype = frame_layout(PIXEL_FORMAT, HEIGHT, WIDTH)
+        pool = FramePool(POOL_SLOTS, height, row, dtype=dtype)
+        if codec:
+            sink = CompressedSink(path, (OFFSET_X, OFFSET_Y, row, height), pixel_format=PIXEL_FORMAT,
+                                  dtype=dtype, codec=codec)
+        else:
+            sink = ContainerSink(path, (OFFSET_X, OFFSET_Y, row, height), capacity=frames,
+                                 pixel_format=PIXEL_FORMAT, dtype=dtype)
+        engine = AcquisitionEngine(self.cam, pool, sink, timeout=int(1000 + 2000 / fps), meta=FrameMetaWriter(path),
+                                   accounting=FrameAccounting(), raw=is_packed(PIXEL_FORMAT))
+        monitor = StreamMonitor(self.cam, verbose=False)
+        result = {'ok': True, 'path': path}
+        grab_errors = []  # 采集线程中的异常, join 之后检查
+
+        def grab():
+            try:
+                engine.run(frames, None, 1.0 / fps)
+            except Exception as ex:
+                grab_errors.append(ex)
+
+        acquiring = False
+        flir_thread = None
+        try:
+            tune_stream(self.cam, fps, STREAM_LATENCY_BUDGET, mode='record')
+            self.event_cam.start_recording(raw_path)
+            self.cam.BeginAcquisition()
+            acquiring = True
+            monitor.start()
+            flir_thread = Thread(target=grab)
+            flir_thread.start()
+            self.send_pulse_command(frames, fps)
+            flir_thread.join()
+            if grab_errors:
+                raise grab_errors[0]
+        except PySpin.SpinnakerException as ex:
+            result = {'ok': False, 'error': str(ex)}
+        finally:
+            monitor.stop()
+            if acquiring:
+                # 出错时也要结束采集, 否则下一个任务无法配置相机
+                try:
+                    self.cam.EndAcquisition()
+                except PySpin.SpinnakerException as ex:
+                    print('Error: %s' % ex)
+            if flir_thread is not None:
+                # 发脉冲失败时采集线程还在运行, EndAcquisition 后 GetNextImage 会退出
+                flir_thread.join()
+            self.event_cam.stop_recording()
+            engine.finish()
+
+        monitor.save(path)
+        result['stream_lost'] = monitor.lost()
+        FrameMeta(path).export_txt(path)
+        try:
+            triggers = extract_triggers(raw_path, polarity=0)[:frames - 1]
+            save_trigger_timestamps(path, triggers['t'])
+            table = map_triggers(path, triggers['t'], TRIGGER_OFFSET, frames)
+            result['triggers'] = len(triggers)
+            result['missing_ordinals'] = table['ordinal'][table['row'] < 0].tolist()
+            clock = fit_trigger_map(table)
+            if clock.count:
+                clock.save(path)
+                result['drift_ppm'] = clock.drift_ppm
+        except Exception as ex:
+            print('trigger extraction failed: %s' % ex)
+            result['triggers'] = 0
+
+        self.jobs_done += 1
+        result.update({'frames': engine.grabbed_count, 'incomplete': engine.incomplete_count,
+                       'missing': engine.accounting.missing_count,
+                       'compression': getattr(sink, 'stats', None),
+                       'event_log': self.event_cam.pump.stats() if self.event_cam.pump else None,
+                       'config_ms': config_ms, 'elapsed_ms': (time.perf_counter() - start) * 1000})
+        return result
+
+    def handle(self, request):
+        cmd = request.get('cmd', 'capture')
+        if cmd == 'capture':
+            return self.capture(request.get('frames', 4), request.get('fps', FRAMERATE),
+                                request.get('exposure', EXPOSURE_TIME),
+                                request.get('path', os.path.join('./data', time.strftime("%Y_%m_%d_%H_%M_%S"))),
+                                request.get('codec'))
+        if cmd == 'status':
+            return {'ok': True, 'jobs_done': self.jobs_done}
+        return {'ok': False, 'error': 'unknown command %s' % cmd}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'ok': False, 'error': 'invalid json'}
+            else:
+                if request.get('cmd') == 'shutdown':
+                    self.wfile.write(b'{"ok": true}\n')
+                    Thread(target=self.server.shutdown).start()
+                    return
+                try:
+                    response = self.server.daemon_obj.handle(request)
+                except Exception as ex:
+                    # 串口 OSError, 任务字段类型错误等也要回复, 不能直接断开连接
+                    print('Error: %s' % ex)
+                    response = {'ok': False, 'error': str(ex)}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+def serve(socket_path=SOCKET_PATH):
+    daemon = CaptureDaemon()
+    if not daemon.open():
+        daemon.close()
+        return False
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    # 单线程服务, 任务按到达顺序串行执行
+    server = socketserver.UnixStreamServer(socket_path, _Handler)
+    server.daemon_obj = daemon
+    signal.signal(signal.SIGINT, lambda sig, frame: Thread(target=server.shutdown).start())
+    print('listening on %s' % socket_path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        daemon.close()
+    return True
+
+
+def submit_job(request, socket_path=SOCKET_PATH):
+    """客户端: 发送一个请求并等待应答"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall((json.dumps(request) + '\n').encode())
+        with s.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Camera capture daemon.')
+    parser.add_argument('--socket', default=SOCKET_PATH)
+    parser.add_argument('--client', action='store_true', help='submit a job to a running daemon')
+    parser.add_argument('--cmd', default='capture', choices=('capture', 'status', 'shutdown'))
+    parser.add_argument('--frames', type=int, default=4)
+    parser.add_argument('--fps', type=float, default=FRAMERATE)
+    parser.add_argument('--exposure', type=float, default=EXPOSURE_TIME)
+    parser.add_argument('--path', default=None)
+    parser.add_argument('--codec', default=None, help="lossless codec ('zlib', 'lz4', 'zstd'), '' for none")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.client:
+        return serve(args.socket)
+    request = {'cmd': args.cmd, 'frames': args.frames, 'fps': args.fps, 'exposure': args.exposure}
+    if args.path:
+        request['path'] = args.path
+    if args.codec is not None:
+        request['codec'] = args.codec
+    response = submit_job(request, args.socket)
+    print(json.dumps(response, indent=2))
+    return response.get('ok', False)
+
+
+if __name__ == '__main__':
+    if main():
+        sys.exit(0)
+    else:
+        sys.exit(1)
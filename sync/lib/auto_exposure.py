@@ -0,0 +1,139 @@
+"""
+主机端快速自动曝光.
+
+每帧在抽稀的 Bayer G 通道上用 numpy 计算亮度 (均值 + 64 档直方图),
+按线性模型 亮度 ∝ 曝光时间 x 线性增益 一步算出达到目标亮度所需的曝光量,
+先加曝光时间 (受帧周期限制), 不够再加增益; 通过 NodeMapConfigurator 缓存的节点句柄写入.
+计算用的是该帧 chunk 中实际的曝光时间和增益, 相机设置生效的延迟不会引起振荡.
+"""
+import time
+import math
+import numpy as np
+
+from lib.camera_profile import NodeMapConfigurator
+
+
+def bayer_stats(bayer, decimation=8, bits=8, bins=64):
+    """
+    在抽稀的 G 通道 (RGGB 的第 0 行第 1 列) 上计算亮度.
+
+    :return: (归一化均值, 饱和像素比例, 直方图)
+    """
+    plane = bayer[0::2 * decimation, 1::2 * decimation]
+    shift = max(bits - int(math.log2(bins)), 0)
+    hist = np.bincount((plane >> shift).ravel(), minlength=bins)[:bins]
+    full = float((1 << bits) - 1)
+    mean = float(plane.mean()) / full
+    saturated = float(hist[-1]) / plane.size
+    return mean, saturated, hist
+
+
+class HostAutoExposure:
+    """
+    :param target: 目标归一化亮度
+    :param tolerance: |亮度 - target| <= tolerance * target 视为收敛
+    :param max_exposure: 最长曝光 us, 一般取帧周期的 90%
+    :param max_gain: 最大增益 dB
+    """
+
+    def __init__(self, nodemap, target=0.45, tolerance=0.08, min_exposure=20.0, max_exposure=60000.0,
+                 max_gain=18.0, decimation=8, bits=8, max_step=8.0, saturation_limit=0.05):
+        self.configurator = NodeMapConfigurator(nodemap)
+        self.target = target
+        self.tolerance = tolerance
+        self.min_exposure = min_exposure
+        self.max_exposure = max_exposure
+        self.max_gain = max_gain
+        self.decimation = decimation
+        self.bits = bits
+        self.max_step = max_step
+        self.saturation_limit = saturation_limit
+
+        self.requested = None     # (exposure, gain) 最近一次写入的值
+        self.pending_frames = 0   # 写入后还没生效的帧数
+        self.max_pending = 4      # 超过后认为相机已取整/限幅, 不再等待
+        self.frames = 0
+        self.converged_frames = None
+        self.converged_time = None
+        self.start_time = None
+        self.last_brightness = None
+
+    def start(self, exposure=None, gain=0.0):
+        """关闭相机自动曝光/增益, 可选设置初始值; 收敛计数从这里开始"""
+        profile = {'ExposureAuto': 'Off', 'ExposureMode': 'Timed', 'GainAuto': 'Off'}
+        if exposure is not None:
+            profile['ExposureTime'] = float(exposure)
+            profile['Gain'] = float(gain)
+            self.requested = (float(exposure), float(gain))
+        result = self.configurator.apply(profile)
+        self.reset()
+        return result
+
+    def reset(self):
+        """场景或触发方式改变后重新统计收敛"""
+        self.frames = 0
+        self.converged_frames = None
+        self.converged_time = None
+        self.start_time = time.perf_counter()
+
+    def split(self, total):
+        """把曝光量 (曝光时间 us x 线性增益) 分成曝光时间和增益 dB"""
+        exposure = min(max(total, self.min_exposure), self.max_exposure)
+        gain = 0.0
+        if total > exposure:
+            gain = min(20.0 * math.log10(total / exposure), self.max_gain)
+        return exposure, gain
+
+    def update(self, bayer, exposure, gain=0.0):
+        """
+        处理一帧, 需要时写入新的曝光时间和增益.
+
+        :param bayer: 该帧的 Bayer 数据
+        :param exposure: 该帧实际的曝光时间 us (chunk ExposureTime)
+        :param gain: 该帧实际的增益 dB (chunk Gain)
+        :return: 是否已收敛
+        """
+        self.frames += 1
+        brightness, saturated, _ = bayer_stats(bayer, self.decimation, self.bits)
+        self.last_brightness = brightness
+        if abs(brightness - self.target) <= self.tolerance * self.target and saturated <= self.saturation_limit:
+            if self.converged_frames is None:
+                self.converged_frames = self.frames
+                self.converged_time = time.perf_counter() - self.start_time
+                print('auto exposure converged in %d frames, %.3f s: exposure %.1f us, gain %.2f dB, brightness %.3f'
+                      % (self.frames, self.converged_time, exposure, gain, brightness))
+            return True
+
+        # 上一次写入的值还没有在帧上生效时不再调整
+        if self.requested is not None and not self._applied(exposure, gain):
+            self.pending_frames += 1
+            if self.pending_frames < self.max_pending:
+                return False
+        self.pending_frames = 0
+
+        if self.converged_frames is not None:
+            # 场景变化, 重新计时
+            self.reset()
+            self.frames = 1
+        if saturated > self.saturation_limit or brightness >= 0.98:
+            # 饱和时均值不再线性, 按饱和程度减小
+            ratio = 1.0 / min(self.max_step, 2.0 + 10.0 * saturated)
+        else:
+            ratio = self.target / max(brightness, 1.0 / (1 << self.bits))
+        ratio = min(max(ratio, 1.0 / self.max_step), self.max_step)
+        total = exposure * 10.0 ** (gain / 20.0) * ratio
+        new_exposure, new_gain = self.split(total)
+        self.configurator.write('ExposureTime', new_exposure)
+        self.configurator.write('Gain', new_gain)
+        self.requested = (new_exposure, new_gain)
+        return False
+
+    def _applied(self, exposure, gain):
+        req_exposure, req_gain = self.requested
+        return abs(exposure - req_exposure) <= max(1.0, 0.02 * req_exposure) and abs(gain - req_gain) <= 0.1
+
+    def report(self):
+        return {'frames': self.frames, 'converged_frames': self.converged_frames,
+                'converged_s': self.converged_time, 'brightness': self.last_brightness,
+                'exposure': self.requested[0] if self.requested else None,
+                'gain': self.requested[1] if self.requested else None}
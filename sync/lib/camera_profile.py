@@ -0,0 +1,140 @@
+"""
+声明式相机配置: 用一个有序 dict 描述节点值, 由 NodeMapConfigurator 应用.
+
+节点句柄只查找一次并缓存, 写之前先读当前值, 只写不同的节点;
+chunk 的使能状态也缓存, 同一会话中再次应用时不再逐项切换 ChunkSelector.
+"""
+import time
+import PySpin
+
+_PTR_TYPES = {
+    PySpin.intfIEnumeration: PySpin.CEnumerationPtr,
+    PySpin.intfIFloat: PySpin.CFloatPtr,
+    PySpin.intfIInteger: PySpin.CIntegerPtr,
+    PySpin.intfIBoolean: PySpin.CBooleanPtr,
+    PySpin.intfIString: PySpin.CStringPtr,
+}
+
+
+class NodeMapConfigurator:
+    """缓存节点句柄, 按差异写入配置"""
+
+    def __init__(self, nodemap):
+        self.nodemap = nodemap
+        self.nodes = {}
+        self.chunk_state = {}   # chunk 名称 -> 是否使能, 第一次应用后缓存
+        self.last_report = None
+
+    def node(self, name):
+        """返回 (句柄, 接口类型), 不存在时返回 (None, None)"""
+        if name not in self.nodes:
+            node = self.nodemap.GetNode(name)
+            if node is None:
+                self.nodes[name] = (None, None)
+            else:
+                kind = node.GetPrincipalInterfaceType()
+                self.nodes[name] = (_PTR_TYPES[kind](node), kind) if kind in _PTR_TYPES else (None, None)
+        return self.nodes[name]
+
+    def read(self, name):
+        ptr, kind = self.node(name)
+        if ptr is None or not PySpin.IsReadable(ptr):
+            return None
+        if kind == PySpin.intfIEnumeration:
+            return ptr.GetCurrentEntry().GetSymbolic()
+        return ptr.GetValue()
+
+    def write(self, name, value):
+        ptr, kind = self.node(name)
+        if ptr is None or not PySpin.IsWritable(ptr):
+            return False
+        if kind == PySpin.intfIEnumeration:
+            entry = ptr.GetEntryByName(value)
+            if not PySpin.IsReadable(entry):
+                return False
+            ptr.SetIntValue(entry.GetValue())
+        else:
+            ptr.SetValue(value)
+        return True
+
+    @staticmethod
+    def same(current, value):
+        if current is None:
+            return False
+        if isinstance(value, float):
+            return abs(current - value) <= max(1e-3, 1e-4 * abs(value))
+        return current == value
+
+    def apply_chunks(self, chunks, refresh=False):
+        """使能 chunks 中的 chunk ('all' 为全部), 返回写入的个数"""
+        if refresh:
+            self.chunk_state = {}
+        selector, _ = self.node('ChunkSelector')
+        if selector is None or not PySpin.IsWritable(selector):
+            print('Unable to retrieve Chunk Selector. Aborting...')
+            return -1
+        if not self.chunk_state:
+            for entry in selector.GetEntries():
+                entry = PySpin.CEnumEntryPtr(entry)
+                if not PySpin.IsReadable(entry):
+                    continue
+                selector.SetIntValue(entry.GetValue())
+                enable, _ = self.node('ChunkEnable')
+                self.chunk_state[entry.GetSymbolic()] = bool(enable.GetValue()) if PySpin.IsReadable(enable) else None
+
+        wanted = list(self.chunk_state) if chunks == 'all' else chunks
+        written = 0
+        for name in wanted:
+            if self.chunk_state.get(name) is not False:
+                continue
+            entry = selector.GetEntryByName(name)
+            if not PySpin.IsReadable(entry):
+                print('\t %s: not available' % name)
+                continue
+            selector.SetIntValue(entry.GetValue())
+            enable, _ = self.node('ChunkEnable')
+            if PySpin.IsWritable(enable):
+                enable.SetValue(True)
+                self.chunk_state[name] = True
+                written += 1
+            else:
+                print('\t %s: not writable' % name)
+        return written
+
+    def apply(self, profile, refresh_chunks=False):
+        """
+        应用配置, 只写与当前值不同的节点.
+
+        :param profile: 有序 dict, 节点名 -> 值, 'chunks' 为需要使能的 chunk
+        :return: True if successful, False otherwise.
+        :rtype: bool
+        """
+        start = time.perf_counter()
+        written, failed, unchanged = [], [], 0
+        try:
+            for name, value in profile.items():
+                if name == 'chunks':
+                    continue
+                if self.same(self.read(name), value):
+                    unchanged += 1
+                elif self.write(name, value):
+                    written.append(name)
+                else:
+                    failed.append(name)
+            chunks_written = 0
+            if 'chunks' in profile:
+                chunks_written = self.apply_chunks(profile['chunks'], refresh=refresh_chunks)
+        except PySpin.SpinnakerException as ex:
+            print('Error: %s' % ex)
+            return False
+
+        elapsed = (time.perf_counter() - start) * 1000
+        self.last_report = {'written': written, 'failed': failed, 'unchanged': unchanged,
+                            'chunks_written': chunks_written, 'elapsed_ms': elapsed}
+        print('profile applied in %.1f ms: %d written, %d unchanged, %d chunks enabled'
+              % (elapsed, len(written), unchanged, max(chunks_written, 0)))
+        if written:
+            print('\t written: %s' % ', '.join(written))
+        if failed:
+            print('\t unable to set: %s' % ', '.join(failed))
+        return not failed and chunks_written >= 0
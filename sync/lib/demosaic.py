@@ -0,0 +1,141 @@
+"""
+离线批量解马赛克: 采集时只保存 Bayer 数据, 采集结束后用进程池分块转换为彩色.
+
+输入可以是单文件容器 (.frc)、np.save 的 Bayer 图像栈 (.npy) 或 {i:05d}.raw 文件夹,
+输出为逐帧 PNG 或一个 (N, H, W, 3) 的 .npy 彩色图像栈.
+命令行用法 (在 sync 目录下): python -m lib.demosaic <src> <dst> --output npy --algorithm ea
+"""
+import os
+import glob
+import time
+import argparse
+import multiprocessing as mp
+import numpy as np
+import cv2 as cv
+
+from lib.frame_container import FrameContainer, RAW_HEADER_SIZE
+
+# GenICam 的 Bayer 命名与 OpenCV 错开一行, BayerRG (RGGB) 对应 OpenCV 的 BayerBG
+_CV_PATTERN = {'BayerRG': 'BG', 'BayerBG': 'RG', 'BayerGR': 'GB', 'BayerGB': 'GR'}
+ALGORITHMS = {'bilinear': '', 'vng': '_VNG', 'ea': '_EA'}
+# 进程池用 spawn 启动: V2 在 acquire_images 中调用时 Spinnaker, 相机和 EVK4 录制线程都还在, fork 会全部继承
+MP_CONTEXT = mp.get_context('spawn')
+
+
+def bayer_code(pixel_format='BayerRG8', algorithm='bilinear', order='BGR'):
+    """返回 cv.cvtColor 使用的转换码"""
+    pattern = _CV_PATTERN[pixel_format[:7]]
+    return getattr(cv, 'COLOR_Bayer%s2%s%s' % (pattern, order, ALGORITHMS[algorithm]))
+
+
+class _BayerSource:
+    """按帧序号读取 Bayer 数据, 只保存路径, 可以在子进程中重新打开"""
+
+    def __init__(self, src):
+        self.src = src
+        if os.path.isdir(src):
+            self.kind = 'raw'
+            self.files = sorted(glob.glob(os.path.join(src, '*.raw')))
+            offset_x, offset_y, width, height = np.fromfile(self.files[0], dtype=np.int32, count=4)
+            self.shape = (int(height), int(width))
+            self.frame_numbers = [int(os.path.splitext(os.path.basename(f))[0]) for f in self.files]
+            self.pixel_format = 'BayerRG8'
+        elif src.endswith('.npy'):
+            self.kind = 'npy'
+            images = np.load(src, mmap_mode='r')
+            self.shape = images.shape[1:3]
+            self.frame_numbers = list(range(len(images)))
+            self.pixel_format = 'BayerRG8'
+        else:
+            self.kind = 'frc'
+            container = FrameContainer(src)
+            self.shape = container.frame_shape
+            self.frame_numbers = [int(n) for n in container.frame_numbers]
+            self.pixel_format = container.pixel_format
+        self._frames = None
+
+    def __len__(self):
+        return len(self.frame_numbers)
+
+    def frame(self, i):
+        if self.kind == 'raw':
+            return np.fromfile(self.files[i], dtype=np.uint8, offset=RAW_HEADER_SIZE).reshape(self.shape)
+        if self._frames is None:
+            self._frames = np.load(self.src, mmap_mode='r') if self.kind == 'npy' else FrameContainer(self.src)
+        return self._frames[i]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_frames'] = None
+        return state
+
+
+def _demosaic_chunk(args):
+    """工作进程: 转换 [start, stop) 范围内的帧"""
+    source, start, stop, code, output, dst = args
+    if output == 'npy':
+        out = np.load(dst, mmap_mode='r+')
+    for i in range(start, stop):
+        image = cv.cvtColor(np.ascontiguousarray(source.frame(i)), code)
+        if output == 'npy':
+            out[i] = image
+        else:
+            cv.imwrite(os.path.join(dst, 'image_%06d.png' % source.frame_numbers[i]), image)
+    if output == 'npy':
+        out.flush()
+    return stop - start
+
+
+def demosaic_session(src, dst, output='png', algorithm='bilinear', num_workers=None, chunk_size=8):
+    """
+    把一个采集的全部 Bayer 帧解马赛克.
+
+    :param src: .frc 容器, Bayer .npy 图像栈或 .raw 文件夹
+    :param dst: output='png' 时为输出文件夹, output='npy' 时为输出 .npy 文件
+    :param output: 'png' 逐帧写 BGR PNG, 'npy' 写 (N, H, W, 3) RGB 图像栈
+    :param algorithm: 'bilinear', 'vng' 或 'ea'
+    :return: 转换的帧数
+    """
+    start_time = time.time()
+    source = _BayerSource(src)
+    n = len(source)
+    if n == 0:
+        print('no frames in %s' % src)
+        return 0
+
+    if output == 'npy':
+        # npy 图像栈与原来 ImageProcessor 输出一致, 使用 RGB 顺序
+        code = bayer_code(source.pixel_format, algorithm, order='RGB')
+        out = np.lib.format.open_memmap(dst, mode='w+', dtype=np.uint8, shape=(n,) + tuple(source.shape) + (3,))
+        del out
+    else:
+        code = bayer_code(source.pixel_format, algorithm, order='BGR')
+        if not os.path.exists(dst):
+            os.makedirs(dst)
+
+    tasks = [(source, s, min(s + chunk_size, n), code, output, dst) for s in range(0, n, chunk_size)]
+    done = 0
+    with MP_CONTEXT.Pool(num_workers) as pool:
+        for count in pool.imap_unordered(_demosaic_chunk, tasks):
+            done += count
+
+    elapsed = time.time() - start_time
+    print('demosaic %d frames (%s) in %.2fs, %.2f fps' % (done, algorithm, elapsed, done / elapsed if elapsed > 0 else 0.0))
+    return done
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline parallel demosaic of a Bayer session.')
+    parser.add_argument('src', help='.frc container, Bayer .npy stack or folder of .raw files')
+    parser.add_argument('dst', help='output folder (png) or .npy file (npy)')
+    parser.add_argument('--output', choices=('png', 'npy'), default='png')
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='bilinear')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=8)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    demosaic_session(args.src, args.dst, output=args.output, algorithm=args.algorithm,
+                     num_workers=args.workers, chunk_size=args.chunk_size)
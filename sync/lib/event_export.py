@@ -0,0 +1,151 @@
+"""
+事件批量导出, 代替逐事件 '{}'.format(...) 写文本.
+
+按块处理: 裁剪原点偏移和时间换算对整块向量化计算, 再按格式整块写出, 整个录制不会同时放在内存里.
+    txt      每行 "t x y p", t 为秒 (%d.%06d, 微秒精确), x/y 减去原点 (与原 save_time 相同, 原点含 -1);
+             每 TEXT_BLOCK 行格式化一次直接写入文件
+    npy      一个 (N,) 结构化数组 (t 为 us), 需要事先知道事件数 (DAT 文件的 event_count())
+    columns  一个目录, 每列一个 <name>.bin 加 meta.json (与 frame_meta 相同的布局), 可用 np.memmap 读取
+"""
+import os
+import json
+import argparse
+import numpy as np
+
+EXPORT_DTYPE = np.dtype([('t', np.int64), ('x', np.int16), ('y', np.int16), ('p', np.int8)])
+FORMATS = ('txt', 'npy', 'columns')
+TEXT_LINE = '%d.%06d %d %d %d\n'
+TEXT_BLOCK = 1 << 16  # 每次格式化的行数, 临时 Python 对象只与这个数有关
+
+
+def shift_chunk(events, origin=(0, 0)):
+    """整块减去原点, 返回 EXPORT_DTYPE 数组"""
+    out = np.empty(len(events), dtype=EXPORT_DTYPE)
+    out['t'] = events['t']
+    np.subtract(events['x'], origin[0], out=out['x'], casting='unsafe')
+    np.subtract(events['y'], origin[1], out=out['y'], casting='unsafe')
+    out['p'] = events['p']
+    return out
+
+
+def write_text(f, chunk, block=TEXT_BLOCK):
+    """按 block 行一组格式化并直接写入打开的文件 (np.savetxt 逐行格式化, 慢约 5 倍)"""
+    for start in range(0, len(chunk), block):
+        part = chunk[start:start + block]
+        seconds, micros = np.divmod(part['t'], 1000000)
+        columns = np.column_stack((seconds, micros, part['x'], part['y'], part['p'])).astype(np.int64, copy=False)
+        f.write((TEXT_LINE * len(part)) % tuple(columns.ravel().tolist()))
+
+
+def iter_dat_chunks(record_dat, chunk_events=1 << 20):
+    """按块读取 EventDatReader, 不一次 load_n_events(event_count())"""
+    while not record_dat.done:
+        events = record_dat.load_n_events(chunk_events)
+        if not len(events):
+            break
+        yield events
+
+
+class _TextWriter:
+    def __init__(self, path, count=None):
+        self.file = open(path, 'w')
+
+    def write(self, chunk):
+        write_text(self.file, chunk)
+
+    def close(self):
+        self.file.close()
+
+
+class _NpyWriter:
+    def __init__(self, path, count=None):
+        from numpy.lib.format import open_memmap
+        if count is None:
+            raise ValueError('npy output needs the event count, use columns instead')
+        self.array = open_memmap(path, mode='w+', dtype=EXPORT_DTYPE, shape=(count,))
+        self.index = 0
+
+    def write(self, chunk):
+        n = min(len(chunk), len(self.array) - self.index)
+        self.array[self.index:self.index + n] = chunk[:n]
+        self.index += n
+
+    def close(self):
+        self.array.flush()
+        del self.array
+
+
+class _ColumnWriter:
+    def __init__(self, path, count=None):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.files = {name: open(os.path.join(path, name + '.bin'), 'wb') for name in EXPORT_DTYPE.names}
+        self.count = 0
+
+    def write(self, chunk):
+        for name, f in self.files.items():
+            f.write(np.ascontiguousarray(chunk[name]).tobytes())
+        self.count += len(chunk)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        header = {'count': self.count, 'time_unit': 'us',
+                  'columns': [(name, EXPORT_DTYPE[name].str) for name in EXPORT_DTYPE.names]}
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(header, f)
+
+
+WRITERS = {'txt': _TextWriter, 'npy': _NpyWriter, 'columns': _ColumnWriter}
+
+
+def export_events(chunks, path, fmt='txt', origin=(0, 0), count=None):
+    """
+    流式导出事件块.
+
+    :param chunks: 事件块的可迭代对象 (带 x, y, p, t 字段的结构化数组)
+    :param fmt: 'txt' / 'npy' / 'columns'
+    :param origin: 从 x, y 中减去的原点
+    :param count: 事件总数, fmt='npy' 时必须给出
+    :return: 导出的事件数
+    """
+    if fmt not in WRITERS:
+        raise ValueError('unknown format %s, expected one of %s' % (fmt, ', '.join(FORMATS)))
+    writer = WRITERS[fmt](path, count)
+    total = 0
+    try:
+        for events in chunks:
+            if len(events):
+                writer.write(shift_chunk(events, origin))
+                total += len(events)
+    finally:
+        writer.close()
+    return total
+
+
+def load_columns(path):
+    """读取 columns 格式, 返回 {列名: np.memmap}"""
+    with open(os.path.join(path, 'meta.json')) as f:
+        header = json.load(f)
+    count = header['count']
+    return {name: np.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r', shape=(count,))
+            if count else np.empty(0, dtype=dtype) for name, dtype in header['columns']}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export the CD events of an EVT 3.0 event.raw.')
+    parser.add_argument('raw', help='event.raw')
+    parser.add_argument('out', help='output .txt / .npy file or columns directory')
+    parser.add_argument('--format', choices=('txt', 'columns'), default='txt')
+    parser.add_argument('--origin', type=int, nargs=2, default=(0, 0), metavar=('X0', 'Y0'),
+                        help='subtracted from x and y, e.g. the ROI corner')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    from lib.event_slices import iter_raw_chunks
+
+    args = parse_args()
+    n = export_events(iter_raw_chunks(args.raw), args.out, args.format, tuple(args.origin))
+    print('exported %d events to %s' % (n, os.path.abspath(args.out)))
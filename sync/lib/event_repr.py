@@ -0,0 +1,215 @@
+"""
+事件表示: 计数图 (可分时间片, 分极性), 双线性时间插值的体素网格 (voxel grid), 时间面 (time surface).
+
+每个构建器对应一个时间窗口 [t0, t1), 可以多次 add() 事件块 (窗口外的事件忽略), 最后 result(out=...)
+写入调用者提供的缓冲区. 累加统一用一个展平下标: 事件多时 np.bincount, 事件稀疏时排序后
+np.add.reduceat (时间面用 np.maximum.reduceat). 内部累加器只分配一次, reset() 后复用,
+成批生成训练张量时不会反复分配整幅数组.
+"""
+import numpy as np
+
+
+class _Builder:
+    """
+    :param width, height: 输出尺寸
+    :param origin: 事件坐标原点 (x0, y0), 例如硬件裁剪的左上角
+    :param dtype: result() 默认输出类型, np.float16 或 np.float32
+    """
+
+    def __init__(self, width, height, origin=(0, 0), dtype=np.float32):
+        self.width = width
+        self.height = height
+        self.origin = origin
+        self.dtype = dtype
+        self.t0 = 0
+        self.t1 = 0
+
+    def reset(self, t0, t1):
+        """开始新的窗口 [t0, t1) us"""
+        self.t0 = int(t0)
+        self.t1 = int(t1)
+
+    def _select(self, events):
+        """窗口内且在图像内的事件, 返回 (像素下标, t, p)"""
+        t = events['t']
+        if len(t) and t[0] >= self.t0 and t[-1] < self.t1:
+            keep = None
+        else:
+            keep = (t >= self.t0) & (t < self.t1)
+        x = events['x'].astype(np.int64) - self.origin[0]
+        y = events['y'].astype(np.int64) - self.origin[1]
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        keep = inside if keep is None else keep & inside
+        if not keep.all():
+            x, y, t = x[keep], y[keep], t[keep]
+            p = events['p'][keep]
+        else:
+            p = events['p']
+        y *= self.width
+        y += x
+        return y, t, p
+
+    @staticmethod
+    def _accumulate(target, index, weights=None):
+        """
+        target[index] += weights (重复下标累加). 事件远少于像素时按下标排序后 np.add.reduceat,
+        只触及有事件的像素; 否则 np.bincount 整幅累加.
+        """
+        if not len(index):
+            return
+        if len(index) * 64 < target.size:
+            order = np.argsort(index, kind='stable')
+            index = index[order]
+            starts = np.concatenate(([0], np.flatnonzero(index[1:] != index[:-1]) + 1))
+            if weights is None:
+                sums = np.diff(np.append(starts, len(index)))
+            else:
+                sums = np.add.reduceat(weights[order], starts)
+            target[index[starts]] += sums.astype(target.dtype, copy=False)
+        else:
+            counts = np.bincount(index, weights=weights, minlength=target.size)
+            target += counts[:target.size].astype(target.dtype, copy=False)
+
+    def _output(self, values, out):
+        if out is None:
+            out = np.empty(values.shape, dtype=self.dtype)
+        if out.dtype == np.float16 and values.dtype != np.float32:
+            # 整数直接转 float16 比经 float32 慢
+            values = values.astype(np.float32)
+        np.copyto(out, values, casting='unsafe')
+        return out
+
+
+class CountImage(_Builder):
+    """
+    事件计数, 形状 (bins, 2, H, W) (分极性) 或 (bins, H, W); bins=1 即普通计数图.
+    e_refocus 里的 pos/neg 时间片张量就是 bins=time_step 的情况.
+    """
+
+    def __init__(self, width, height, bins=1, polarity=True, origin=(0, 0), dtype=np.float32):
+        super().__init__(width, height, origin, dtype)
+        self.bins = bins
+        self.polarity = polarity
+        channels = 2 if polarity else 1
+        self.shape = (bins, channels, height, width) if polarity else (bins, height, width)
+        self.counts = np.zeros(bins * channels * height * width, dtype=np.int32)
+
+    def reset(self, t0, t1):
+        super().reset(t0, t1)
+        self.counts.fill(0)
+
+    def add(self, events):
+        index, t, p = self._select(events)
+        plane = self.height * self.width
+        if self.polarity:
+            index += p.astype(np.int64) * plane
+            plane *= 2
+        if self.bins > 1:
+            b = ((t - self.t0) * self.bins) // max(self.t1 - self.t0, 1)
+            index += b * plane
+        self._accumulate(self.counts, index)
+
+    def result(self, out=None):
+        return self._output(self.counts.reshape(self.shape), out)
+
+
+class VoxelGrid(_Builder):
+    """
+    体素网格 (bins, H, W): 每个事件以极性 +1/-1 按归一化时间 (bins - 1)(t - t0)/(t1 - t0)
+    双线性地分到相邻两个时间片.
+    """
+
+    def __init__(self, width, height, bins=5, origin=(0, 0), dtype=np.float32):
+        super().__init__(width, height, origin, dtype)
+        self.bins = bins
+        self.shape = (bins, height, width)
+        self.grid = np.zeros(bins * height * width, dtype=np.float32)
+
+    def reset(self, t0, t1):
+        super().reset(t0, t1)
+        self.grid.fill(0)
+
+    def add(self, events):
+        index, t, p = self._select(events)
+        if not len(index):
+            return
+        plane = self.height * self.width
+        tn = (t - self.t0).astype(np.float32)
+        tn *= np.float32((self.bins - 1) / max(self.t1 - self.t0, 1))
+        lower = tn.astype(np.int64)
+        upper_weight = tn - lower
+        value = p.astype(np.float32) * 2 - 1
+        # 下面的时间片权重 1 - w, 上面的 w (最后一片之外的部分丢弃)
+        upper_weight *= value
+        value -= upper_weight
+        index += lower * plane
+        self._accumulate(self.grid, index, value)
+        # 落在最后一片之后的上邻居权重为 0, 丢弃
+        upper = index < self.grid.size - plane
+        index += plane
+        self._accumulate(self.grid, index[upper], upper_weight[upper])
+
+    def result(self, out=None):
+        return self._output(self.grid.reshape(self.shape), out)
+
+
+class TimeSurface(_Builder):
+    """
+    时间面 (2, H, W) 或 (H, W): exp(-(t_ref - 该像素最近事件时间) / tau), 没有事件的像素为 0.
+    每块事件按像素排序后用 np.maximum.reduceat 求每个像素的最近时间.
+
+    :param tau: 衰减时间 us
+    """
+
+    EMPTY = np.iinfo(np.int64).min
+
+    def __init__(self, width, height, tau=50000, polarity=True, origin=(0, 0), dtype=np.float32):
+        super().__init__(width, height, origin, dtype)
+        self.tau = float(tau)
+        self.polarity = polarity
+        self.shape = (2, height, width) if polarity else (height, width)
+        self.last = np.full(int(np.prod(self.shape)), self.EMPTY, dtype=np.int64)
+        self.surface = np.empty(self.last.size, dtype=np.float32)
+
+    def reset(self, t0, t1):
+        super().reset(t0, t1)
+        self.last.fill(self.EMPTY)
+
+    def add(self, events):
+        index, t, p = self._select(events)
+        if not len(index):
+            return
+        if self.polarity:
+            index += p.astype(np.int64) * (self.height * self.width)
+        order = np.argsort(index, kind='stable')
+        index = index[order]
+        starts = np.concatenate(([0], np.flatnonzero(index[1:] != index[:-1]) + 1))
+        latest = np.maximum.reduceat(t[order], starts)
+        pixels = index[starts]
+        self.last[pixels] = np.maximum(self.last[pixels], latest)
+
+    def result(self, out=None, t_ref=None):
+        """t_ref 默认为窗口结束时间 t1"""
+        t_ref = self.t1 if t_ref is None else t_ref
+        seen = self.last != self.EMPTY
+        self.surface.fill(0)
+        age = (t_ref - self.last[seen]).astype(np.float32)
+        self.surface[seen] = np.exp(age * np.float32(-1.0 / self.tau))
+        return self._output(self.surface.reshape(self.shape), out)
+
+
+def build_windows(chunks, starts, ends, builder, out):
+    """
+    用 event_slices.slice_events 切窗口, 每个窗口的结果写入 out[k].
+
+    :param builder: CountImage / VoxelGrid / TimeSurface
+    :param out: 形状为 (窗口数,) + builder.shape 的数组, 可以是 np.memmap
+    :return: out
+    """
+    from lib.event_slices import slice_events
+
+    for k, events in slice_events(chunks, starts, ends):
+        builder.reset(starts[k], ends[k])
+        builder.add(events)
+        builder.result(out=out[k])
+    return out
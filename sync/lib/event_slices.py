@@ -0,0 +1,139 @@
+"""
+按 FLIR 帧切分事件: 每帧一个窗口, 顺序扫描一遍 RAW, 逐帧产出窗口内的事件.
+
+窗口为 [触发, 触发 + 曝光时间) 或 [触发, 下一个触发), 时间与 event/TimeStamps.txt 一致 (us).
+事件按块到达, 每块用 np.searchsorted 找到窗口边界; 只保留还未结束的窗口需要的事件,
+内存不超过一块加一个窗口.
+"""
+import os
+import argparse
+import numpy as np
+
+from lib.frame_meta import META_DIR, FrameMeta
+from lib.raw_triggers import read_header, is_evt3
+from lib.raw_index import EVT3Decoder, EVENT_DTYPE
+
+
+def iter_raw_chunks(raw_path, chunk_words=1 << 20, do_time_shifting=True):
+    """顺序解码 EVT 3.0 RAW, 每次产出一块 CD 事件 (EVENT_DTYPE)"""
+    with open(raw_path, 'rb') as f:
+        header, offset = read_header(f)
+        if not is_evt3(header):
+            raise ValueError('%s is not EVT 3.0 (header %s)' % (raw_path, header))
+        f.seek(offset)
+        # time shifting 以第一个 TIME_HIGH 为 0
+        decoder = EVT3Decoder(None if do_time_shifting else 0)
+        buffer = np.empty(chunk_words, dtype=np.uint16)
+        while True:
+            n = f.readinto(memoryview(buffer).cast('B')) // 2
+            if n == 0:
+                break
+            yield decoder.decode(buffer[:n])
+
+
+def slice_events(chunks, starts, ends):
+    """
+    把按时间排序的事件块切成窗口.
+
+    :param chunks: 事件块的可迭代对象, 每块是带 't' 字段的结构化数组 (iter_raw_chunks 或 EventsIterator)
+    :param starts: 每个窗口的开始时间 us, 递增
+    :param ends: 每个窗口的结束时间 us (不含)
+    :return: 生成器, 依次产出 (窗口序号, 事件数组的拷贝)
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    k = 0
+    carry = None
+    for chunk in chunks:
+        if k >= len(starts):
+            break
+        events = chunk if carry is None or not len(carry) else np.concatenate((carry, chunk))
+        if not len(events):
+            continue
+        # 结构化数组的字段不连续, searchsorted 每次都会复制; 每块只转换一次
+        t = np.ascontiguousarray(events['t'])
+        # 最后一个事件已经超过窗口结束时间, 窗口完整
+        while k < len(starts) and t[-1] >= ends[k]:
+            i0, i1 = np.searchsorted(t, (starts[k], ends[k]), side='left')
+            yield k, events[i0:i1].copy()
+            k += 1
+        if k < len(starts):
+            # 只保留下一个 (可能重叠的) 窗口开始之后的事件
+            carry = events[np.searchsorted(t, starts[k], side='left'):]
+            if carry.base is not None:
+                carry = carry.copy()
+    # 数据结束, 剩下的窗口用已有的事件
+    while k < len(starts):
+        if carry is not None and len(carry):
+            i0, i1 = np.searchsorted(carry['t'], (starts[k], ends[k]), side='left')
+            yield k, carry[i0:i1].copy()
+        else:
+            yield k, np.empty(0, dtype=EVENT_DTYPE)
+        k += 1
+
+
+def trigger_windows(trigger_ts, exposures=None, period=None):
+    """
+    由触发时间生成窗口.
+
+    :param exposures: 每帧曝光时间 us (chunk ExposureTime); 为空时窗口到下一个触发为止
+    :param period: 最后一个触发的窗口长度, 默认取触发间隔的中位数
+    :return: (starts, ends)
+    """
+    starts = np.asarray(trigger_ts, dtype=np.int64)
+    if exposures is not None:
+        return starts, starts + np.round(np.asarray(exposures, dtype=np.float64)).astype(np.int64)
+    ends = np.empty_like(starts)
+    ends[:-1] = starts[1:]
+    if len(starts):
+        if period is None:
+            period = int(np.median(np.diff(starts))) if len(starts) > 1 else 0
+        ends[-1] = starts[-1] + period
+    return starts, ends
+
+
+def session_windows(path, use_exposure=True):
+    """
+    由 meta/frame_trigger_map.npy 生成每帧的窗口, 只包含既有图像又有触发的帧.
+
+    :return: (触发序号 ordinal, starts, ends)
+    """
+    table = np.load(os.path.join(path, META_DIR, 'frame_trigger_map.npy'))
+    with_trigger = table[table['trigger_index'] >= 0]
+    starts, ends = trigger_windows(with_trigger['trigger_ts'])
+    matched = with_trigger['row'] >= 0
+    if use_exposure:
+        meta = FrameMeta(path)
+        exposures = np.asarray(meta['exposure'])[with_trigger['row'][matched]]
+        ends = ends.copy()
+        ends[matched] = starts[matched] + np.round(exposures).astype(np.int64)
+    return with_trigger['ordinal'][matched], starts[matched], ends[matched]
+
+
+def export_slices(raw_path, cam_path, out_dir, use_exposure=True):
+    """把每帧的事件写成 out_dir/<ordinal>.npy"""
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    ordinals, starts, ends = session_windows(cam_path, use_exposure)
+    counts = np.zeros(len(ordinals), dtype=np.int64)
+    for k, events in slice_events(iter_raw_chunks(raw_path), starts, ends):
+        np.save(os.path.join(out_dir, '%d.npy' % ordinals[k]), events)
+        counts[k] = len(events)
+    print('%d frames sliced, %d events (min %d, max %d per frame)'
+          % (len(counts), counts.sum(), counts.min() if len(counts) else 0, counts.max() if len(counts) else 0))
+    return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Cut event.raw into per-frame event windows.')
+    parser.add_argument('raw', help='event/event.raw')
+    parser.add_argument('cam_path', help='FLIR camera directory with meta/frame_trigger_map.npy')
+    parser.add_argument('--out', default=None, help='output directory, default <raw dir>/slices')
+    parser.add_argument('--interval', action='store_true', help='window to the next trigger instead of the exposure')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    out = args.out or os.path.join(os.path.dirname(os.path.abspath(args.raw)), 'slices')
+    export_slices(args.raw, args.cam_path, out, use_exposure=not args.interval)
@@ -0,0 +1,217 @@
+"""
+EVK4 (Prophesee) 事件相机的打开、录制和触发提取, 供常驻/多相机采集脚本共用.
+"""
+import os
+import sys
+import time
+import threading
+import numpy as np
+sys.path.append("/home/nvidia/openeb/sdk/modules/core/python/pypkg")
+sys.path.append("/home/nvidia/openeb/build/py3")
+
+from metavision_core.event_io.raw_reader import RawReader
+from metavision_core.event_io import EventsIterator
+from metavision_hal import I_TriggerIn
+from metavision_core.event_io.raw_reader import initiate_device
+
+from lib.raw_triggers import scan_triggers
+from lib.raw_index import IndexBuilder
+
+# 硬件裁剪 (x0, y0, x1, y1)
+ROI = (340, 60, 939, 659)
+POLL_INTERVAL = 0.05  # s, 低 CPU 录制时两次取数据的间隔
+
+
+class RawLogPump:
+    """
+    不解码的 RAW 录制: 直接从 I_EventsStream 取原始缓冲区 (log_raw_data 在取数据时写盘),
+    每 poll_interval 秒醒来一次取空所有就绪的缓冲区, 其余时间阻塞在 Event.wait 上.
+
+    :param poll_interval: 轮询间隔 s, 越大 CPU 越低, 但要保证驱动缓冲区在间隔内不会溢出
+    :param on_data: 可选回调 on_data(buffer), 每个取到的原始缓冲区调用一次 (例如 IndexBuilder.feed)
+    """
+
+    def __init__(self, ieventstream, poll_interval=POLL_INTERVAL, on_data=None):
+        self.ieventstream = ieventstream
+        self.poll_interval = poll_interval
+        self.on_data = on_data
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.error = None
+        self.callback_error = None
+
+        self.polls = 0
+        self.buffers = 0
+        self.bytes = 0
+        self.max_buffers_per_poll = 0   # 一次轮询取出的最多缓冲区数, 接近驱动缓冲区数时说明间隔太长
+        self.max_bytes_per_poll = 0
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+
+    def start(self, should_stop=None):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, args=(should_stop,), daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self, should_stop=None):
+        """阻塞直到 stop() 或 should_stop() 为真"""
+        cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        self.ieventstream.start()
+        try:
+            while True:
+                stopping = self.stop_event.wait(self.poll_interval) or (should_stop is not None and should_stop())
+                # 停止前最后再取空一次
+                self._drain()
+                if stopping:
+                    break
+        except Exception as ex:
+            self.error = ex
+            print('Error: %s' % ex)
+        finally:
+            self.ieventstream.stop()
+            self.cpu_time = time.thread_time() - cpu_start
+            self.wall_time = time.perf_counter() - wall_start
+
+    def _drain(self):
+        self.polls += 1
+        buffers = size = 0
+        while self.ieventstream.poll_buffer() > 0:
+            data = self.ieventstream.get_latest_raw_data()
+            if self.on_data is not None:
+                try:
+                    self.on_data(data)
+                except Exception as ex:
+                    # 回调 (例如建索引) 出错只关掉回调, 不能停掉录制
+                    print('Error: on_data disabled: %s' % ex)
+                    self.on_data = None
+                    self.callback_error = ex
+            buffers += 1
+            size += len(data)
+        self.buffers += buffers
+        self.bytes += size
+        self.max_buffers_per_poll = max(self.max_buffers_per_poll, buffers)
+        self.max_bytes_per_poll = max(self.max_bytes_per_poll, size)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def stats(self):
+        wall = max(self.wall_time, 1e-9)
+        return {'poll_interval': self.poll_interval, 'polls': self.polls, 'buffers': self.buffers,
+                'bytes': self.bytes, 'MB/s': self.bytes / wall / 1e6,
+                'max_buffers_per_poll': self.max_buffers_per_poll, 'max_bytes_per_poll': self.max_bytes_per_poll,
+                'cpu_s': self.cpu_time, 'cpu_percent': 100.0 * self.cpu_time / wall}
+
+    def summary(self):
+        st = self.stats()
+        return ('event raw log: %.1f MB at %.1f MB/s, %d polls, max %d buffers (%.1f MB) per poll, cpu %.1f%%'
+                % (st['bytes'] / 1e6, st['MB/s'], st['polls'], st['max_buffers_per_poll'],
+                   st['max_bytes_per_poll'] / 1e6, st['cpu_percent']))
+
+
+class EventCamera:
+    """保持 EVK4 打开, 每次录制只切换 log_raw_data"""
+
+    def __init__(self, roi=ROI, serial='', low_cpu=True, poll_interval=POLL_INTERVAL, index=False):
+        self.roi = roi
+        self.serial = serial
+        self.low_cpu = low_cpu              # True 用 RawLogPump, False 用 EventsIterator 解码后丢弃
+        self.poll_interval = poll_interval
+        self.index = index                  # True 时录制中同时建立时间索引 event.raw.tidx.npz (需 low_cpu),
+                                            # 默认由 IndexedRaw 第一次读取时离线建立
+        self.pump = None
+        self.indexer = None
+        self.device = None
+        self.ieventstream = None
+        self.outputpath = None
+        self.thread = None
+        self.stop_flag = False
+
+    def open(self):
+        self.device = initiate_device(path=self.serial)
+        if not self.device:
+            print("Could not open camera. Make sure you have an event-based device plugged in")
+            return False
+        # set trigger
+        triggerin = self.device.get_i_trigger_in()
+        triggerin.enable(I_TriggerIn.Channel(0))
+        # 访问事件流功能
+        self.ieventstream = self.device.get_i_events_stream()
+        # 裁剪图像 硬件裁剪
+        digital_crop = self.device.get_i_digital_crop()
+        digital_crop.set_window_region(self.roi, False)
+        digital_crop.enable(True)
+        return True
+
+    def start_recording(self, outputpath):
+        """在后台线程中录制到 outputpath, 直到 stop_recording"""
+        if not self.ieventstream:
+            print("no events stream")
+            return False
+        self.outputpath = outputpath
+        self.stop_flag = False
+        self.ieventstream.log_raw_data(outputpath)
+        self.pump = None
+        self.indexer = IndexBuilder() if self.low_cpu and self.index else None
+        if self.low_cpu:
+            on_data = self.indexer.feed if self.indexer is not None else None
+            self.pump = RawLogPump(self.ieventstream, self.poll_interval, on_data).start()
+            return True
+        self.thread = threading.Thread(target=self._pump, daemon=True)
+        self.thread.start()
+        return True
+
+    def _pump(self):
+        mv_iterator = EventsIterator.from_device(device=self.device, max_duration=1200000000)
+        for evs in mv_iterator:
+            if self.stop_flag:
+                break
+
+    def stop_recording(self):
+        self.stop_flag = True
+        if self.pump is not None:
+            self.pump.stop()
+            print(self.pump.summary())
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.ieventstream.stop_log_raw_data()
+        # 索引回调出过错时索引不完整, 不保存 (IndexedRaw 会离线重建)
+        if self.indexer is not None and self.pump.callback_error is None:
+            self.indexer.save(self.outputpath)
+        self.indexer = None
+        print("event stop recording")
+
+    def close(self):
+        if self.thread is not None or (self.pump is not None and self.pump.thread is not None):
+            self.stop_recording()
+        self.ieventstream = None
+        self.device = None
+
+
+def extract_triggers(raw_path, polarity=0, do_time_shifting=True):
+    """
+    读出 RAW 文件中的外部触发, polarity 为 0/1 时只保留该极性 (1 is neg, 0 is pos).
+    EVT 3.0 文件只扫描时间字和触发字, 其他格式退回到 RawReader 完整解码.
+    """
+    try:
+        return scan_triggers(str(raw_path), polarity=polarity, do_time_shifting=do_time_shifting)
+    except ValueError as ex:
+        print('%s, decoding with RawReader' % ex)
+    with RawReader(str(raw_path), do_time_shifting=do_time_shifting) as ev_data:
+        while not ev_data.is_done():
+            ev_data.load_n_events(1000000)
+        triggers = ev_data.get_ext_trigger_events()
+    if polarity in (0, 1):
+        triggers = triggers[triggers['p'] == polarity]
+    return triggers.copy()
+
+
+def save_trigger_timestamps(path, trigger_time):
+    """写 event/TimeStamps.txt, 每行一个触发时间 (us)"""
+    np.savetxt(os.path.join(path, 'event', 'TimeStamps.txt'), np.asarray(trigger_time, dtype=np.int64), fmt='%d')
@@ -0,0 +1,118 @@
+"""
+基于 FrameID 的帧计数: 每帧放到它真实的触发序号上, 缺失的帧显式记录为空缺,
+并生成 FLIR 帧 <-> EVK4 触发的对应表.
+"""
+import os
+import numpy as np
+
+from lib.frame_meta import META_DIR, FrameMeta
+
+MAP_DTYPE = np.dtype([
+    ('ordinal', np.int64),        # FLIR 触发序号 (FrameID - 第一帧 FrameID)
+    ('row', np.int64),            # 帧元数据中的行号, -1 表示该帧缺失
+    ('frame_id', np.int64),
+    ('timestamp', np.uint64),     # chunk 时间戳 ns
+    ('trigger_index', np.int64),  # 对应的 EVK4 触发序号, -1 表示没有
+    ('trigger_ts', np.int64),     # EVK4 触发时间 us
+])
+
+
+class FrameAccounting:
+    """采集线程中按 FrameID 给每帧分配触发序号"""
+
+    def __init__(self):
+        self.first_id = None
+        self.next_ordinal = 0
+        self.gaps = []          # (起始序号, 缺失个数)
+        self.missing_count = 0
+        self.out_of_order = 0
+
+    def assign(self, frame_id):
+        """返回该帧的触发序号, FrameID 回退 (乱序或计数器复位) 时返回 -1"""
+        if self.first_id is None:
+            self.first_id = frame_id
+        ordinal = frame_id - self.first_id
+        if ordinal < self.next_ordinal:
+            self.out_of_order += 1
+            return -1
+        if ordinal > self.next_ordinal:
+            missing = ordinal - self.next_ordinal
+            self.gaps.append((self.next_ordinal, missing))
+            self.missing_count += missing
+            print('Missing %d frame(s) at ordinal %d' % (missing, self.next_ordinal))
+        self.next_ordinal = ordinal + 1
+        return ordinal
+
+    def finish(self, num_ordinals):
+        """采集结束, 末尾没有到达的序号记为空缺"""
+        if self.next_ordinal < num_ordinals:
+            missing = num_ordinals - self.next_ordinal
+            self.gaps.append((self.next_ordinal, missing))
+            self.missing_count += missing
+            print('Missing %d frame(s) at ordinal %d (end of capture)' % (missing, self.next_ordinal))
+            self.next_ordinal = num_ordinals
+
+    def summary(self):
+        return 'ordinals 0-%d, %d missing in %d gap(s), %d out of order' % (
+            self.next_ordinal - 1, self.missing_count, len(self.gaps), self.out_of_order)
+
+
+def build_trigger_map(meta, trigger_ts, trigger_offset=0, num_ordinals=None):
+    """
+    生成帧 <-> 触发对应表, 每个触发序号一行.
+
+    :param meta: FrameMeta, frame_index 列为触发序号
+    :param trigger_ts: EVK4 触发时间 (us), 按时间顺序
+    :param trigger_offset: FLIR 序号 = 触发序号 + trigger_offset (EVK4 丢了开头的触发时为正)
+    :param num_ordinals: 表的行数, 默认取帧和触发中较大的序号
+    :return: MAP_DTYPE 结构化数组
+    """
+    trigger_ts = np.asarray(trigger_ts, dtype=np.int64)
+    rows = meta.complete()
+    ordinals = np.asarray(meta['frame_index'][rows], dtype=np.int64)
+    keep = ordinals >= 0
+    rows, ordinals = rows[keep], ordinals[keep]
+    if num_ordinals is None:
+        num_ordinals = max(int(ordinals.max()) + 1 if len(ordinals) else 0, len(trigger_ts) + trigger_offset)
+
+    table = np.zeros(num_ordinals, dtype=MAP_DTYPE)
+    table['ordinal'] = np.arange(num_ordinals)
+    table['row'] = -1
+    table['frame_id'] = -1
+    table['trigger_index'] = -1
+    table['trigger_ts'] = -1
+
+    inside = ordinals < num_ordinals
+    rows, ordinals = rows[inside], ordinals[inside]
+    table['row'][ordinals] = rows
+    table['frame_id'][ordinals] = meta['frame_id'][rows]
+    table['timestamp'][ordinals] = meta['timestamp'][rows]
+
+    trigger_index = table['ordinal'] - trigger_offset
+    valid = (trigger_index >= 0) & (trigger_index < len(trigger_ts))
+    table['trigger_index'][valid] = trigger_index[valid]
+    table['trigger_ts'][valid] = trigger_ts[trigger_index[valid]]
+    return table
+
+
+def save_trigger_map(path, table):
+    """保存为 meta/frame_trigger_map.npy 和同名 txt"""
+    meta_path = os.path.join(path, META_DIR)
+    np.save(os.path.join(meta_path, 'frame_trigger_map.npy'), table)
+    np.savetxt(os.path.join(meta_path, 'frame_trigger_map.txt'),
+               np.column_stack([table[name].astype(np.int64) for name in MAP_DTYPE.names]),
+               fmt='%d', header=' '.join(MAP_DTYPE.names))
+    missing = np.flatnonzero(table['row'] < 0)
+    print('frame/trigger map: %d ordinals, %d frames missing, %d without trigger'
+          % (len(table), len(missing), int(np.sum(table['trigger_index'] < 0))))
+    return missing
+
+
+def map_triggers(path, trigger_ts, trigger_offset=0, num_ordinals=None):
+    """按触发序号把触发时间回填到 path 下的帧元数据, 并保存对应表"""
+    meta = FrameMeta(path, mode='r+')
+    table = build_trigger_map(meta, trigger_ts, trigger_offset, num_ordinals)
+    matched = (table['row'] >= 0) & (table['trigger_index'] >= 0)
+    meta.set_triggers(table['trigger_ts'][matched], rows=table['row'][matched])
+    save_trigger_map(path, table)
+    return table
@@ -0,0 +1,289 @@
+"""
+无损压缩帧文件: 每帧按行切成若干块, 在线程池中并行压缩后顺序写盘.
+
+文件布局:
+    frames.cfz      [64 字节文件头][压缩块 ...]
+    frames.cfz.idx  每个块一项 (frame, offset, size, row), 每帧写完后追加
+每块独立压缩, 读单帧时只解压该帧的块. zlib 总是可用,
+安装了 lz4 / zstandard 时也可以选 'lz4' / 'zstd'.
+"""
+import os
+import glob
+import time
+import zlib
+import struct
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from lib.frame_container import FrameContainer, RAW_HEADER_SIZE
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'FRMZ'
+VERSION = 1
+HEADER_FORMAT = '<4sIIIiiII16s8sI4x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)  # 64
+CHUNK_DTYPE = np.dtype([('frame', '<i8'), ('offset', '<u8'), ('size', '<u4'), ('row', '<u4')])
+
+_DTYPES = {1: np.uint8, 2: np.uint16}
+
+
+def _zlib_codec(level):
+    return (lambda data: zlib.compress(data, level)), zlib.decompress
+
+
+def _lz4_codec(level):
+    return (lambda data: lz4.frame.compress(data, compression_level=level)), lz4.frame.decompress
+
+
+def _zstd_codec(level):
+    # ZstdCompressor 不是线程安全的, 每次压缩新建一个 (开销很小)
+    return (lambda data: zstandard.ZstdCompressor(level=level).compress(data)), \
+        (lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+
+# 名称 -> (构造函数, 默认等级)
+CODECS = {'zlib': (_zlib_codec, 1)}
+if lz4 is not None:
+    CODECS['lz4'] = (_lz4_codec, 0)
+if zstandard is not None:
+    CODECS['zstd'] = (_zstd_codec, 1)
+
+
+def get_codec(name, level=None):
+    """返回 (compress, decompress)"""
+    if name not in CODECS:
+        raise ValueError('codec %s not available, choose from %s' % (name, ', '.join(CODECS)))
+    factory, default_level = CODECS[name]
+    return factory(default_level if level is None else level)
+
+
+class CompressedFrameWriter:
+    """顺序追加帧, 块在 num_workers 个线程中压缩 (zlib/lz4/zstd 压缩时释放 GIL)"""
+
+    def __init__(self, path, height, width, roi=(0, 0), pixel_format='BayerRG8', dtype=np.uint8,
+                 channels=1, codec='zlib', level=None, chunk_rows=125, num_workers=4):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.frame_shape = (height, width) if channels == 1 else (height, width, channels)
+        self.frame_bytes = height * width * channels * self.dtype.itemsize
+        self.chunk_rows = min(chunk_rows, height)
+        self.rows = list(range(0, height, self.chunk_rows))
+        self.compress, _ = get_codec(codec, level)
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.count = 0
+
+        self.f = open(path, 'wb')
+        self.f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, height, width, roi[0], roi[1],
+                                 self.dtype.itemsize, channels, pixel_format.encode()[:16],
+                                 codec.encode()[:8], self.chunk_rows))
+        self.offset = HEADER_SIZE
+        self.index_file = open(path + '.idx', 'wb')
+
+        # 统计信息
+        self.raw_bytes = 0
+        self.index_bytes = 0
+        self.stored_bytes = HEADER_SIZE
+        self.compress_time = 0.0
+        self.start = None
+
+    def append(self, frame, frame_number=None):
+        """压缩并写入一帧, 返回后 frame 可以被复用"""
+        if self.start is None:
+            self.start = time.perf_counter()
+        frame = np.ascontiguousarray(frame, dtype=self.dtype)
+        if frame.nbytes != self.frame_bytes:
+            raise ValueError('frame size %d does not match file (%d)' % (frame.nbytes, self.frame_bytes))
+        if frame_number is None:
+            frame_number = self.count
+
+        t0 = time.perf_counter()
+        blocks = list(self.executor.map(self.compress, [frame[r:r + self.chunk_rows] for r in self.rows]))
+        self.compress_time += time.perf_counter() - t0
+
+        index = np.empty(len(blocks), dtype=CHUNK_DTYPE)
+        index['frame'] = frame_number
+        index['row'] = self.rows
+        for k, block in enumerate(blocks):
+            index['offset'][k] = self.offset
+            index['size'][k] = len(block)
+            self.f.write(block)
+            self.offset += len(block)
+        self.f.flush()
+        # 先写数据再写索引, 采集中断时索引里的帧都是完整的
+        self.index_file.write(index.tobytes())
+        self.index_file.flush()
+
+        self.raw_bytes += self.frame_bytes
+        self.index_bytes += index.nbytes
+        self.stored_bytes = self.offset + self.index_bytes
+        self.count += 1
+        return self.count - 1
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.start if self.start is not None else 0.0
+        return {'frames': self.count, 'raw_bytes': self.raw_bytes, 'stored_bytes': self.stored_bytes,
+                'ratio': self.raw_bytes / self.stored_bytes if self.stored_bytes else 0.0,
+                'elapsed': elapsed, 'compress_time': self.compress_time,
+                'stored_mb_s': self.stored_bytes / elapsed / 1e6 if elapsed > 0 else 0.0,
+                'raw_mb_s': self.raw_bytes / elapsed / 1e6 if elapsed > 0 else 0.0}
+
+    def close(self):
+        if self.f is not None:
+            self.executor.shutdown()
+            self.f.close()
+            self.index_file.close()
+            self.f = None
+        return self.stats()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CompressedFrames:
+    """只读打开压缩帧文件, 按需解压单帧"""
+
+    def __init__(self, path, num_workers=1):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = struct.unpack(HEADER_FORMAT, f.read(HEADER_SIZE))
+        (magic, version, self.height, self.width, self.offset_x, self.offset_y,
+         itemsize, self.channels, pixel_format, codec, self.chunk_rows) = header
+        if magic != MAGIC:
+            raise ValueError('%s is not a compressed frame file' % path)
+        self.pixel_format = pixel_format.rstrip(b'\0').decode()
+        self.codec = codec.rstrip(b'\0').decode()
+        self.dtype = np.dtype(_DTYPES[itemsize])
+        self.frame_shape = (self.height, self.width) if self.channels == 1 else (self.height, self.width, self.channels)
+        _, self.decompress = get_codec(self.codec)
+
+        self.chunks_per_frame = -(-self.height // self.chunk_rows)
+        index = np.fromfile(path + '.idx', dtype=CHUNK_DTYPE)
+        self.count = len(index) // self.chunks_per_frame
+        self.index = index[:self.count * self.chunks_per_frame].reshape(self.count, self.chunks_per_frame)
+        self._mm = np.memmap(path, dtype=np.uint8, mode='r')
+        self.executor = ThreadPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+
+    @property
+    def roi(self):
+        return (self.offset_x, self.offset_y, self.width, self.height)
+
+    @property
+    def frame_numbers(self):
+        return self.index[:, 0]['frame']
+
+    def __len__(self):
+        return self.count
+
+    def read_into(self, i, out):
+        """把第 i 帧解压到 out (frame_shape, dtype)"""
+        chunks = self.index[i]
+
+        def decode(chunk):
+            offset, size, row = int(chunk['offset']), int(chunk['size']), int(chunk['row'])
+            data = self.decompress(self._mm[offset:offset + size])
+            rows = min(self.chunk_rows, self.height - row)
+            out[row:row + rows] = np.frombuffer(data, dtype=self.dtype).reshape((rows,) + self.frame_shape[1:])
+
+        if self.executor is None:
+            for chunk in chunks:
+                decode(chunk)
+        else:
+            list(self.executor.map(decode, chunks))
+        return out
+
+    def __getitem__(self, i):
+        return self.read_into(i, np.empty(self.frame_shape, dtype=self.dtype))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+
+class CompressedSink:
+    """FramePool 的写盘回调, 压缩后写入 frames.cfz"""
+
+    def __init__(self, path, roi, filename='frames.cfz', pixel_format='BayerRG8', dtype=np.uint8,
+                 codec='zlib', level=None, chunk_rows=125, num_workers=4):
+        offset_x, offset_y, width, height = roi
+        self.path = path
+        self.writer = CompressedFrameWriter(os.path.join(path, filename), height, width,
+                                            roi=(offset_x, offset_y), pixel_format=pixel_format,
+                                            dtype=dtype, codec=codec, level=level,
+                                            chunk_rows=chunk_rows, num_workers=num_workers)
+
+        self.stats = None
+
+    def __call__(self, frame, i):
+        self.writer.append(frame, frame_number=i)
+
+    def close(self):
+        self.stats = self.writer.close()
+        print_stats(self.stats)
+
+
+def print_stats(stats):
+    print('compressed %d frames: %.1f MB -> %.1f MB, ratio %.2f, %.1f MB/s in, %.1f MB/s to disk, '
+          'compress %.2fs of %.2fs'
+          % (stats['frames'], stats['raw_bytes'] / 1e6, stats['stored_bytes'] / 1e6, stats['ratio'],
+             stats['raw_mb_s'], stats['stored_mb_s'], stats['compress_time'], stats['elapsed']))
+
+
+def compress_file(src, dst, codec='zlib', level=None, chunk_rows=125, num_workers=4):
+    """把容器文件 (.frc)、.raw 文件夹或 .npy 图像栈压缩为 .cfz"""
+    if os.path.isdir(src):
+        files = sorted(glob.glob(os.path.join(src, '*.raw')))
+        offset_x, offset_y, width, height = (int(v) for v in np.fromfile(files[0], dtype=np.int32, count=4))
+        roi, frame_numbers = (offset_x, offset_y), [int(os.path.splitext(os.path.basename(f))[0]) for f in files]
+        frames = (np.fromfile(f, dtype=np.uint8, offset=RAW_HEADER_SIZE).reshape(height, width) for f in files)
+        shape, dtype, pixel_format = (height, width), np.uint8, 'BayerRG8'
+    elif src.endswith('.npy'):
+        frames = np.load(src, mmap_mode='r')
+        roi, frame_numbers, shape, dtype, pixel_format = (0, 0), range(len(frames)), frames.shape[1:], frames.dtype, 'BayerRG8'
+    else:
+        frames = FrameContainer(src)
+        roi, frame_numbers = frames.roi[:2], frames.frame_numbers
+        shape, dtype, pixel_format = frames.frame_shape, frames.dtype, frames.pixel_format
+
+    channels = shape[2] if len(shape) == 3 else 1
+    with CompressedFrameWriter(dst, shape[0], shape[1], roi=roi, pixel_format=pixel_format, dtype=dtype,
+                               channels=channels, codec=codec, level=level, chunk_rows=chunk_rows,
+                               num_workers=num_workers) as writer:
+        for frame, frame_number in zip(frames, frame_numbers):
+            writer.append(frame, frame_number=int(frame_number))
+    stats = writer.stats()
+    print_stats(stats)
+    return stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Losslessly compress captured Bayer frames.')
+    parser.add_argument('src', help='frame container (.frc), folder of .raw files or .npy stack')
+    parser.add_argument('dst', help='output .cfz file')
+    parser.add_argument('--codec', default='zlib', choices=sorted(CODECS))
+    parser.add_argument('--level', type=int, default=None)
+    parser.add_argument('--chunk-rows', type=int, default=125)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--verify', action='store_true', help='decompress and compare every frame')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    compress_file(args.src, args.dst, args.codec, args.level, args.chunk_rows, args.workers)
+    if args.verify and not os.path.isdir(args.src) and not args.src.endswith('.npy'):
+        original = FrameContainer(args.src)
+        restored = CompressedFrames(args.dst, num_workers=args.workers)
+        ok = all(np.array_equal(original[i], restored[i]) for i in range(len(original)))
+        print('verify %s' % ('ok' if ok else 'FAILED'))
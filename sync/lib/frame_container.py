@@ -0,0 +1,194 @@
+"""
+单文件帧容器, 代替每帧一个 {i:05d}.raw 文件.
+
+文件布局:
+    [64 字节文件头][capacity 个索引项 (offset uint64, frame int64)][帧数据 ...]
+文件头记录 ROI、像素格式、每像素字节数和通道数, 读取时只解析一次,
+帧通过 np.memmap 视图返回, 不发生拷贝.
+"""
+import os
+import glob
+import struct
+import argparse
+import numpy as np
+
+MAGIC = b'FRMC'
+VERSION = 1
+HEADER_FORMAT = '<4sIIIiiII16sQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)  # 64
+COUNT_OFFSET = HEADER_SIZE - 8
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('frame', '<i8')])
+RAW_HEADER_SIZE = 16  # 旧 .raw 文件头 [OFFSET_X, OFFSET_Y, WIDTH, HEIGHT] int32
+
+_DTYPES = {1: np.uint8, 2: np.uint16}
+
+
+class FrameContainerWriter:
+    """顺序追加帧; preallocate=True 时一次性分配整个文件"""
+
+    def __init__(self, path, height, width, roi=(0, 0), pixel_format='BayerRG8',
+                 dtype=np.uint8, channels=1, capacity=100000, preallocate=False):
+        self.path = path
+        self.height = height
+        self.width = width
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.frame_shape = (height, width) if channels == 1 else (height, width, channels)
+        self.frame_bytes = height * width * channels * self.dtype.itemsize
+        self.data_offset = HEADER_SIZE + capacity * INDEX_DTYPE.itemsize
+        self.count = 0
+
+        self.f = open(path, 'wb+')
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, height, width, roi[0], roi[1],
+                             self.dtype.itemsize, channels, pixel_format.encode()[:16], capacity, 0)
+        self.f.write(header)
+        if preallocate:
+            self.f.truncate(self.data_offset + capacity * self.frame_bytes)
+        else:
+            self.f.truncate(self.data_offset)
+        self.fd = self.f.fileno()
+
+    def append(self, frame, frame_number=None):
+        if self.count >= self.capacity:
+            raise ValueError('frame container is full (capacity %d)' % self.capacity)
+        frame = np.ascontiguousarray(frame, dtype=self.dtype)
+        if frame.nbytes != self.frame_bytes:
+            raise ValueError('frame size %d does not match container (%d)' % (frame.nbytes, self.frame_bytes))
+
+        offset = self.data_offset + self.count * self.frame_bytes
+        if frame_number is None:
+            frame_number = self.count
+        os.pwrite(self.fd, frame.data, offset)
+        entry = np.array([(offset, frame_number)], dtype=INDEX_DTYPE)
+        os.pwrite(self.fd, entry.tobytes(), HEADER_SIZE + self.count * INDEX_DTYPE.itemsize)
+        self.count += 1
+        # 每帧更新帧数, 采集中断时已写入的帧仍然可读
+        os.pwrite(self.fd, struct.pack('<Q', self.count), COUNT_OFFSET)
+        return self.count - 1
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FrameContainer:
+    """只读打开容器, 帧以 np.memmap 视图返回"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = struct.unpack(HEADER_FORMAT, f.read(HEADER_SIZE))
+        (magic, version, self.height, self.width, self.offset_x, self.offset_y,
+         itemsize, self.channels, pixel_format, self.capacity, self.count) = header
+        if magic != MAGIC:
+            raise ValueError('%s is not a frame container' % path)
+        self.pixel_format = pixel_format.rstrip(b'\0').decode()
+        self.dtype = np.dtype(_DTYPES[itemsize])
+        self.frame_shape = (self.height, self.width) if self.channels == 1 else (self.height, self.width, self.channels)
+
+        self._mm = np.memmap(path, dtype=np.uint8, mode='r')
+        self.index = self._mm[HEADER_SIZE:HEADER_SIZE + self.count * INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+        self.frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+
+    @property
+    def roi(self):
+        return (self.offset_x, self.offset_y, self.width, self.height)
+
+    @property
+    def frame_numbers(self):
+        return self.index['frame']
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        offset = int(self.index['offset'][i])
+        return self._mm[offset:offset + self.frame_bytes].view(self.dtype).reshape(self.frame_shape)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def stack(self):
+        """帧连续存放时返回 (N, H, W) 的整体视图"""
+        if self.count == 0:
+            return np.empty((0,) + self.frame_shape, dtype=self.dtype)
+        start = int(self.index['offset'][0])
+        expected = start + np.arange(self.count, dtype=np.uint64) * self.frame_bytes
+        if not np.array_equal(self.index['offset'], expected):
+            raise ValueError('frames are not contiguous')
+        end = start + self.count * self.frame_bytes
+        return self._mm[start:end].view(self.dtype).reshape((self.count,) + self.frame_shape)
+
+
+class ContainerSink:
+    """FramePool 的写盘回调, 写入单文件容器"""
+
+    def __init__(self, path, roi, capacity, filename='frames.frc', pixel_format='BayerRG8',
+                 dtype=np.uint8, preallocate=True):
+        offset_x, offset_y, width, height = roi
+        self.path = path
+        self.writer = FrameContainerWriter(os.path.join(path, filename), height, width,
+                                           roi=(offset_x, offset_y), pixel_format=pixel_format,
+                                           dtype=dtype, capacity=capacity, preallocate=preallocate)
+
+    def __call__(self, frame, i):
+        self.writer.append(frame, frame_number=i)
+
+    def close(self):
+        self.writer.close()
+
+
+def convert_raw_dir(src_dir, dst_path, pixel_format='BayerRG8'):
+    """把 {i:05d}.raw 文件夹转换为一个容器文件, 帧号取自文件名"""
+    files = sorted(glob.glob(os.path.join(src_dir, '*.raw')))
+    if not files:
+        print('no raw files in %s' % src_dir)
+        return 0
+    offset_x, offset_y, width, height = np.fromfile(files[0], dtype=np.int32, count=4)
+    with FrameContainerWriter(dst_path, int(height), int(width), roi=(int(offset_x), int(offset_y)),
+                              pixel_format=pixel_format, capacity=len(files), preallocate=True) as writer:
+        for filename in files:
+            frame = np.fromfile(filename, dtype=np.uint8, offset=RAW_HEADER_SIZE).reshape(height, width)
+            frame_number = int(os.path.splitext(os.path.basename(filename))[0])
+            writer.append(frame, frame_number=frame_number)
+    return len(files)
+
+
+def convert_npy(src_npy, dst_path, roi=(0, 0), pixel_format='BayerRG8'):
+    """把 np.save 保存的 (N, H, W[, C]) 图像栈转换为容器文件"""
+    images = np.load(src_npy, mmap_mode='r')
+    height, width = images.shape[1:3]
+    channels = images.shape[3] if images.ndim == 4 else 1
+    with FrameContainerWriter(dst_path, height, width, roi=roi, pixel_format=pixel_format,
+                              dtype=images.dtype, channels=channels, capacity=len(images),
+                              preallocate=True) as writer:
+        for frame in images:
+            writer.append(frame)
+    return len(images)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert .raw folders or .npy stacks to a frame container.')
+    parser.add_argument('src', help='folder of {i:05d}.raw files or an image .npy stack')
+    parser.add_argument('dst', help='output container file')
+    parser.add_argument('--pixel-format', default='BayerRG8')
+    parser.add_argument('--offset', type=int, nargs=2, default=(0, 0), help='ROI offset for .npy input')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if os.path.isdir(args.src):
+        n = convert_raw_dir(args.src, args.dst, pixel_format=args.pixel_format)
+    else:
+        n = convert_npy(args.src, args.dst, roi=tuple(args.offset), pixel_format=args.pixel_format)
+    print('converted %d frames to %s' % (n, args.dst))
@@ -0,0 +1,129 @@
+"""
+按列存储的每帧元数据, 代替 exposure_times.txt / timestamps.txt.
+
+一个采集目录下的 meta/ 文件夹中每一列一个二进制文件 <name>.bin, 外加 meta.json 记录
+列类型和行数. 采集时按帧追加到内存中的块, 块满后整体写盘; 读取时每列是一个 np.memmap,
+查询全部向量化.
+"""
+import os
+import json
+import numpy as np
+
+COLUMNS = [
+    ('frame_index', np.int64),    # 采集序号
+    ('frame_id', np.int64),       # chunk FrameID
+    ('timestamp', np.uint64),     # chunk 时间戳 ns (相机时钟)
+    ('exposure', np.float64),     # chunk 曝光时间 us
+    ('gain', np.float64),         # chunk 增益 dB
+    ('incomplete', np.uint8),     # 1 表示图像不完整
+    ('dropped', np.uint8),        # 1 表示主机端丢弃 (队列满)
+    ('host_ns', np.int64),        # 主机收到图像的时间 time.time_ns()
+    ('trigger_ts', np.int64),     # 匹配到的 EVK4 触发时间 us, -1 表示没有
+]
+DEFAULTS = {'frame_id': -1, 'trigger_ts': -1}
+META_DIR = 'meta'
+
+
+class FrameMetaWriter:
+    """按帧追加, 每 block_size 行写一次盘"""
+
+    def __init__(self, path, block_size=256, columns=COLUMNS):
+        self.path = os.path.join(path, META_DIR)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.columns = columns
+        self.block_size = block_size
+        self.block = {}
+        for name, dtype in columns:
+            self.block[name] = np.full(block_size, DEFAULTS.get(name, 0), dtype=dtype)
+        self.files = {name: open(os.path.join(self.path, name + '.bin'), 'wb') for name, _ in columns}
+        self.n_block = 0
+        self.count = 0
+
+    def append(self, **values):
+        """追加一行, 没给出的列取默认值"""
+        row = self.n_block
+        for name, value in values.items():
+            self.block[name][row] = value
+        self.n_block += 1
+        self.count += 1
+        if self.n_block == self.block_size:
+            self.flush()
+        return self.count - 1
+
+    def flush(self):
+        if self.n_block == 0:
+            return
+        for name, _ in self.columns:
+            column = self.block[name]
+            self.files[name].write(column[:self.n_block].tobytes())
+            column.fill(DEFAULTS.get(name, 0))
+            self.files[name].flush()
+        self.n_block = 0
+        self._write_header()
+
+    def _write_header(self):
+        header = {'count': self.count,
+                  'columns': [[name, np.dtype(dtype).str] for name, dtype in self.columns]}
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(header, f)
+
+    def close(self):
+        self.flush()
+        self._write_header()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+class FrameMeta:
+    """读取元数据, 每列为 np.memmap; mode='r+' 时可以回填列 (例如触发时间)"""
+
+    def __init__(self, path, mode='r'):
+        self.path = os.path.join(path, META_DIR)
+        with open(os.path.join(self.path, 'meta.json')) as f:
+            header = json.load(f)
+        self.count = header['count']
+        self.columns = {}
+        for name, dtype in header['columns']:
+            filename = os.path.join(self.path, name + '.bin')
+            if self.count == 0:
+                self.columns[name] = np.empty(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(filename, dtype=dtype, mode=mode, shape=(self.count,))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def complete(self):
+        """完整且已保存的帧的行号"""
+        return np.flatnonzero((self.columns['incomplete'] == 0) & (self.columns['dropped'] == 0))
+
+    def between(self, t0, t1, column='timestamp'):
+        """column 落在 [t0, t1) 内的行号"""
+        values = self.columns[column]
+        if len(values) > 1 and np.all(values[1:] >= values[:-1]):
+            start, stop = np.searchsorted(values, [t0, t1], side='left')
+            return np.arange(start, stop)
+        return np.flatnonzero((values >= t0) & (values < t1))
+
+    def set_triggers(self, trigger_ts, rows=None):
+        """回填触发时间; rows 为空时按顺序对应完整帧"""
+        if rows is None:
+            rows = self.complete()
+        trigger_ts = np.asarray(trigger_ts, dtype=np.int64)
+        n = min(len(rows), len(trigger_ts))
+        if n == 0:
+            return 0
+        self.columns['trigger_ts'][rows[:n]] = trigger_ts[:n]
+        self.columns['trigger_ts'].flush()
+        return n
+
+    def export_txt(self, path):
+        """输出旧格式的 exposure_times.txt / timestamps.txt (只含完整帧)"""
+        rows = self.complete()
+        np.savetxt(os.path.join(path, 'exposure_times.txt'), self.columns['exposure'][rows])
+        np.savetxt(os.path.join(path, 'timestamps.txt'), self.columns['timestamp'][rows], fmt='%d')
@@ -0,0 +1,213 @@
+import os
+import time
+import queue
+import threading
+import numpy as np
+
+
+class FramePool:
+    """预分配的帧缓存池, 采集线程填充空闲槽, 写盘线程取出已填充槽, 内存恒定"""
+
+    def __init__(self, num_slots, height, width, dtype=np.uint8):
+        self.num_slots = num_slots
+        self.buffers = np.empty((num_slots, height, width), dtype=dtype)
+        self.free_slots = queue.Queue()
+        self.filled_slots = queue.Queue()
+        for i in range(num_slots):
+            self.free_slots.put(i)
+
+        # 统计信息
+        self.wait_count = 0      # 采集线程等待空闲槽的次数
+        self.written_count = 0
+        self.max_in_flight = 0
+
+        self.writer_thread = None
+        self.writer_error = None
+
+    def get_free(self, timeout=None):
+        """取一个空闲槽, 写盘跟不上时阻塞 (背压)"""
+        try:
+            return self.free_slots.get_nowait()
+        except queue.Empty:
+            self.wait_count += 1
+        return self.free_slots.get(timeout=timeout)
+
+    def commit(self, slot, info):
+        """槽已填充完毕, 交给写盘线程"""
+        self.filled_slots.put((slot, info))
+        in_flight = self.num_slots - self.free_slots.qsize()
+        if in_flight > self.max_in_flight:
+            self.max_in_flight = in_flight
+
+    def release(self, slot):
+        self.free_slots.put(slot)
+
+    def start_writer(self, sink):
+        """启动写盘线程, sink(frame, info) 负责把一帧写到磁盘"""
+        def writer():
+            while True:
+                item = self.filled_slots.get()
+                if item is None:
+                    break
+                slot, info = item
+                try:
+                    if self.writer_error is None:
+                        sink(self.buffers[slot], info)
+                        self.written_count += 1
+                except Exception as ex:
+                    # 记录错误, 继续归还槽位防止采集线程死锁
+                    self.writer_error = ex
+                    print('Writer error: %s' % ex)
+                self.release(slot)
+
+        self.writer_thread = threading.Thread(target=writer, daemon=True)
+        self.writer_thread.start()
+
+    def close(self):
+        """等待所有已提交的帧写完并结束写盘线程"""
+        if self.writer_thread is not None:
+            self.filled_slots.put(None)
+            self.writer_thread.join()
+            self.writer_thread = None
+        return self.writer_error is None
+
+
+class RawFileSink:
+    """按原来的格式每帧写一个 {i:05d}.raw, 文件头为 [OFFSET_X, OFFSET_Y, WIDTH, HEIGHT] int32"""
+
+    def __init__(self, path, roi):
+        self.path = path
+        self.header = np.array(roi, dtype=np.int32).tobytes()
+
+    def __call__(self, frame, i):
+        filename = os.path.join(self.path, f"{i:05d}.raw")
+        with open(filename, 'wb') as f:
+            f.write(self.header)
+            f.write(frame.tobytes())
+
+
+class AcquisitionEngine:
+    """
+    采集引擎: GetNextImage 的结果只拷贝一次到缓存池, 写盘线程同时把缓存池写到磁盘.
+    给出 meta (FrameMetaWriter) 时每帧的 chunk 数据在采集线程中追加到元数据.
+    给出 accounting (FrameAccounting) 时按 chunk FrameID 给帧编号, 编号即触发序号,
+    丢失的帧留下空号而不是让后面的帧前移.
+    raw=True 时拷贝原始字节 GetData() 而不是 GetNDArray(), 用于打包像素格式 (BayerRG12p 等).
+    """
+
+    def __init__(self, cam, pool, sink, timeout=1000, meta=None, accounting=None, raw=False):
+        self.cam = cam
+        self.pool = pool
+        self.sink = sink
+        self.timeout = timeout  # GetNextImage 超时 ms
+        self.meta = meta
+        self.accounting = accounting
+        self.raw = raw
+
+        self.grabbed_count = 0
+        self.incomplete_count = 0
+        self.elapsed = 0.0
+
+    def run(self, num_images=None, should_stop=None, period=None):
+        """
+        采集 num_images 次, num_images 为 None 时一直采集直到 should_stop() 返回 True.
+        有 accounting 时 num_images 为触发序号的个数, 丢失的帧也计入; 给出触发周期 period (s) 时,
+        最后一个应到的触发过后 (再加 timeout) 仍没有帧就结束, 末尾缺失的序号记为空缺.
+        SpinnakerException 交给调用方处理.
+        """
+        self.pool.start_writer(self.sink)
+        start = time.time()
+        deadline = None
+        i = 0
+        try:
+            while num_images is None or self._next_index(i) < num_images:
+                if should_stop is not None and should_stop():
+                    break
+                timeout = self.timeout
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    timeout = max(1, min(timeout, int(remaining * 1000)))
+                try:
+                    image_result = self.cam.GetNextImage(timeout)
+                except Exception:
+                    # 已经收到过帧时超时只说明后面的帧丢了, 等到最后一个触发的时刻为止
+                    if deadline is None:
+                        raise
+                    continue
+                host_ns = time.time_ns()
+                try:
+                    index = i
+                    frame_id = None
+                    chunk_data = None
+                    if self.accounting is not None or self.meta is not None:
+                        try:
+                            chunk_data = image_result.GetChunkData()
+                            frame_id = chunk_data.GetFrameID()
+                        except Exception:
+                            # 残帧可能没有 chunk 数据
+                            chunk_data = None
+                    if self.accounting is not None:
+                        if frame_id is None:
+                            # 没有 chunk FrameID 无法确定序号, 留给后面的帧按空缺记录
+                            self.incomplete_count += 1
+                            continue
+                        index = self.accounting.assign(frame_id)
+                        if index < 0 or (num_images is not None and index >= num_images):
+                            # FrameID 回退或超出本次采集范围, 不写入
+                            continue
+                        if period is not None and num_images is not None:
+                            deadline = (time.time() + (num_images - 1 - index) * period
+                                        + self.timeout / 1000.0)
+                    if image_result.IsIncomplete():
+                        print(f'Image incomplete with status {image_result.GetImageStatus()}')
+                        self.incomplete_count += 1
+                        if self.meta is not None:
+                            self._append_meta(index, frame_id, chunk_data, host_ns, incomplete=1)
+                        continue
+
+                    slot = self.pool.get_free()
+                    if self.raw:
+                        np.copyto(self.pool.buffers[slot].reshape(-1), image_result.GetData())
+                    else:
+                        np.copyto(self.pool.buffers[slot], image_result.GetNDArray())
+                    if self.meta is not None:
+                        self._append_meta(index, frame_id, chunk_data, host_ns)
+                    self.pool.commit(slot, index)
+                    self.grabbed_count += 1
+                finally:
+                    image_result.Release()
+                    i += 1
+        finally:
+            self.elapsed = time.time() - start
+            if self.accounting is not None and num_images is not None:
+                self.accounting.finish(num_images)
+        return self.grabbed_count
+
+    def _append_meta(self, index, frame_id, chunk_data, host_ns, incomplete=0):
+        """追加一行元数据; 读不到 chunk 数据时 frame_id 为 -1, 时间戳/曝光/增益为 0, 不中断采集"""
+        values = {'frame_index': index, 'incomplete': incomplete, 'host_ns': host_ns}
+        if chunk_data is not None:
+            values.update(frame_id=frame_id, timestamp=chunk_data.GetTimestamp(),
+                          exposure=chunk_data.GetExposureTime(), gain=chunk_data.GetGain())
+        self.meta.append(**values)
+
+    def _next_index(self, i):
+        return i if self.accounting is None else self.accounting.next_ordinal
+
+    def finish(self):
+        """等待写盘完成并输出统计"""
+        result = self.pool.close()
+        if hasattr(self.sink, 'close'):
+            self.sink.close()
+        if self.meta is not None:
+            self.meta.close()
+        fps = self.grabbed_count / self.elapsed if self.elapsed > 0 else 0.0
+        print(f'grabbed {self.grabbed_count} images, incomplete {self.incomplete_count}, '
+              f'written {self.pool.written_count}, {fps:.2f} fps')
+        print(f'pool slots {self.pool.num_slots}, max in flight {self.pool.max_in_flight}, '
+              f'capture waits {self.pool.wait_count}')
+        if self.accounting is not None:
+            print(self.accounting.summary())
+        return result
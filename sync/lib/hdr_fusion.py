@@ -0,0 +1,164 @@
+"""
+序列器 (Sequencer) HDR 采集的在线曝光融合.
+
+相机按序列器状态循环不同曝光, 采集线程把连续的一组 (每个状态一帧) 交给 HDRFusion,
+凑齐一组后在线程池中做 float32 辐照度融合 (numpy 运算释放 GIL), 每组输出一帧 HDR:
+    hdr/%d.npy        float32 Bayer 辐照度 (归一化像素值 / 曝光时间 us)
+    hdr/%d.png        对数色调映射后的预览 (可选)
+    hdr/TimeStamps.txt  每行: 中心时间 s, 文件名, 各曝光时间 us
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2 as cv
+
+
+def merge_radiance(frames, exposures, max_value=65535, low=0.05, high=0.95, out=None, scratch=None):
+    """
+    三角权重的辐照度融合, 在 Bayer (线性) 数据上逐像素计算.
+
+    :param frames: 同尺寸的原始帧列表
+    :param exposures: 对应的曝光时间 us
+    :param max_value: 像素满量程, 例如 BayerRG16 为 65535
+    :param low: 归一化值低于 low 的像素不参与 (噪声)
+    :param high: 归一化值高于 high 的像素不参与 (饱和)
+    :param out: float32 输出, 为空时新建
+    :param scratch: 4 个与帧同尺寸的 float32 临时数组, 为空时新建
+    :return: out
+    """
+    shape = frames[0].shape
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    if scratch is None:
+        scratch = [np.empty(shape, dtype=np.float32) for _ in range(4)]
+    den, z, w, tmp = scratch
+    out.fill(0)
+    den.fill(0)
+    scale = np.float32(1.0 / max_value)
+    for frame, exposure in zip(frames, exposures):
+        np.multiply(frame, scale, out=z)
+        # w = max(0, min(z - low, high - z))
+        np.subtract(z, low, out=w)
+        np.subtract(high, z, out=tmp)
+        np.minimum(w, tmp, out=w)
+        np.maximum(w, 0, out=w)
+        den += w
+        np.multiply(w, z, out=tmp)
+        tmp *= np.float32(1.0 / exposure)
+        out += tmp
+
+    invalid = den == 0
+    np.divide(out, den, out=out, where=~invalid)
+    if invalid.any():
+        # 所有曝光都饱和的像素取最短曝光, 都过暗的取最长曝光
+        shortest, longest = int(np.argmin(exposures)), int(np.argmax(exposures))
+        idx = np.flatnonzero(invalid)
+        short_z = frames[shortest].ravel()[idx] * scale
+        long_z = frames[longest].ravel()[idx] * scale
+        out.ravel()[idx] = np.where(short_z > high, short_z / exposures[shortest], long_z / exposures[longest])
+    return out
+
+
+def tonemap(radiance, color_code=None):
+    """对数色调映射为 8 位预览, 给出 color_code 时同时解马赛克"""
+    lo, hi = np.percentile(radiance[::4, ::4], (0.5, 99.5))
+    lo = max(float(lo), 1e-12)
+    hi = max(float(hi), lo * 1.0001)
+    scaled = np.log(np.clip(radiance, lo, hi) / lo) * np.float32(255.0 / np.log(hi / lo))
+    preview = scaled.astype(np.uint8)
+    if color_code is not None:
+        preview = cv.cvtColor(preview, color_code)
+    return preview
+
+
+class HDRFusion:
+    """
+    把连续帧按序列器状态分组, 凑齐后交给线程池融合.
+
+    :param path: 输出目录, 结果写到 path/hdr
+    :param exposures: 每个序列器状态的曝光时间 us, 下标即状态号
+    :param max_pending: 最多排队的组数, 超过时 add 阻塞, 内存有上限
+    """
+
+    def __init__(self, path, exposures, max_value=65535, num_workers=3, max_pending=6,
+                 preview=True, color_code=None):
+        self.path = os.path.join(path, 'hdr')
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.exposures = [float(e) for e in exposures]
+        self.max_value = max_value
+        self.preview = preview
+        self.color_code = color_code
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        self.frames = []
+        self.timestamps = []
+        self.records = []          # (组号, 中心时间 ns)
+        self.group_count = 0
+        self.broken_groups = 0     # 因丢帧或顺序错乱丢弃的不完整组
+        self.error = None
+
+    def set_for_exposure(self, exposure):
+        """按 chunk 中的曝光时间找到序列器状态号"""
+        return int(np.argmin([abs(e - exposure) for e in self.exposures]))
+
+    def add(self, frame, set_index, timestamp):
+        """
+        加入一帧 (会拷贝), 凑齐一组后提交融合.
+
+        :param set_index: 序列器状态号, 必须按 0, 1, ..., n-1 的顺序到达
+        :param timestamp: 曝光开始时间 ns
+        """
+        if set_index != len(self.frames):
+            if self.frames:
+                self.broken_groups += 1
+            self.frames, self.timestamps = [], []
+            if set_index != 0:
+                return False
+        self.frames.append(np.array(frame, copy=True))
+        self.timestamps.append(int(timestamp))
+        if len(self.frames) < len(self.exposures):
+            return True
+
+        frames, timestamps = self.frames, self.timestamps
+        self.frames, self.timestamps = [], []
+        # 中心时间: 第一帧曝光开始到最后一帧曝光结束的中点
+        center = (timestamps[0] + timestamps[-1] + int(self.exposures[-1] * 1000)) // 2
+        index = self.group_count
+        self.group_count += 1
+        self.pending.acquire()
+        self.executor.submit(self._fuse, index, frames, center)
+        return True
+
+    def _fuse(self, index, frames, center):
+        try:
+            if not hasattr(self.local, 'out'):
+                self.local.out = np.empty(frames[0].shape, dtype=np.float32)
+                self.local.scratch = [np.empty(frames[0].shape, dtype=np.float32) for _ in range(4)]
+            radiance = merge_radiance(frames, self.exposures, self.max_value,
+                                      out=self.local.out, scratch=self.local.scratch)
+            np.save(os.path.join(self.path, '%d.npy' % index), radiance)
+            if self.preview:
+                cv.imwrite(os.path.join(self.path, '%d.png' % index), tonemap(radiance, self.color_code))
+            with self.lock:
+                self.records.append((index, center))
+        except Exception as ex:
+            self.error = ex
+            print('Error: %s' % ex)
+        finally:
+            self.pending.release()
+
+    def close(self):
+        """等待融合完成并写 TimeStamps.txt, 返回 HDR 帧数"""
+        self.executor.shutdown(wait=True)
+        self.records.sort()
+        with open(os.path.join(self.path, 'TimeStamps.txt'), 'w') as f:
+            for index, center in self.records:
+                f.write('{} '.format(center / 1000000000) + '%d.npy ' % index
+                        + ' '.join('%.2f' % e for e in self.exposures) + '\n')
+        print('HDR: %d frames fused, %d incomplete groups dropped' % (len(self.records), self.broken_groups))
+        return len(self.records)
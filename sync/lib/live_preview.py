@@ -0,0 +1,145 @@
+"""
+与采集解耦的低分辨率实时预览.
+
+采集线程调用 offer(frame): 距上次接收不足 1/max_fps 时直接返回, 否则把帧拷贝到单槽信箱
+(只保留最新一帧, 从不等待). 预览线程从信箱取帧, 用 Bayer 超像素 (2x2 -> 1 个 RGB 像素)
+缩小后再按 factor 合并 (bin) 或抽取 (stride), 以不超过 max_fps 的速率显示.
+"""
+import time
+import threading
+import numpy as np
+import cv2 as cv
+
+
+def superpixel(bayer, factor=1, mode='bin', out=None):
+    """
+    RGGB Bayer -> BGR, 尺寸为 (H / 2factor, W / 2factor).
+
+    :param factor: 在超像素之后再缩小的倍数
+    :param mode: 'bin' 对 factor x factor 个超像素求平均, 'stride' 每 factor 个取一个
+    """
+    h, w = bayer.shape
+    step = 2 * factor
+    h, w = h // step * step, w // step * step
+    blocks = bayer[:h, :w].reshape(h // step, factor, 2, w // step, factor, 2)
+    if mode == 'stride':
+        blocks = blocks[:, :1, :, :, :1, :]
+    if out is None:
+        out = np.empty((h // step, w // step, 3), dtype=np.float32)
+    # 通道顺序 BGR
+    np.mean(blocks[:, :, 1, :, :, 1], axis=(1, 3), out=out[..., 0])
+    np.mean(blocks[:, :, 0, :, :, 1], axis=(1, 3), out=out[..., 1])
+    out[..., 1] += blocks[:, :, 1, :, :, 0].mean(axis=(1, 3))
+    out[..., 1] *= 0.5
+    np.mean(blocks[:, :, 0, :, :, 0], axis=(1, 3), out=out[..., 2])
+    return out
+
+
+class LivePreview:
+    """
+    单槽信箱 + 预览线程.
+
+    :param max_fps: 显示帧率上限, 同时限制采集线程拷贝帧的频率
+    :param factor: 超像素之后的缩小倍数
+    :param mode: 'bin' 或 'stride'
+    :param bits: 像素有效位数, 显示时转换为 8 位
+    :param flip: True 时左右翻转 (与 raw2npy 一致)
+    :param show: 显示回调 show(bgr), 默认用 cv.imshow
+    """
+
+    def __init__(self, window='Image', max_fps=10.0, factor=2, mode='bin', bits=8, flip=False, show=None):
+        self.window = window
+        self.period = 1.0 / max_fps
+        self.factor = factor
+        self.mode = mode
+        self.scale = np.float32(255.0 / ((1 << bits) - 1))
+        self.flip = flip
+        self.show = show
+
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.mailbox = None      # 采集线程写入
+        self.spare = None        # 预览线程处理中的缓存, 交换后复用
+        self.has_frame = False
+        self.last_offer = 0.0
+
+        self.offered = 0
+        self.accepted = 0
+        self.shown = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def offer(self, frame):
+        """采集线程调用, 不阻塞; 返回是否拷贝了这一帧"""
+        self.offered += 1
+        now = time.perf_counter()
+        if not self.running or now - self.last_offer < self.period:
+            return False
+        # 预览线程正在交换缓存时放弃这一帧, 不等待
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if self.mailbox is None or self.mailbox.shape != frame.shape or self.mailbox.dtype != frame.dtype:
+                self.mailbox = np.empty_like(frame)
+            np.copyto(self.mailbox, frame)
+            self.has_frame = True
+        finally:
+            self.lock.release()
+        self.last_offer = now
+        self.accepted += 1
+        self.ready.set()
+        return True
+
+    def _take(self):
+        with self.lock:
+            if not self.has_frame:
+                return None
+            self.mailbox, self.spare = self.spare, self.mailbox
+            self.has_frame = False
+            return self.spare
+
+    def _render(self, bayer):
+        bgr = superpixel(bayer, self.factor, self.mode)
+        bgr *= self.scale
+        image = bgr.astype(np.uint8)
+        if self.flip:
+            image = image[:, ::-1]
+        if self.show is not None:
+            self.show(image)
+        else:
+            cv.imshow(self.window, image)
+            cv.waitKey(1)
+        self.shown += 1
+
+    def _run(self):
+        if self.show is None:
+            cv.namedWindow(self.window, cv.WINDOW_NORMAL)
+        while self.running:
+            if not self.ready.wait(timeout=0.1):
+                continue
+            self.ready.clear()
+            start = time.perf_counter()
+            bayer = self._take()
+            if bayer is not None:
+                try:
+                    self._render(bayer)
+                except Exception as ex:
+                    print('Preview error: %s' % ex)
+            elapsed = time.perf_counter() - start
+            if elapsed < self.period:
+                time.sleep(self.period - elapsed)
+        if self.show is None:
+            cv.destroyWindow(self.window)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        print('preview: %d offered, %d copied, %d shown' % (self.offered, self.accepted, self.shown))
@@ -0,0 +1,140 @@
+"""
+打包像素格式 (GenICam PFNC, 低位在前) 的解包.
+
+    10p: 4 个像素占 5 字节, 链路带宽为 8 位的 1.25 倍
+    12p: 2 个像素占 3 字节, 链路带宽为 8 位的 1.5 倍
+
+采集时只拷贝原始字节 (每行 packed_row_bytes 字节, uint8), 解包放到离线或写盘之后,
+解包函数写入预分配的 uint16 输出, 不产生整帧临时数组.
+"""
+import os
+import argparse
+import numpy as np
+
+# 像素格式 -> 位深, 打包格式以 p 结尾
+BIT_DEPTHS = {
+    'BayerRG8': 8, 'Mono8': 8,
+    'BayerRG10p': 10, 'Mono10p': 10,
+    'BayerRG12p': 12, 'Mono12p': 12,
+    'BayerRG16': 16, 'Mono16': 16,
+}
+
+
+def is_packed(pixel_format):
+    return BIT_DEPTHS.get(pixel_format, 8) in (10, 12)
+
+
+def packed_row_bytes(width, pixel_format):
+    bits = BIT_DEPTHS[pixel_format]
+    if (width * bits) % 8:
+        raise ValueError('width %d is not valid for %s' % (width, pixel_format))
+    return width * bits // 8
+
+
+def frame_layout(pixel_format, height, width):
+    """采集缓存的 (shape, dtype): 打包格式为每行 packed_row_bytes 的 uint8"""
+    bits = BIT_DEPTHS[pixel_format]
+    if bits == 8:
+        return (height, width), np.uint8
+    if bits == 16:
+        return (height, width), np.uint16
+    return (height, packed_row_bytes(width, pixel_format)), np.uint8
+
+
+def unpack12(data, out, scratch=None):
+    """12p 解包, data 为 3 字节一组的 uint8, out 为 uint16 (像素数为 data 字节数 * 2 / 3)"""
+    b = np.asarray(data, dtype=np.uint8).reshape(-1, 3)
+    o = out.reshape(-1, 2)
+    if scratch is None:
+        scratch = np.empty(len(b), dtype=np.uint16)
+    # p0 = b0 | (b1 & 0x0F) << 8
+    np.bitwise_and(b[:, 1], 0x0F, out=o[:, 0], dtype=np.uint16)
+    np.left_shift(o[:, 0], 8, out=o[:, 0])
+    np.bitwise_or(o[:, 0], b[:, 0], out=o[:, 0], dtype=np.uint16)
+    # p1 = (b1 >> 4) | b2 << 4
+    np.left_shift(b[:, 2], 4, out=o[:, 1], dtype=np.uint16)
+    np.right_shift(b[:, 1], 4, out=scratch, dtype=np.uint16)
+    np.bitwise_or(o[:, 1], scratch, out=o[:, 1])
+    return out
+
+
+def unpack10(data, out, scratch=None):
+    """10p 解包, data 为 5 字节一组的 uint8, out 为 uint16 (像素数为 data 字节数 * 4 / 5)"""
+    b = np.asarray(data, dtype=np.uint8).reshape(-1, 5)
+    o = out.reshape(-1, 4)
+    if scratch is None:
+        scratch = np.empty(len(b), dtype=np.uint16)
+    # 像素 k 的低位在字节 k 的高 2k 位, 高位在字节 k+1 的低 2k+2 位
+    for k in range(4):
+        np.bitwise_and(b[:, k + 1], (1 << (2 * k + 2)) - 1, out=o[:, k], dtype=np.uint16)
+        np.left_shift(o[:, k], 8 - 2 * k, out=o[:, k])
+        np.right_shift(b[:, k], 2 * k, out=scratch, dtype=np.uint16)
+        np.bitwise_or(o[:, k], scratch, out=o[:, k])
+    return out
+
+
+class Unpacker:
+    """按像素格式解包整帧, 输出和临时数组只分配一次"""
+
+    def __init__(self, pixel_format, height, width, msb_align=False):
+        self.pixel_format = pixel_format
+        self.bits = BIT_DEPTHS[pixel_format]
+        if self.bits not in (10, 12):
+            raise ValueError('%s is not a packed format' % pixel_format)
+        self.height = height
+        self.width = width
+        self.msb_align = msb_align   # True 时左移到 16 位满量程
+        self.out = np.empty((height, width), dtype=np.uint16)
+        group = 2 if self.bits == 12 else 4
+        self.scratch = np.empty(height * width // group, dtype=np.uint16)
+
+    def __call__(self, data, out=None):
+        if out is None:
+            out = self.out
+        if self.bits == 12:
+            unpack12(data, out, self.scratch)
+        else:
+            unpack10(data, out, self.scratch)
+        if self.msb_align:
+            np.left_shift(out, 16 - self.bits, out=out)
+        return out
+
+    def to_8bit(self, data, out=None):
+        """解包并取高 8 位, 用于预览"""
+        unpacked = self(data)
+        if out is None:
+            out = np.empty((self.height, self.width), dtype=np.uint8)
+        np.right_shift(unpacked, 16 - 8 if self.msb_align else self.bits - 8, out=out, casting='unsafe')
+        return out
+
+
+def unpack_container(src, dst, msb_align=False):
+    """把打包格式的容器文件 (.frc) 解包为 (N, H, W) uint16 的 .npy"""
+    from numpy.lib.format import open_memmap
+    from lib.frame_container import FrameContainer
+
+    frames = FrameContainer(src)
+    if not is_packed(frames.pixel_format):
+        raise ValueError('%s holds %s frames, nothing to unpack' % (src, frames.pixel_format))
+    height = frames.height
+    width = frames.width * 8 // BIT_DEPTHS[frames.pixel_format]
+    unpacker = Unpacker(frames.pixel_format, height, width, msb_align=msb_align)
+    out = open_memmap(dst, mode='w+', dtype=np.uint16, shape=(len(frames), height, width))
+    for i in range(len(frames)):
+        unpacker(frames[i], out=out[i])
+    out.flush()
+    return len(frames)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Unpack a BayerRG10p/12p or Mono10p/12p frame container.')
+    parser.add_argument('src', help='frame container (.frc) recorded with a packed pixel format')
+    parser.add_argument('dst', help='output .npy (N, H, W) uint16')
+    parser.add_argument('--msb-align', action='store_true', help='shift values to the 16-bit range')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    n = unpack_container(args.src, args.dst, msb_align=args.msb_align)
+    print('unpacked %d frames to %s' % (n, os.path.abspath(args.dst)))
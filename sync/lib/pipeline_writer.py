@@ -0,0 +1,141 @@
+import os
+import time
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import cv2 as cv
+
+from lib.frame_meta import FrameMetaWriter, FrameMeta
+
+# FLIR 的 BayerRG8 对应 OpenCV 的 BayerBG 命名, 输出 BGR 直接给 imwrite
+BAYER_RG_TO_BGR = cv.COLOR_BayerBG2BGR
+# 写盘进程用 spawn 启动: fork 会让子进程继承已初始化的 Spinnaker / USB 状态
+MP_CONTEXT = mp.get_context('spawn')
+
+
+def _encode_worker(shm_name, num_slots, height, width, path, save_format,
+                   task_queue, free_queue, written_count):
+    """写盘进程: 从共享内存槽读 Bayer 数据, 解马赛克并编码写盘, 然后归还槽位"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray((num_slots, height, width), dtype=np.uint8, buffer=shm.buf)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            slot, index = task
+            try:
+                if save_format == 'raw':
+                    filename = os.path.join(path, f'image_{index:06d}.raw')
+                    slots[slot].tofile(filename)
+                else:
+                    image = cv.cvtColor(slots[slot], BAYER_RG_TO_BGR)
+                    filename = os.path.join(path, f'image_{index:06d}.{save_format}')
+                    cv.imwrite(filename, image)
+                with written_count.get_lock():
+                    written_count.value += 1
+            except Exception as ex:
+                print('Encode error on image %d: %s' % (index, ex))
+            free_queue.put(slot)
+    finally:
+        del slots
+        shm.close()
+
+
+class PipelinedRecorder:
+    """
+    流水线录制: 采集线程只把 Bayer 数据拷贝到共享内存槽并入队,
+    多个写盘进程并行完成解马赛克与 PNG/raw 编码.
+    槽位用完时按 policy 处理: 'block' 阻塞等待 (背压), 'drop' 丢帧并计数.
+    文件名按采集序号命名, 与写完的先后顺序无关.
+    """
+
+    def __init__(self, path, height, width, num_workers=3, num_slots=32,
+                 save_format='png', policy='drop', block_timeout=0.0):
+        self.path = path
+        self.height = height
+        self.width = width
+        self.num_slots = num_slots
+        self.save_format = save_format
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        frame_size = height * width
+        self.shm = shared_memory.SharedMemory(create=True, size=num_slots * frame_size)
+        self.slots = np.ndarray((num_slots, height, width), dtype=np.uint8, buffer=self.shm.buf)
+
+        self.task_queue = MP_CONTEXT.Queue(maxsize=num_slots)
+        # 写盘进程通过 free_queue 归还槽位, 采集线程先用本地列表中的空闲槽
+        self.free_queue = MP_CONTEXT.Queue()
+        self.local_free = list(range(num_slots))
+        self.written_count = MP_CONTEXT.Value('q', 0)
+
+        self.workers = []
+        for _ in range(num_workers):
+            p = MP_CONTEXT.Process(target=_encode_worker,
+                           args=(self.shm.name, num_slots, height, width, path, save_format,
+                                 self.task_queue, self.free_queue, self.written_count),
+                           daemon=True)
+            p.start()
+            self.workers.append(p)
+
+        # 元数据按列追加, 丢弃的帧也记录一行
+        self.meta = FrameMetaWriter(path)
+        self.dropped_count = 0
+        self.submitted_count = 0
+        self.start_time = time.time()
+
+    def submit(self, index, bayer, exposure_time, timestamp, frame_id=-1, gain=0.0):
+        """采集线程调用, 返回 False 表示该帧被丢弃"""
+        host_ns = time.time_ns()
+        try:
+            slot = self._get_free()
+        except queue.Empty:
+            self.dropped_count += 1
+            self.meta.append(frame_index=index, frame_id=frame_id, timestamp=timestamp, exposure=exposure_time,
+                             gain=gain, dropped=1, host_ns=host_ns)
+            return False
+
+        np.copyto(self.slots[slot], bayer)
+        self.task_queue.put((slot, index))
+        self.meta.append(frame_index=index, frame_id=frame_id, timestamp=timestamp, exposure=exposure_time,
+                         gain=gain, host_ns=host_ns)
+        self.submitted_count += 1
+        return True
+
+    def _get_free(self):
+        if not self.local_free:
+            try:
+                while True:
+                    self.local_free.append(self.free_queue.get_nowait())
+            except queue.Empty:
+                pass
+        if self.local_free:
+            return self.local_free.pop()
+        if self.policy == 'block':
+            return self.free_queue.get(timeout=self.block_timeout or None)
+        raise queue.Empty
+
+    def status(self):
+        return (self.submitted_count, self.written_count.value, self.dropped_count)
+
+    def close(self):
+        """等待队列写完, 结束写盘进程并保存元数据"""
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for p in self.workers:
+            p.join()
+
+        self.meta.close()
+        FrameMeta(self.path).export_txt(self.path)
+
+        elapsed = time.time() - self.start_time
+        submitted, written, dropped = self.status()
+        print(f'pipeline: submitted {submitted}, written {written}, dropped {dropped}, '
+              f'{written / elapsed if elapsed > 0 else 0.0:.2f} fps written')
+
+        del self.slots
+        self.shm.close()
+        self.shm.unlink()
+        return dropped == 0
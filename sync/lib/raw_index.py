@@ -0,0 +1,311 @@
+"""
+event.raw (EVT 3.0) 的时间索引和按时间窗口随机读取.
+
+索引是与 RAW 同目录的 event.raw.tidx.npz, 每隔 interval_us 记录一个 TIME_HIGH 字的位置:
+    t        该 TIME_HIGH 的绝对时间 us (含回绕, 未做 time shifting)
+    offset   该字相对数据区起点 (头部之后) 的字节偏移
+    y, base_x, p   从该字开始继续解码需要的状态 (最近的 ADDR_Y 和 VECT_BASE_X)
+读取 [t0, t1) 时找到 t0 之前最近的条目, seek 过去从保存的状态开始解码, 到 t1 为止,
+读入的数据量约为 interval_us + 窗口长度, 与文件长度无关.
+
+IndexBuilder 可以在录制时直接喂入 RawLogPump 取到的原始缓冲区 (与写盘的数据相同), 也可以离线扫描已有文件;
+它只找几类字的位置, 不走解码器.
+解码器 EVT3Decoder 是纯 numpy 的向量化实现, 输出与 RawReader 相同字段的 CD 事件.
+"""
+import os
+import argparse
+import numpy as np
+
+from lib.raw_triggers import read_header, is_evt3, TIME_LOW, TIME_HIGH, TimeHighClock
+
+EVENT_DTYPE = np.dtype([('x', np.uint16), ('y', np.uint16), ('p', np.int16), ('t', np.int64)])
+ENTRY_DTYPE = np.dtype([('t', np.int64), ('offset', np.int64), ('y', np.int32), ('base_x', np.int32), ('p', np.int8)])
+INDEX_SUFFIX = '.tidx.npz'
+
+ADDR_Y = 0x0
+ADDR_X = 0x2
+VECT_BASE_X = 0x3
+VECT_12 = 0x4
+VECT_8 = 0x5
+
+_BITS = np.arange(12, dtype=np.uint16)
+
+
+def _ranks(mask):
+    """每个位置之前 (含) 的 mask 个数, 用来取最近一个为真的元素 (0 表示上一块留下的状态)"""
+    return np.cumsum(mask, dtype=np.int64)
+
+
+class EVT3Decoder:
+    """
+    逐块解码 EVT 3.0, 块之间保存时间和坐标状态.
+
+    :param shift: 从时间戳中减去的值 us; None 时做 time shifting, 以解码到的第一个 TIME_HIGH 为 0
+    """
+
+    def __init__(self, shift=0):
+        self.clock = TimeHighClock(do_time_shifting=True, shift=shift)
+        self.time_base = 0
+        self.time_low = 0
+        self.y = 0
+        self.base_x = 0
+        self.p = 0
+
+    def set_state(self, entry):
+        """从索引条目恢复状态, 下一块必须从该条目的 TIME_HIGH 字开始"""
+        self.time_base = int(entry['t'])
+        self.clock.set_time(self.time_base)
+        self.time_low = 0
+        self.y = int(entry['y'])
+        self.base_x = int(entry['base_x'])
+        self.p = int(entry['p'])
+
+    def resolve(self, words, positions):
+        """
+        计算 positions 处 (之前最近) 的时间和坐标状态, 并把块末状态留给下一块.
+
+        :return: (TIME_HIGH 时间 us, TIME_LOW 值, y, base_x, p), 都是与 positions 等长的数组
+        """
+        kind = words >> 12
+        value = (words & 0x0FFF).astype(np.int64)
+
+        is_high = kind == TIME_HIGH
+        high_pos = np.flatnonzero(is_high)
+        base = np.concatenate(([self.time_base], self.clock.unwrap(value[high_pos])))
+
+        is_low = kind == TIME_LOW
+        low_pos = np.flatnonzero(is_low)
+        low = np.concatenate(([self.time_low], value[low_pos]))
+        is_y = kind == ADDR_Y
+        ys = np.concatenate(([self.y], value[is_y] & 0x7FF))
+        is_base = kind == VECT_BASE_X
+        base_pos = np.flatnonzero(is_base)
+        base_x = np.concatenate(([self.base_x], value[base_pos] & 0x7FF))
+        base_p = np.concatenate(([self.p], value[base_pos] >> 11))
+        # VECT_12/VECT_8 每个字之后 base_x 分别加 12/8
+        inc = np.where(kind == VECT_12, 12, np.where(kind == VECT_8, 8, 0))
+        cum = np.cumsum(inc)
+        cum_at_base = np.concatenate(([0], cum[base_pos]))
+
+        high_rank = _ranks(is_high)
+        low_rank = _ranks(is_low)
+        y_rank = _ranks(is_y)
+        base_rank = _ranks(is_base)
+
+        def at(pos):
+            hr, lr, br = high_rank[pos], low_rank[pos], base_rank[pos]
+            # TIME_HIGH 之后还没有 TIME_LOW 时低位为 0
+            high_at = np.concatenate(([-1], high_pos))[hr]
+            low_at = np.concatenate(([-1], low_pos))[lr]
+            t_low = np.where(high_at > low_at, 0, low[lr])
+            x = base_x[br] + (cum[pos] - inc[pos]) - cum_at_base[br]
+            return base[hr], t_low, ys[y_rank[pos]], x, base_p[br]
+
+        result = at(positions)
+        if len(words):
+            last = len(words) - 1
+            tb, tl, y, x, p = at(np.array([last]))
+            self.time_base, self.time_low, self.y, self.p = int(tb[0]), int(tl[0]), int(y[0]), int(p[0])
+            self.base_x = int(x[0]) + int(inc[last])
+        return result
+
+    def decode(self, words):
+        """解码一块 uint16 字, 返回 CD 事件 (EVENT_DTYPE), 按时间顺序"""
+        words = np.asarray(words, dtype=np.uint16)
+        kind = words >> 12
+        emit = np.flatnonzero((kind == ADDR_X) | (kind == VECT_12) | (kind == VECT_8))
+        t_base, t_low, y, base_x, p = self.resolve(words, emit)
+
+        k = kind[emit]
+        w = words[emit]
+        single = k == ADDR_X
+        # ADDR_X 看作只有第 0 位的向量
+        x0 = np.where(single, w & 0x7FF, base_x)
+        pol = np.where(single, (w >> 11) & 1, p)
+        mask = np.where(single, 1, np.where(k == VECT_12, w & 0x0FFF, w & 0x00FF)).astype(np.uint16)
+        rows, bits = np.nonzero((mask[:, None] >> _BITS) & 1)
+
+        events = np.empty(len(rows), dtype=EVENT_DTYPE)
+        events['x'] = x0[rows] + bits
+        events['y'] = y[rows]
+        events['p'] = pol[rows]
+        events['t'] = t_base[rows] + t_low[rows] - (self.clock.shift or 0)
+        return events
+
+
+class IndexBuilder:
+    """
+    增量建立时间索引. 不解码事件, 每块只找 TIME_HIGH / ADDR_Y / VECT_BASE_X / 向量字的位置,
+    条目处的状态用 searchsorted 取最近的 ADDR_Y 和 VECT_BASE_X, 再加上其后向量字的个数.
+
+    :param interval_us: 条目间隔, 随机读取时最多多读这么长时间的数据
+    :param do_time_shifting: 与 RawReader 相同, 以第一个 TIME_HIGH 为时间 0
+    """
+
+    def __init__(self, interval_us=10000, do_time_shifting=True):
+        self.interval_us = interval_us
+        self.clock = TimeHighClock(do_time_shifting)
+        self.parts = []
+        self.offset = 0          # 已处理的字节数 (数据区)
+        self.pending = b''       # 上一个缓冲区剩下的奇数字节
+        self.last_bucket = None
+        # 上一块末尾的坐标状态
+        self.y = 0
+        self.base_x = 0
+        self.p = 0
+
+    def feed(self, data):
+        """喂入数据区中接下来的一段 (bytes / uint8 / uint16 数组)"""
+        raw = np.asarray(data).view(np.uint8).ravel() if isinstance(data, np.ndarray) else np.frombuffer(data, np.uint8)
+        if self.pending:
+            raw = np.concatenate((np.frombuffer(self.pending, np.uint8), raw))
+        usable = len(raw) // 2 * 2
+        self.pending = raw[usable:].tobytes()
+        words = raw[:usable].view(np.uint16)
+
+        kind = words >> 12
+        high_pos = np.flatnonzero(kind == TIME_HIGH)
+        y_pos = np.flatnonzero(kind == ADDR_Y)
+        base_pos = np.flatnonzero(kind == VECT_BASE_X)
+        v12_pos = np.flatnonzero(kind == VECT_12)
+        v8_pos = np.flatnonzero(kind == VECT_8)
+
+        def state_at(pos):
+            """pos 之前最近的 ADDR_Y 和 VECT_BASE_X (加上其后向量字的宽度), 本块没有时用上一块的状态"""
+            yi = np.searchsorted(y_pos, pos) - 1
+            y = np.full(len(pos), self.y, dtype=np.int64)
+            y[yi >= 0] = words[y_pos[yi[yi >= 0]]] & 0x7FF
+            bi = np.searchsorted(base_pos, pos) - 1
+            x = np.full(len(pos), self.base_x, dtype=np.int64)
+            p = np.full(len(pos), self.p, dtype=np.int64)
+            start = np.zeros(len(pos), dtype=np.int64)
+            w = words[base_pos[bi[bi >= 0]]].astype(np.int64)
+            x[bi >= 0] = w & 0x7FF
+            p[bi >= 0] = (w >> 11) & 1
+            start[bi >= 0] = base_pos[bi[bi >= 0]] + 1
+            x += 12 * (np.searchsorted(v12_pos, pos) - np.searchsorted(v12_pos, start))
+            x += 8 * (np.searchsorted(v8_pos, pos) - np.searchsorted(v8_pos, start))
+            return y, x, p
+
+        t_high = self.clock.unwrap(words[high_pos] & 0x0FFF)
+        if len(t_high):
+            # 每个 interval 的第一个 TIME_HIGH 作为条目
+            bucket = t_high // self.interval_us
+            prev = np.empty_like(bucket)
+            prev[0] = -1 if self.last_bucket is None else self.last_bucket
+            prev[1:] = bucket[:-1]
+            keep = bucket != prev
+            pos = high_pos[keep]
+            entries = np.empty(len(pos), dtype=ENTRY_DTYPE)
+            entries['t'] = t_high[keep]
+            entries['offset'] = self.offset + 2 * pos
+            entries['y'], entries['base_x'], entries['p'] = state_at(pos)
+            self.parts.append(entries)
+            self.last_bucket = int(bucket[-1])
+
+        # 块末状态留给下一块
+        y, x, p = state_at(np.array([len(words)]))
+        self.y, self.base_x, self.p = int(y[0]), int(x[0]), int(p[0])
+        self.offset += usable
+
+    def entries(self):
+        return np.concatenate(self.parts) if self.parts else np.empty(0, dtype=ENTRY_DTYPE)
+
+    def save(self, raw_path):
+        """写 raw_path + '.tidx.npz'"""
+        entries = self.entries()
+        np.savez(raw_path + INDEX_SUFFIX, entries=entries, shift=self.clock.shift or 0,
+                 interval_us=self.interval_us, data_bytes=self.offset)
+        print('event index: %d entries every %d us for %.1f MB' % (len(entries), self.interval_us, self.offset / 1e6))
+        return entries
+
+
+def build_index(raw_path, interval_us=10000, do_time_shifting=True, chunk_words=1 << 22):
+    """离线为已有的 RAW 文件建立索引"""
+    with open(raw_path, 'rb') as f:
+        header, offset = read_header(f)
+        if not is_evt3(header):
+            raise ValueError('%s is not EVT 3.0 (header %s)' % (raw_path, header))
+        builder = IndexBuilder(interval_us, do_time_shifting)
+        f.seek(offset)
+        buffer = np.empty(chunk_words, dtype=np.uint16)
+        while True:
+            n = f.readinto(memoryview(buffer).cast('B'))
+            if not n:
+                break
+            builder.feed(buffer.view(np.uint8)[:n])
+    builder.save(raw_path)
+    return builder
+
+
+class IndexedRaw:
+    """
+    按时间窗口读取 event.raw, 时间与 RawReader (do_time_shifting=True) 和触发时间一致.
+
+    :param build: 没有索引文件时先离线建立
+    """
+
+    def __init__(self, raw_path, build=True, chunk_words=1 << 18):
+        self.raw_path = raw_path
+        self.chunk_words = chunk_words
+        if not os.path.exists(raw_path + INDEX_SUFFIX) and build:
+            build_index(raw_path)
+        index = np.load(raw_path + INDEX_SUFFIX)
+        self.entries = index['entries']
+        self.shift = int(index['shift'])
+        self.interval_us = int(index['interval_us'])
+        self.times = self.entries['t'] - self.shift
+        with open(raw_path, 'rb') as f:
+            _, self.data_offset = read_header(f)
+        self.bytes_read = 0
+
+    def time_range(self):
+        if not len(self.times):
+            return 0, 0
+        return int(self.times[0]), int(self.times[-1]) + (1 << 12)
+
+    def read(self, t0, t1):
+        """返回 t0 <= t < t1 (us) 的 CD 事件"""
+        decoder = EVT3Decoder(self.shift)
+        start, end = 0, None
+        if len(self.entries):
+            k = max(int(np.searchsorted(self.times, t0, side='right')) - 1, 0)
+            decoder.set_state(self.entries[k])
+            start = int(self.entries[k]['offset'])
+            # 时间大于 t1 的第一个条目之后的事件都在窗口外
+            j = int(np.searchsorted(self.times, t1, side='right'))
+            if j < len(self.entries):
+                end = int(self.entries[j]['offset'])
+        parts = []
+        with open(self.raw_path, 'rb') as f:
+            f.seek(self.data_offset + start)
+            remaining = -1 if end is None else end - start
+            buffer = np.empty(self.chunk_words, dtype=np.uint16)
+            while remaining:
+                view = memoryview(buffer).cast('B')
+                if remaining > 0:
+                    view = view[:min(remaining, len(view))]
+                n = f.readinto(view) // 2
+                if n == 0:
+                    break
+                self.bytes_read += n * 2
+                if remaining > 0:
+                    remaining -= n * 2
+                events = decoder.decode(buffer[:n])
+                if len(events):
+                    parts.append(events[(events['t'] >= t0) & (events['t'] < t1)])
+                if decoder.time_base - self.shift >= t1:
+                    break
+        return np.concatenate(parts) if parts else np.empty(0, dtype=EVENT_DTYPE)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build a time index for an EVT 3.0 event.raw.')
+    parser.add_argument('raw', help='event.raw')
+    parser.add_argument('--interval', type=int, default=10000, help='index entry spacing in us')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    build_index(args.raw, args.interval)
@@ -0,0 +1,171 @@
+"""
+不解码 CD 事件, 直接从 EVT 3.0 格式的 RAW 文件中扫描外部触发.
+
+EVT 3.0 每个字 16 位, 高 4 位为类型. 这里只关心三种:
+    0x8 TIME_HIGH    bits 11..0 为时间戳 bits 23..12 (约 16.7 s 回绕一次)
+    0x6 TIME_LOW     bits 11..0 为时间戳 bits 11..0
+    0xA EXT_TRIGGER  bit 0 为电平 (p), bits 11..8 为通道 (id)
+按块读入 uint16, 向量化找到这三类字的位置, 每个触发的时间取它之前最近的 TIME_HIGH/TIME_LOW,
+不展开任何 CD 事件, 内存只占一个块. 结果与 RawReader.get_ext_trigger_events() 的 dtype 和
+时间基准 (do_time_shifting 时以第一个 TIME_HIGH 为 0) 一致.
+"""
+import os
+import argparse
+import numpy as np
+
+TRIGGER_DTYPE = np.dtype([('p', np.int16), ('t', np.int64), ('id', np.int16)])
+
+TIME_LOW = 0x6
+TIME_HIGH = 0x8
+EXT_TRIGGER = 0xA
+TIME_HIGH_PERIOD = 1 << 12       # TIME_HIGH 值的取值范围
+LOOP_THRESHOLD = 1 << 11         # TIME_HIGH 回退超过此值视为回绕
+
+
+def read_header(f):
+    """读取 '%' 开头的头部行, 返回 (头部字典, 数据起始偏移)"""
+    header = {}
+    f.seek(0)
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        if not line.startswith(b'%'):
+            break
+        text = line[1:].decode('ascii', 'replace').strip()
+        if text == 'end':
+            pos = f.tell()
+            break
+        key, _, value = text.partition(' ')
+        header[key] = value
+    return header, pos
+
+
+def is_evt3(header):
+    return header.get('format', '').upper().startswith('EVT3') or header.get('evt', '') == '3.0'
+
+
+class TimeHighClock:
+    """
+    把 TIME_HIGH 展开为含回绕的绝对时间 us, 块之间保存状态.
+    TriggerScanner, raw_index.EVT3Decoder 和 event_slices.iter_raw_chunks 共用这一个实现, 时间基准一致.
+
+    :param shift: time shifting 的偏移 us; None 时 do_time_shifting 取第一个 TIME_HIGH 的时间, 否则为 0
+    """
+
+    def __init__(self, do_time_shifting=True, shift=None):
+        self.do_time_shifting = do_time_shifting
+        self.shift = shift
+        self.last_high = None     # 上一个 TIME_HIGH 的原始 12 位值
+        self.loops = 0
+
+    def unwrap(self, high):
+        """一块中按顺序出现的 TIME_HIGH 12 位值 -> 绝对时间 us (未减 shift)"""
+        high = np.asarray(high, dtype=np.int64)
+        prev = np.empty_like(high)
+        if len(high):
+            prev[0] = high[0] if self.last_high is None else self.last_high
+            prev[1:] = high[:-1]
+        loops = self.loops + np.cumsum(prev - high >= LOOP_THRESHOLD)
+        base = (loops * TIME_HIGH_PERIOD + high) << 12
+        if len(high):
+            if self.shift is None:
+                self.shift = int(base[0]) if self.do_time_shifting else 0
+            self.last_high = int(high[-1])
+            self.loops = int(loops[-1])
+        return base
+
+    def set_time(self, time_base):
+        """从某个 TIME_HIGH 的绝对时间恢复回绕状态 (随机读取时)"""
+        self.last_high = (time_base >> 12) & 0x0FFF
+        self.loops = time_base >> 24
+
+
+class TriggerScanner:
+    """跨块保存 TIME_HIGH/TIME_LOW 状态, 可以逐块喂入 (例如录制中增量扫描)"""
+
+    def __init__(self, do_time_shifting=True):
+        self.clock = TimeHighClock(do_time_shifting)
+        self.time_base = 0        # 含回绕的 TIME_HIGH 时间 us
+        self.time_low = 0         # 当前 TIME_HIGH 之后最近的 TIME_LOW, 没有时为 0
+        self.words = 0
+
+    def feed(self, words):
+        """扫描一块 uint16 字, 返回其中的触发 (TRIGGER_DTYPE)"""
+        words = np.asarray(words, dtype=np.uint16)
+        self.words += len(words)
+        kind = words >> 12
+        high_pos = np.flatnonzero(kind == TIME_HIGH)
+        low_pos = np.flatnonzero(kind == TIME_LOW)
+        trig_pos = np.flatnonzero(kind == EXT_TRIGGER)
+
+        # TIME_HIGH 展开为含回绕的绝对时间
+        base = self.clock.unwrap(words[high_pos] & 0x0FFF)
+
+        triggers = np.empty(len(trig_pos), dtype=TRIGGER_DTYPE)
+        if len(trig_pos):
+            # 上一块留下的状态放在位置 -1, 每个触发取它之前最近的 TIME_HIGH / TIME_LOW
+            high_at = np.concatenate(([-1], high_pos))
+            low_at = np.concatenate(([-1], low_pos))
+            t_base = np.concatenate(([self.time_base], base))
+            t_low = np.concatenate(([self.time_low], (words[low_pos] & 0x0FFF).astype(np.int64)))
+            hi = np.searchsorted(high_pos, trig_pos)
+            lo = np.searchsorted(low_pos, trig_pos)
+            # TIME_HIGH 之后还没有 TIME_LOW 时低位为 0
+            low = np.where(high_at[hi] > low_at[lo], 0, t_low[lo])
+            w = words[trig_pos]
+            triggers['p'] = w & 0x1
+            triggers['id'] = (w >> 8) & 0xF
+            triggers['t'] = t_base[hi] + low - (self.clock.shift or 0)
+
+        # 状态留给下一块
+        if len(base):
+            self.time_base = int(base[-1])
+            self.time_low = 0
+        if len(low_pos) and (not len(high_pos) or low_pos[-1] > high_pos[-1]):
+            self.time_low = int(words[low_pos[-1]] & 0x0FFF)
+        return triggers
+
+
+def scan_triggers(raw_path, polarity=None, do_time_shifting=True, chunk_words=1 << 24):
+    """
+    扫描 RAW 文件中的全部外部触发.
+
+    :param polarity: 0/1 时只保留该电平 (1 is neg, 0 is pos), None 保留全部
+    :param chunk_words: 每块读入的 16 位字数, 默认 32MB
+    :return: TRIGGER_DTYPE 数组; 不是 EVT 3.0 格式时抛出 ValueError
+    """
+    with open(raw_path, 'rb') as f:
+        header, offset = read_header(f)
+        if not is_evt3(header):
+            raise ValueError('%s is not EVT 3.0 (header %s)' % (raw_path, header))
+        scanner = TriggerScanner(do_time_shifting)
+        size = os.path.getsize(raw_path)
+        parts = []
+        f.seek(offset)
+        buffer = np.empty(chunk_words, dtype=np.uint16)
+        while offset + 1 < size:
+            n = f.readinto(memoryview(buffer).cast('B')) // 2
+            if n == 0:
+                break
+            parts.append(scanner.feed(buffer[:n]))
+            offset += n * 2
+    triggers = np.concatenate(parts) if parts else np.empty(0, dtype=TRIGGER_DTYPE)
+    if polarity in (0, 1):
+        triggers = triggers[triggers['p'] == polarity]
+    return triggers
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Extract external triggers from an EVT 3.0 RAW file.')
+    parser.add_argument('raw', help='event.raw')
+    parser.add_argument('--polarity', type=int, default=0, help='0 (pos), 1 (neg) or -1 for both')
+    parser.add_argument('--out', default=None, help='write trigger times (us) to this txt file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    triggers = scan_triggers(args.raw, polarity=args.polarity)
+    print('%d triggers' % len(triggers))
+    if args.out:
+        np.savetxt(args.out, triggers['t'], fmt='%d')
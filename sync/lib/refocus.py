@@ -0,0 +1,95 @@
+"""
+事件合成孔径重聚焦: 相机沿导轨以速度 v 平移时, 深度 d 处的点在图像上以 v * fx / d 像素/秒 移动,
+把每个事件按 (t - ref_t) 平移回参考时刻后累加, 深度 d 处的目标清晰, 其余深度模糊.
+
+按块处理结构化事件数组 (x, y, p, t): 平移量用 float32 计算, np.bincount 累加到预分配的 int32 图像,
+内存只与块大小有关, 一次顺序扫描完成.
+"""
+import numpy as np
+
+
+class Refocus:
+    """
+    :param v: 导轨速度 m/s
+    :param fx: 相机内参 fx (像素)
+    :param d: 目标深度 m
+    :param ref_t: 参考时刻 us, 该时刻的事件不平移
+    :param origin: 事件坐标原点 (x0, y0), 例如硬件裁剪的左上角
+    :param batch: 像素下标先攒到这么多个再做一次 bincount, EventsIterator 的小块不必每块遍历整幅图像
+    """
+
+    def __init__(self, width=600, height=600, v=0.1775, fx=383.547, d=1.32, ref_t=0, origin=(0, 0),
+                 batch=1 << 20):
+        self.width = width
+        self.height = height
+        self.ref_t = int(ref_t)
+        self.origin = origin
+        # 每 us 平移的像素数
+        self.speed = np.float32(v * fx / d * 1e-6)
+        self.counts = np.zeros(height * width, dtype=np.int32)
+        self.pending = np.empty(batch, dtype=np.int32)
+        self.num_pending = 0
+        self.events = 0
+        self.dropped = 0
+        self.t_min = None
+        self.t_max = None
+
+    def add(self, events):
+        """累加一块事件"""
+        if not len(events):
+            return
+        t = events['t']
+        dx = (t - self.ref_t).astype(np.float32)
+        dx *= self.speed
+        x = np.rint(dx).astype(np.int32)
+        x += events['x']
+        x -= self.origin[0]
+        np.clip(x, 0, self.width - 1, out=x)
+        y = events['y'].astype(np.int32) - self.origin[1]
+        inside = (y >= 0) & (y < self.height)
+        if not inside.all():
+            self.dropped += int(len(y) - inside.sum())
+            x, y = x[inside], y[inside]
+        y *= self.width
+        y += x
+        if self.num_pending + len(y) > len(self.pending):
+            self.flush()
+        if len(y) > len(self.pending):
+            self._accumulate(y)
+        else:
+            self.pending[self.num_pending:self.num_pending + len(y)] = y
+            self.num_pending += len(y)
+        self.events += len(t)
+        self.t_min = int(t[0]) if self.t_min is None else min(self.t_min, int(t[0]))
+        self.t_max = int(t[-1]) if self.t_max is None else max(self.t_max, int(t[-1]))
+
+    def _accumulate(self, index):
+        self.counts += np.bincount(index, minlength=self.counts.size).astype(np.int32, copy=False)
+
+    def flush(self):
+        if self.num_pending:
+            self._accumulate(self.pending[:self.num_pending])
+            self.num_pending = 0
+
+    def image(self):
+        """事件数图像 (height, width) int32"""
+        self.flush()
+        return self.counts.reshape(self.height, self.width)
+
+    def normalized(self):
+        """与原 e_refocus 相同的显示归一化: 超过 3 倍均值的像素置为均值, 再按最大值缩放到 0-255"""
+        image = self.image().astype(np.float64)
+        mean = image.mean()
+        image[image > 3 * mean] = mean
+        peak = image.max()
+        if peak > 0:
+            image /= peak
+        return image * 255
+
+
+def refocus(chunks, **kwargs):
+    """对事件块的可迭代对象 (EventsIterator 或 event_slices.iter_raw_chunks) 做一次重聚焦"""
+    engine = Refocus(**kwargs)
+    for events in chunks:
+        engine.add(events)
+    return engine
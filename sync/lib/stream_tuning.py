@@ -0,0 +1,129 @@
+"""
+传输层 (TL stream) 缓冲区设置与丢帧统计.
+
+主机端缓冲区个数按 帧率 x 可容忍延迟 计算, 并受内存上限约束;
+录制时用 OldestFirst (不丢帧, 按顺序取), 预览时用 NewestOnly (只取最新帧).
+StreamMonitor 在后台线程里定期读取 TL stream 的统计计数.
+"""
+import os
+import json
+import math
+import time
+import threading
+import PySpin
+
+from lib.camera_profile import NodeMapConfigurator
+from lib.frame_meta import META_DIR
+
+HANDLING_MODES = {'record': 'OldestFirst', 'preview': 'NewestOnly'}
+
+# 读取的统计节点, 相机或驱动不支持的节点会被跳过
+STAT_NODES = [
+    'StreamStartedFrameCount',
+    'StreamDeliveredFrameCount',
+    'StreamIncompleteFrameCount',
+    'StreamLostFrameCount',
+    'StreamDroppedFrameCount',
+    'StreamFailedBufferCount',
+    'StreamBufferUnderrunCount',
+    'StreamPacketResendRequestCount',
+]
+
+
+def buffer_count_for(framerate, payload_size, latency_budget=1.0, min_count=10, max_bytes=512 * 1024 * 1024):
+    """按帧率和延迟预算计算缓冲区个数, 总内存不超过 max_bytes"""
+    count = max(min_count, int(math.ceil(framerate * latency_budget)) + 2)
+    if payload_size > 0:
+        count = min(count, max(min_count, max_bytes // payload_size))
+    return count
+
+
+def tune_stream(cam, framerate, latency_budget=1.0, mode='record', max_bytes=512 * 1024 * 1024):
+    """
+    设置 TL stream 的缓冲区个数和处理方式.
+
+    :param cam: Camera to tune, must be initialized.
+    :param framerate: 采集帧率 fps
+    :param latency_budget: 主机最长可能停顿的时间 s, 期间的帧都要能缓存
+    :param mode: 'record' 或 'preview'
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    node_payload = PySpin.CIntegerPtr(cam.GetNodeMap().GetNode('PayloadSize'))
+    payload_size = node_payload.GetValue() if PySpin.IsReadable(node_payload) else 0
+    count = buffer_count_for(framerate, payload_size, latency_budget, max_bytes=max_bytes)
+
+    configurator = NodeMapConfigurator(cam.GetTLStreamNodeMap())
+    profile = {'StreamBufferCountMode': 'Manual',
+               'StreamBufferCountManual': count,
+               'StreamBufferHandlingMode': HANDLING_MODES[mode]}
+    result = configurator.apply(profile)
+    print('stream buffers: %d x %.1f MB, handling %s' % (count, payload_size / 1e6, HANDLING_MODES[mode]))
+    return result
+
+
+class StreamMonitor:
+    """后台定期读取 TL stream 统计, 计数变化时打印, 结束时写入 meta/stream_stats.json"""
+
+    def __init__(self, cam, interval=1.0, verbose=True):
+        self.nodemap = cam.GetTLStreamNodeMap()
+        self.interval = interval
+        self.verbose = verbose
+        self.nodes = {}
+        for name in STAT_NODES:
+            node = PySpin.CIntegerPtr(self.nodemap.GetNode(name))
+            if PySpin.IsReadable(node):
+                self.nodes[name] = node
+        self.series = []
+        self.latest = {}
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def poll(self):
+        values = {name: node.GetValue() for name, node in self.nodes.items()}
+        values['host_ns'] = time.time_ns()
+        changed = any(values[name] != self.latest.get(name) for name in self.nodes)
+        self.latest = values
+        self.series.append(values)
+        if self.verbose and changed:
+            print('stream: ' + ', '.join('%s %d' % (name[6:], values[name]) for name in self.nodes))
+        return values
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except PySpin.SpinnakerException as ex:
+                print('Error: %s' % ex)
+                break
+
+    def start(self):
+        self.poll()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """结束后台线程, 可以重复调用 (没有在运行时不再读取节点)"""
+        if self.thread is None:
+            return self.latest
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        return self.poll()
+
+    def lost(self):
+        """开始以来丢失/不完整的帧数"""
+        if not self.series:
+            return 0
+        first, last = self.series[0], self.series[-1]
+        return sum(last[name] - first[name] for name in
+                   ('StreamLostFrameCount', 'StreamDroppedFrameCount', 'StreamIncompleteFrameCount')
+                   if name in self.nodes)
+
+    def save(self, path):
+        meta_path = os.path.join(path, META_DIR)
+        if not os.path.exists(meta_path):
+            os.makedirs(meta_path)
+        with open(os.path.join(meta_path, 'stream_stats.json'), 'w') as f:
+            json.dump({'final': self.latest, 'lost': self.lost(), 'series': self.series}, f)
@@ -0,0 +1,190 @@
+"""
+FLIR 相机时钟 (chunk 时间戳 ns) 与 EVK4 传感器时钟 (触发时间 us) 之间的在线对齐.
+
+两个时钟近似线性关系 evk4_us = offset + slope * flir_us, slope - 1 即漂移 (ppm 量级).
+每来一对 (FLIR 帧时间, EVK4 触发时间) 做一次带遗忘因子的递推最小二乘 (加权均值/协方差),
+用当前模型的残差剔除错配对 (丢帧/丢触发时两者差一个周期); 转换是 O(1) 的一次乘加.
+模型保存在采集目录 meta/clock_model.json, 离线切事件窗口时直接加载, 不需要重新拟合.
+"""
+import os
+import json
+import argparse
+import numpy as np
+
+from lib.frame_meta import META_DIR
+
+MODEL_FILE = 'clock_model.json'
+
+
+class ClockModel:
+    """
+    :param forget: 遗忘因子, 1.0 为普通最小二乘, 小于 1 时跟踪随温度变化的漂移
+    :param reject_sigma: 残差超过 reject_sigma 倍残差尺度 (且超过 min_tolerance_us) 时剔除
+    :param min_tolerance_us: 剔除门限的下限 us, 避免拟合很好时把正常抖动当成离群
+    :param warmup: 前 warmup 对只做粗检查, 不按残差剔除
+    :param max_rejects: 连续剔除这么多对后认为对应关系整体错位, 清空模型重新拟合
+    """
+
+    def __init__(self, forget=1.0, reject_sigma=6.0, min_tolerance_us=50.0, warmup=3, max_rejects=8):
+        self.forget = forget
+        self.reject_sigma = reject_sigma
+        self.min_tolerance_us = min_tolerance_us
+        self.warmup = warmup
+        self.max_rejects = max_rejects
+
+        self.accepted = 0
+        self.rejected = 0
+        self.relocks = 0
+        self.reset()
+
+    def reset(self):
+        """丢弃当前拟合, 下一对重新作为参考点"""
+        self.flir_ref = None      # 参考点 (整数 ns / us), 内部用相对值保证 float64 精度
+        self.evk4_ref = None
+        self.weight = 0.0
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.cxx = 0.0
+        self.cxy = 0.0
+        self.scale = 0.0          # 残差尺度 us (|残差| 的指数平均)
+        self.consecutive_rejects = 0
+        self.slope = 1.0
+        self.intercept = 0.0      # 相对参考点: y = intercept + slope * x
+
+    def add(self, flir_ns, evk4_us):
+        """
+        加入一对时间, 返回是否被采用.
+
+        :param flir_ns: FLIR chunk 时间戳 ns
+        :param evk4_us: 对应的 EVK4 触发时间 us
+        """
+        flir_ns, evk4_us = int(flir_ns), int(evk4_us)
+        if self.flir_ref is None:
+            self.flir_ref, self.evk4_ref = flir_ns, evk4_us
+        x = (flir_ns - self.flir_ref) / 1000.0
+        y = float(evk4_us - self.evk4_ref)
+
+        if self.count > 0:
+            r = y - (self.intercept + self.slope * x)
+            tolerance = max(self.reject_sigma * self.scale, self.min_tolerance_us)
+            if self.count < self.warmup:
+                # 斜率还不可信, 只检查偏移是否在一个很宽的范围内
+                tolerance = max(tolerance, 1e-3 * abs(x) + self.min_tolerance_us * 10)
+            if abs(r) > tolerance:
+                self.rejected += 1
+                self.consecutive_rejects += 1
+                if self.consecutive_rejects >= self.max_rejects:
+                    print('clock model: %d consecutive outliers, relocking' % self.consecutive_rejects)
+                    self.relocks += 1
+                    self.reset()
+                return False
+            # 残差尺度, 第一次用实际残差初始化
+            self.scale = abs(r) if self.count == 1 else 0.9 * self.scale + 0.1 * abs(r)
+
+        # 加权递推均值与协方差
+        self.weight = self.forget * self.weight + 1.0
+        dx = x - self.mean_x
+        self.mean_x += dx / self.weight
+        dy = y - self.mean_y
+        self.mean_y += dy / self.weight
+        self.cxx = self.forget * self.cxx + dx * (x - self.mean_x)
+        self.cxy = self.forget * self.cxy + dx * (y - self.mean_y)
+        self.count += 1
+        self.accepted += 1
+        self.consecutive_rejects = 0
+
+        if self.count >= 2 and self.cxx > 0:
+            self.slope = self.cxy / self.cxx
+        self.intercept = self.mean_y - self.slope * self.mean_x
+        return True
+
+    def add_pairs(self, flir_ns, evk4_us):
+        """批量加入, 返回被采用的个数"""
+        return sum(self.add(f, e) for f, e in zip(flir_ns, evk4_us))
+
+    def to_evk4(self, flir_ns):
+        """FLIR 时间 ns -> EVK4 时间 us, 支持标量和数组"""
+        if self.flir_ref is None:
+            raise ValueError('clock model has no data')
+        x = (np.asarray(flir_ns, dtype=np.int64) - self.flir_ref) / 1000.0
+        return self.evk4_ref + self.intercept + self.slope * x
+
+    def to_flir(self, evk4_us):
+        """EVK4 时间 us -> FLIR 时间 ns, 支持标量和数组"""
+        if self.flir_ref is None:
+            raise ValueError('clock model has no data')
+        y = np.asarray(evk4_us, dtype=np.int64) - self.evk4_ref
+        return self.flir_ref + (y - self.intercept) / self.slope * 1000.0
+
+    @property
+    def drift_ppm(self):
+        return (self.slope - 1.0) * 1e6
+
+    def state(self):
+        return {'flir_ref_ns': self.flir_ref, 'evk4_ref_us': self.evk4_ref,
+                'slope': self.slope, 'intercept_us': self.intercept, 'drift_ppm': self.drift_ppm,
+                'residual_us': self.scale, 'pairs': self.count, 'accepted': self.accepted,
+                'rejected': self.rejected, 'relocks': self.relocks,
+                'forget': self.forget, 'weight': self.weight, 'mean_x': self.mean_x, 'mean_y': self.mean_y,
+                'cxx': self.cxx, 'cxy': self.cxy}
+
+    def summary(self):
+        return 'clock model: %d pairs (%d rejected, %d relocks), drift %.2f ppm, residual %.1f us' % (
+            self.count, self.rejected, self.relocks, self.drift_ppm, self.scale)
+
+    def save(self, path):
+        """写 path/meta/clock_model.json, 长时间录制中可反复调用"""
+        meta_path = os.path.join(path, META_DIR)
+        if not os.path.exists(meta_path):
+            os.makedirs(meta_path)
+        tmp = os.path.join(meta_path, MODEL_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.state(), f, indent=1)
+        os.replace(tmp, os.path.join(meta_path, MODEL_FILE))
+
+    @classmethod
+    def load(cls, path):
+        """读取 path/meta/clock_model.json, 可继续 add"""
+        with open(os.path.join(path, META_DIR, MODEL_FILE)) as f:
+            state = json.load(f)
+        model = cls(forget=state.get('forget', 1.0))
+        model.flir_ref, model.evk4_ref = state['flir_ref_ns'], state['evk4_ref_us']
+        model.slope, model.intercept = state['slope'], state['intercept_us']
+        model.scale = state['residual_us']
+        model.count, model.accepted = state['pairs'], state['accepted']
+        model.rejected, model.relocks = state['rejected'], state['relocks']
+        model.weight = state['weight']
+        model.mean_x, model.mean_y = state['mean_x'], state['mean_y']
+        model.cxx, model.cxy = state['cxx'], state['cxy']
+        return model
+
+
+def fit_trigger_map(table, model=None):
+    """用帧 <-> 触发对应表 (frame_accounting.MAP_DTYPE) 中两边都有的行拟合"""
+    if model is None:
+        model = ClockModel()
+    matched = (table['row'] >= 0) & (table['trigger_index'] >= 0)
+    model.add_pairs(table['timestamp'][matched], table['trigger_ts'][matched])
+    return model
+
+
+def fit_session(path):
+    """由 meta/frame_trigger_map.npy 拟合并保存 meta/clock_model.json"""
+    table = np.load(os.path.join(path, META_DIR, 'frame_trigger_map.npy'))
+    model = fit_trigger_map(table)
+    if model.count:
+        model.save(path)
+    print(model.summary())
+    return model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Fit the FLIR <-> EVK4 clock model of a recorded session.')
+    parser.add_argument('path', help='camera directory containing meta/frame_trigger_map.npy')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    fit_session(args.path)
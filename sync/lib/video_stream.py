@@ -0,0 +1,205 @@
+"""
+边采集边编码的视频写入, 代替采集结束后再调用的 save_list_to_avi.
+
+采集线程把帧放入有界队列, 编码线程取出后写入当前视频文件,
+文件达到 max_bytes 或 max_seconds (按帧率计算的视频时长) 时切换到下一个文件.
+后端可选 OpenCV VideoWriter (输入 Bayer, 在编码线程中解马赛克) 或 PySpin.SpinVideo.
+"""
+import os
+import time
+import queue
+import threading
+import numpy as np
+import cv2 as cv
+
+from lib.pipeline_writer import BAYER_RG_TO_BGR
+
+VIDEO_TYPES = ('uncompressed', 'mjpg', 'h264')
+
+# OpenCV fourcc, 0 为不压缩; h264 依次尝试
+_FOURCCS = {
+    'uncompressed': [0],
+    'mjpg': [cv.VideoWriter_fourcc(*'MJPG')],
+    'h264': [cv.VideoWriter_fourcc(*'avc1'), cv.VideoWriter_fourcc(*'H264'), cv.VideoWriter_fourcc(*'X264')],
+}
+
+
+class _OpenCVSegment:
+    def __init__(self, filename, video_type, width, height, framerate, color=True):
+        self.filename = filename + '.avi'
+        self.color = color
+        self.writer = None
+        for fourcc in _FOURCCS[video_type]:
+            self.writer = cv.VideoWriter(self.filename, fourcc, framerate, (width, height), color)
+            if self.writer.isOpened():
+                break
+        if self.writer is None or not self.writer.isOpened():
+            raise IOError('unable to open %s video %s' % (video_type, self.filename))
+
+    def append(self, frame):
+        if self.color and frame.ndim == 2:
+            frame = cv.cvtColor(frame, BAYER_RG_TO_BGR)
+        self.writer.write(frame)
+
+    def size(self):
+        return os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+
+    def close(self):
+        self.writer.release()
+
+
+class _SpinVideoSegment:
+    def __init__(self, filename, video_type, width, height, framerate, pixel_format='BayerRG8',
+                 quality=75, bitrate=1000000):
+        import PySpin
+        self.PySpin = PySpin
+        self.filename = filename + '.avi'
+        self.width = width
+        self.height = height
+        self.pixel_format = getattr(PySpin, 'PixelFormat_' + pixel_format)
+        if video_type == 'uncompressed':
+            option = PySpin.AVIOption()
+        elif video_type == 'mjpg':
+            option = PySpin.MJPGOption()
+            option.quality = quality
+        else:
+            option = PySpin.H264Option()
+            option.bitrate = bitrate
+        option.frameRate = framerate
+        option.height = height
+        option.width = width
+        self.recorder = PySpin.SpinVideo()
+        # SpinVideo 会自动加上扩展名
+        self.recorder.Open(filename, option)
+
+    def append(self, frame):
+        image = self.PySpin.Image.Create(self.width, self.height, 0, 0, self.pixel_format, frame)
+        self.recorder.Append(image)
+
+    def size(self):
+        return os.path.getsize(self.filename) if os.path.exists(self.filename) else 0
+
+    def close(self):
+        self.recorder.Close()
+
+
+class StreamingVideoWriter:
+    """
+    有界队列 + 编码线程. 也可以直接作为 FramePool 的 sink 使用: writer(frame, i).
+
+    :param video_type: 'uncompressed', 'mjpg' 或 'h264'
+    :param backend: 'opencv' 或 'spinvideo'
+    :param policy: 队列满时 'block' 等待编码线程, 'drop' 丢弃该帧
+    :param max_bytes: 单个文件的最大字节数, None 不限制
+    :param max_seconds: 单个文件的最长视频时长 s, None 不限制
+    """
+
+    def __init__(self, path, width, height, framerate, video_type='mjpg', backend='opencv',
+                 basename='video', queue_size=32, policy='block', max_bytes=None, max_seconds=None):
+        if video_type not in VIDEO_TYPES:
+            raise ValueError('video_type must be one of %s' % ', '.join(VIDEO_TYPES))
+        self.path = path
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.video_type = video_type
+        self.backend = backend
+        self.basename = basename
+        self.policy = policy
+        self.max_bytes = max_bytes
+        self.max_frames = int(max_seconds * framerate) if max_seconds else None
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.files = []
+        self.segment = None
+        self.segment_frames = 0
+        self.written_count = 0
+        self.dropped_count = 0
+        self.max_queued = 0
+        self.error = None
+        self.last_write = None
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame, timeout=None):
+        """拷贝一帧放入队列, 返回是否成功入队"""
+        if self.error is not None:
+            self.dropped_count += 1
+            return False
+        item = np.array(frame, copy=True)
+        try:
+            if self.policy == 'drop':
+                self.queue.put_nowait(item)
+            else:
+                self.queue.put(item, timeout=timeout)
+        except queue.Full:
+            self.dropped_count += 1
+            return False
+        queued = self.queue.qsize()
+        if queued > self.max_queued:
+            self.max_queued = queued
+        return True
+
+    def __call__(self, frame, i):
+        self.submit(frame)
+
+    def _open_segment(self):
+        filename = os.path.join(self.path, '%s-%s-%03d' % (self.basename, self.video_type.upper(), len(self.files)))
+        if self.backend == 'spinvideo':
+            self.segment = _SpinVideoSegment(filename, self.video_type, self.width, self.height, self.framerate)
+        else:
+            self.segment = _OpenCVSegment(filename, self.video_type, self.width, self.height, self.framerate)
+        self.files.append(self.segment.filename)
+        self.segment_frames = 0
+
+    def _close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            print('Video saved at %s (%d frames)' % (self.segment.filename, self.segment_frames))
+            self.segment = None
+
+    def _rollover_due(self):
+        if self.max_frames is not None and self.segment_frames >= self.max_frames:
+            return True
+        # 文件大小只在每秒左右检查一次
+        if self.max_bytes is not None and self.segment_frames % max(1, int(self.framerate)) == 0:
+            return self.segment.size() >= self.max_bytes
+        return False
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                if self.segment is not None and self._rollover_due():
+                    self._close_segment()
+                if self.segment is None:
+                    self._open_segment()
+                self.segment.append(frame)
+                self.segment_frames += 1
+                self.written_count += 1
+                self.last_write = time.perf_counter()
+            except Exception as ex:
+                self.error = ex
+                print('Error: %s' % ex)
+        try:
+            self._close_segment()
+        except Exception as ex:
+            self.error = ex
+            print('Error: %s' % ex)
+
+    def close(self):
+        """等待队列中的帧编码完, 返回视频文件列表"""
+        if self.thread is not None:
+            start = time.perf_counter()
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            print('video: %d frames in %d file(s), %d dropped, max queued %d, finished %.2fs after close'
+                  % (self.written_count, len(self.files), self.dropped_count, self.max_queued,
+                     time.perf_counter() - start))
+        return self.files
@@ -19,6 +19,8 @@ from metavision_core.event_io.raw_reader import RawReader
 from metavision_core.event_io import EventsIterator
 from metavision_hal import I_TriggerIn
 from metavision_core.event_io.raw_reader import initiate_device
+from lib.video_stream import StreamingVideoWriter, VIDEO_TYPES
+from lib.demosaic import demosaic_session
 
 
 # 全局变量设置
@@ -32,6 +34,8 @@ EXPOSURE_TIME = 50000 # us
 Auto_Exposure = False
 EX_Trigger = False
 Save_mode = True  ## 单张存false npy true
+STORE_BAYER = True  # 采集时只存 Bayer, 采集结束后再并行解马赛克
+DEMOSAIC_ALGORITHM = 'ea'  # 'bilinear', 'vng', 'ea'
 OFFSET_X = 224
 OFFSET_Y = 524
 WIDTH = 2000
@@ -43,6 +47,10 @@ class AviType:
     H264 = 2
 
 chosenAviType = AviType.UNCOMPRESSED  # change me!
+STREAM_VIDEO = False    # 采集的同时按 chosenAviType 编码视频, 代替采集后的 save_list_to_avi
+VIDEO_BACKEND = 'opencv'  # 'opencv' 或 'spinvideo'
+VIDEO_MAX_SECONDS = 600   # 单个视频文件最长时长 s, 超过后切换到新文件
+VIDEO_MAX_BYTES = 4 * 1024 ** 3  # 单个视频文件最大字节数
 # prophesee camera set
 stc_filter_ths = 10000  # Length of the time window for filtering (in us)
 stc_cut_trail = True  # If true, after an event goes through, it removes all events until change of polarity
@@ -654,6 +662,11 @@ def acquire_images(cam, nodemap,path,mode):
         images = list()
         timestamps = list()
         exposure_times = list()
+        video = None
+        if STREAM_VIDEO:
+            video = StreamingVideoWriter(path, WIDTH, HEIGHT, FRAMERATE, video_type=VIDEO_TYPES[chosenAviType],
+                                         backend=VIDEO_BACKEND, max_bytes=VIDEO_MAX_BYTES,
+                                         max_seconds=VIDEO_MAX_SECONDS)
         for i in range(NUM_IMAGES):
             try:
                 # Retrieve next received image and ensure image completion
@@ -677,8 +690,14 @@ def acquire_images(cam, nodemap,path,mode):
                     exposure_times.append(exposure_time)
                     timestamps.append(timestamp)
                     
-                    # Convert image to RGB8
-                    images.append(processor.Convert(image_result, PySpin.PixelFormat_RGB8).GetNDArray())
+                    if STORE_BAYER:
+                        # 只拷贝 Bayer 数据, 解马赛克放到采集结束后
+                        images.append(np.array(image_result.GetNDArray()))
+                    else:
+                        # Convert image to RGB8
+                        images.append(processor.Convert(image_result, PySpin.PixelFormat_RGB8).GetNDArray())
+                    if video is not None:
+                        video.submit(image_result.GetNDArray())
                     
                     
                 # Release image
@@ -691,6 +710,8 @@ def acquire_images(cam, nodemap,path,mode):
         # End acquisition
         print(f'we acquiring {len(images)} images')
         cam.EndAcquisition()
+        if video is not None:
+            video.close()
 
 
         global acquisition_flag
@@ -710,11 +731,19 @@ def acquire_images(cam, nodemap,path,mode):
         images[:] = images[1:] 
         print(f'after discarding first image, we have {len(images)} images')
         index = len(images)//2
-        filename = os.path.join(path, 'image_center.png')
-        cv.imwrite(filename, images[index])
-        images = np.array(images)
-        filename = os.path.join(path, 'image')
-        np.save(filename,images)
+        if STORE_BAYER:
+            bayer_filename = os.path.join(path, 'image_bayer.npy')
+            np.save(bayer_filename, np.array(images))
+            filename = os.path.join(path, 'image.npy')
+            demosaic_session(bayer_filename, filename, output='npy', algorithm=DEMOSAIC_ALGORITHM)
+            images = np.load(filename, mmap_mode='r')
+            cv.imwrite(os.path.join(path, 'image_center.png'), images[index])
+        else:
+            filename = os.path.join(path, 'image_center.png')
+            cv.imwrite(filename, images[index])
+            images = np.array(images)
+            filename = os.path.join(path, 'image')
+            np.save(filename,images)
         et_txt.close()
         ts_txt.close()
         print('end saving images...')
@@ -21,13 +21,36 @@ from metavision_core.event_io.raw_reader import RawReader
 from metavision_core.event_io import EventsIterator
 from metavision_hal import I_TriggerIn
 from metavision_core.event_io.raw_reader import initiate_device
-
+from lib.frame_pool import FramePool, RawFileSink, AcquisitionEngine
+from lib.frame_container import ContainerSink
+from lib.frame_compress import CompressedSink
+from lib.frame_meta import FrameMetaWriter, FrameMeta
+from lib.camera_profile import NodeMapConfigurator
+from lib.stream_tuning import tune_stream, StreamMonitor
+from lib.frame_accounting import FrameAccounting, map_triggers
+from lib.evk4 import extract_triggers, RawLogPump
+from lib.raw_index import IndexBuilder
+from lib.timebase import fit_trigger_map
+from lib.packed_pixels import frame_layout, is_packed
 
 
 # 全局变量设置
 NUM_IMAGES = 3+1  # number of images to save
 #prophesee first trigger is incompelete, so we save one more image
 # evk4 触发反向了
+POOL_SLOTS = 16  # 帧缓存池槽数, 2000x1000 BayerRG8 约 32MB
+SAVE_CONTAINER = True  # True 写单文件容器 frames.frc, False 每帧一个 .raw
+COMPRESS_CODEC = None  # 'zlib' / 'lz4' / 'zstd' 时无损压缩写入 frames.cfz, None 不压缩
+COMPRESS_WORKERS = 4
+USE_PROFILE = True     # True 用声明式配置 camera_profile(), 只写有变化的节点
+PIXEL_FORMAT = 'BayerRG8'  # 'BayerRG10p' / 'BayerRG12p' 保留位深, 链路带宽为 8 位的 1.25 / 1.5 倍 (需 USE_PROFILE)
+STREAM_LATENCY_BUDGET = 2.0  # s, 主机缓冲区至少能缓存这么长时间的帧
+# FLIR 触发序号 = EVK4 触发序号 + TRIGGER_OFFSET. EVK4 收不到第一个脉冲 (原来保留 triggers[:NUM_IMAGES-1],
+# V2 丢弃 images[0]), 所以 FLIR 第 k 帧对应 EVK4 第 k-1 个触发, 第 0 帧没有触发
+TRIGGER_OFFSET = 1
+EVENT_LOW_CPU = True  # True 时 EVK4 只取原始缓冲区写盘 (RawLogPump), False 用 EventsIterator 解码后丢弃
+EVENT_POLL_INTERVAL = 0.05  # s, 低 CPU 录制的轮询间隔
+EVENT_INDEX = False  # True 时录制中建立时间索引 event.raw.tidx.npz (需 EVENT_LOW_CPU); False 时 IndexedRaw 第一次读取时离线建立
 ## flir camera set
 FRAMERATE = int(10) # fps
 EXPOSURE_TIME = 50000 # us
@@ -98,11 +121,10 @@ class event():
         self.ieventstream = None
         self.device = None
     def prophesee_tirgger_found(self,polarity: int = 0,do_time_shifting=True):
-        triggers = None
-        with RawReader(str(self.outputpath), do_time_shifting=do_time_shifting) as ev_data:
-            while not ev_data.is_done():
-                a = ev_data.load_n_events(1000000)
-            triggers = ev_data.get_ext_trigger_events()
+        start = time.perf_counter()
+        # 只扫描时间字和触发字, 不解码 CD 事件
+        triggers = extract_triggers(self.outputpath, polarity=None, do_time_shifting=do_time_shifting)
+        print(f"trigger extraction took {time.perf_counter() - start:.2f}s")
         print(f"total triggers num = {len(triggers)} pos and neg")
 
         #---------------需要测试触发信号的数量和时间----------------#
@@ -126,10 +148,7 @@ class event():
             trigger_polar = np.array(trigger_polar)
             trigger_time = np.array(trigger_time)
             # wirte time to a txt file
-            with open(os.path.join(self.path, 'event', 'TimeStamps.txt'), "w+") as f:
-                for i in range(len(trigger_time)):
-                    timestamp =trigger_time[i]
-                    f.write('{}'.format(int(timestamp)) +'\n')
+            np.savetxt(os.path.join(self.path, 'event', 'TimeStamps.txt'), trigger_time, fmt='%d')
         except:
             print(f"no trigger signal!")
         return triggers
@@ -167,13 +186,25 @@ class event():
         else:
             print("no events stream")
 
+        global acquisition_flag
+        global running
+        if EVENT_LOW_CPU:
+            # 不解码事件, 每 EVENT_POLL_INTERVAL 秒取空一次原始缓冲区
+            indexer = IndexBuilder() if EVENT_INDEX else None
+            pump = RawLogPump(self.ieventstream, EVENT_POLL_INTERVAL, indexer.feed if indexer else None)
+            pump.run(should_stop=lambda: acquisition_flag == 1 or not running)
+            self.ieventstream.stop_log_raw_data()
+            if indexer is not None and pump.callback_error is None:
+                indexer.save(self.outputpath)
+            print(pump.summary())
+            print("event stop recording")
+            return 0
+
         mv_iterator = EventsIterator.from_device(device=self.device, max_duration=1200000000)
         # 接受事件流
         print("events stream start")
         height, width = mv_iterator.get_size()  # Camera Geometry
         print(f"height = {height}, width = {width}")
-        global acquisition_flag
-        global running
         print("flag is ",acquisition_flag)
         for evs in mv_iterator:
             if acquisition_flag == 1 or not running:
@@ -534,6 +565,37 @@ def config_camera(nodemap):
     return result
 
 
+def camera_profile():
+    """与 config_camera 相同的配置, 以节点名 -> 值的有序 dict 描述"""
+    profile = {'PixelFormat': PIXEL_FORMAT,
+               'Width': WIDTH, 'Height': HEIGHT, 'OffsetX': OFFSET_X, 'OffsetY': OFFSET_Y}
+    if Auto_Exposure:
+        profile['AutoExposureExposureTimeUpperLimit'] = 5000000.0
+        profile['ExposureAuto'] = 'Continuous'
+    else:
+        profile['ExposureAuto'] = 'Off'
+        profile['ExposureMode'] = 'Timed'
+        profile['ExposureTime'] = float(EXPOSURE_TIME)
+    profile['GainAuto'] = 'Off'
+    profile['BalanceWhiteAuto'] = 'Off'
+    profile['DeviceLinkThroughputLimit'] = 43000000
+    profile['TriggerSelector'] = 'FrameStart'
+    if EX_Trigger:
+        profile['TriggerSource'] = 'Line3'
+        profile['TriggerMode'] = 'On'
+        profile['TriggerActivation'] = 'RisingEdge'
+        profile['TriggerOverlap'] = 'ReadOut'
+    else:
+        profile['TriggerMode'] = 'Off'
+        profile['TriggerSource'] = 'Software'
+    profile['AcquisitionMode'] = 'Continuous'
+    profile['AcquisitionFrameRateEnable'] = True
+    profile['AcquisitionFrameRate'] = float(FRAMERATE)
+    profile['ChunkModeActive'] = True
+    profile['chunks'] = 'all'
+    return profile
+
+
 def disable_chunk_data(nodemap):
     """
     This function disables each type of chunk data before disabling chunk data mode.
@@ -691,67 +753,61 @@ def read_chunk_data(image):
 
 
 
-def acquire_images(cam, nodemap, path):
+def acquire_images(cam, nodemap, path, stats=None):
     print('*** IMAGE ACQUISITION ***\n')
+    # 预分配固定数量的缓存槽, 采集的同时由写盘线程写 raw 文件, 内存不随采集张数增长
+    # 打包格式按原始字节保存, 每行 WIDTH * 位深 / 8 字节, 离线用 lib.packed_pixels 解包
+    pixel_format = PIXEL_FORMAT if USE_PROFILE else 'BayerRG8'
+    (height, row), dtype = frame_layout(pixel_format, HEIGHT, WIDTH)
+    pool = FramePool(POOL_SLOTS, height, row, dtype=dtype)
+    if COMPRESS_CODEC:
+        sink = CompressedSink(path, (OFFSET_X, OFFSET_Y, row, height), pixel_format=pixel_format, dtype=dtype,
+                              codec=COMPRESS_CODEC, num_workers=COMPRESS_WORKERS)
+    elif SAVE_CONTAINER:
+        sink = ContainerSink(path, (OFFSET_X, OFFSET_Y, row, height), capacity=NUM_IMAGES,
+                             pixel_format=pixel_format, dtype=dtype)
+    else:
+        sink = RawFileSink(path, (OFFSET_X, OFFSET_Y, WIDTH, HEIGHT))
+    # 每帧的 chunk 数据按列写到 meta/, 结束后导出旧格式的 txt
+    meta = FrameMetaWriter(path)
+    # 按 FrameID 编号, 丢帧时后面的帧不会前移, 文件名/frame_index 即触发序号
+    engine = AcquisitionEngine(cam, pool, sink, timeout=1000, meta=meta, accounting=FrameAccounting(),
+                               raw=is_packed(pixel_format))
+    # 传输层丢帧统计
+    monitor = StreamMonitor(cam, interval=1.0)
+    monitor.start()
+    global running
     try:
-        # 预分配内存
-        images = np.empty((NUM_IMAGES, HEIGHT, WIDTH), dtype=np.uint8)
-        timestamps = np.zeros(NUM_IMAGES, dtype=np.uint64)
-        exposure_times = np.zeros(NUM_IMAGES, dtype=float)
-        
-        # 创建图像处理器
-        # processor = PySpin.ImageProcessor()
-        # processor.SetColorProcessing(PySpin.SPINNAKER_COLOR_PROCESSING_ALGORITHM_HQ_LINEAR)
-        
-        global running
-        for i in range(NUM_IMAGES):
-            if not running:
-                break
-            try:
-                image_result = cam.GetNextImage(1000)
-                
-                if image_result.IsIncomplete():
-                    print(f'Image incomplete with status {image_result.GetImageStatus()}')
-                    image_result.Release()
-                    continue
-                
-                # 直接获取图像数据并转换
-                # converted = processor.Convert(image_result, PySpin.PixelFormat_RGB8)
-                #这里需要保存原始的RG8数据，raw文件
-                images[i] = image_result.GetNDArray()
-                
-                # 读取时间戳等信息
-                _, exposure_times[i], timestamps[i] = read_chunk_data(image_result)
-                # print(f"exposure time is {exposure_times[i]} us")
-                image_result.Release()
-                
-            except PySpin.SpinnakerException as ex:
-                print(f'Error: {ex}')
-                return False
-        
+        engine.run(NUM_IMAGES, should_stop=lambda: not running, period=1.0 / FRAMERATE)
+        monitor.stop()
         # 结束采集
         cam.EndAcquisition()
-        global acquisition_flag
-        acquisition_flag = 1
-        for i, img_data in enumerate(images):
-            filename = os.path.join(path, f"{i:05d}.raw")
-            with open(filename, 'wb') as f:
-                # 写入ROI信息
-                f.write(np.array([OFFSET_X, OFFSET_Y, WIDTH, HEIGHT], dtype=np.int32).tobytes())
-                # 写入图像数据
-                f.write(img_data.tobytes())
-
-
-        # 保存时间戳和曝光时间
-        np.savetxt(os.path.join(path, 'exposure_times.txt'), exposure_times)
-        np.savetxt(os.path.join(path, 'timestamps.txt'), timestamps)
-        
-        return True
-        
+        result = engine.finish()
+        FrameMeta(path).export_txt(path)
+
     except PySpin.SpinnakerException as ex:
         print(f'Error: {ex}')
-        return False
-    
+        engine.finish()
+        result = False
+    finally:
+        monitor.stop()
+    monitor.save(path)
+    print(f'stream lost/dropped/incomplete frames: {monitor.lost()}')
+
+    if stats is not None:
+        stats.update({'grabbed': engine.grabbed_count, 'incomplete': engine.incomplete_count,
+                      'elapsed': engine.elapsed, 'bytes': engine.grabbed_count * pool.buffers[0].nbytes,
+                      'missing': engine.accounting.missing_count, 'result': result})
+        if getattr(sink, 'stats', None):
+            stats['stored_bytes'] = sink.stats['stored_bytes']
+    return result
+
+
+def get_serial_number(nodemap_tldevice):
+    node_serial = PySpin.CStringPtr(nodemap_tldevice.GetNode('DeviceSerialNumber'))
+    if PySpin.IsReadable(node_serial):
+        return node_serial.GetValue()
+    return ''
 
 
 def main():
@@ -809,78 +865,126 @@ def main():
     ensure_dir(path) 
     prophesee_cam = event(0,path)
     prophesee_cam.config_prophesee()
-    # Run example on each camera
-    for i, cam in enumerate(cam_list):
 
-        print('Running example for camera %d...' % i)
+    # 先初始化并配置所有相机, 多于一台时每台相机的数据存到以序列号命名的子目录
+    cameras = []
+    for i, cam in enumerate(cam_list):
         try:
-            result = True
-
-            # Retrieve TL device nodemap and print device information
             nodemap_tldevice = cam.GetTLDeviceNodeMap()
-
-            # result &= print_device_info(nodemap_tldevice)
-
+            serial_number = get_serial_number(nodemap_tldevice) or str(i)
             # Initialize camera
             cam.Init()
-            print("init")
+            print("init camera %d (%s)" % (i, serial_number))
             # Retrieve GenICam nodemap
             nodemap = cam.GetNodeMap()
 
             # Configure camera
-            if config_camera(nodemap) is False:
+            if USE_PROFILE:
+                configured = NodeMapConfigurator(nodemap).apply(camera_profile())
+            else:
+                configured = config_camera(nodemap)
+            if configured is False:
                 cam.DeInit()
-                cam_list.Clear()
-                system.ReleaseInstance() 
-                return False
-            # acquire images  flag 
-            global acquisition_flag
-
-            acquisition_flag = 0
-            #  Begin acquiring images
-            cam.BeginAcquisition()
-            # 多线程配置 
-            print("线程开始")
-            prophesee_thread = Thread(target=prophesee_cam.start_recording,args=()) 
+                continue
+            # 按帧率和延迟预算设置主机缓冲区, 录制时按顺序取帧
+            tune_stream(cam, FRAMERATE, STREAM_LATENCY_BUDGET, mode='record')
+            cam_path = path if num_cameras == 1 else os.path.join(path, serial_number)
+            ensure_dir(cam_path)
+            cameras.append((cam, nodemap, serial_number, cam_path))
+        except PySpin.SpinnakerException as ex:
+            print('Error: %s' % ex)
 
-            flir_thread = Thread(target=acquire_images,args=(cam,nodemap,path))
+    if len(cameras) == 0:
+        del cam
+        cam_list.Clear()
+        system.ReleaseInstance()
+        return False
 
-            #多线程启动
-            prophesee_thread.start()
+    # acquire images  flag 
+    global acquisition_flag
+    acquisition_flag = 0
+    try:
+        #  Begin acquiring images
+        for cam, nodemap, serial_number, cam_path in cameras:
+            cam.BeginAcquisition()
+        # 多线程配置: 每台 FLIR 一个采集线程和缓存池, EVK4 一个录制线程
+        print("线程开始")
+        prophesee_thread = Thread(target=prophesee_cam.start_recording,args=()) 
+        flir_threads = []
+        stats = {}
+        for cam, nodemap, serial_number, cam_path in cameras:
+            stats[serial_number] = {}
+            flir_threads.append(Thread(target=acquire_images,
+                                       args=(cam, nodemap, cam_path, stats[serial_number])))
+
+        #多线程启动
+        start_time = time.time()
+        prophesee_thread.start()
+        for flir_thread in flir_threads:
             flir_thread.start()
-            ##-------------  发送指令  --------—--------##
+        ##-------------  发送指令  --------—--------##
 
-            # 示例：发送产生NUM_IMAGES个频率为FRAMERATE Hz脉冲的指令  
-            send_pulse_command(NUM_IMAGES,FRAMERATE)
-            # 关闭串口  
-            ser.close()
+        # 示例：发送产生NUM_IMAGES个频率为FRAMERATE Hz脉冲的指令  
+        send_pulse_command(NUM_IMAGES,FRAMERATE)
+        # 关闭串口  
+        ser.close()
 
-            ##-----------------------------------------##
-            prophesee_thread.join()
+        ##-----------------------------------------##
+        for flir_thread in flir_threads:
             flir_thread.join()
-            # 将存放都放在了 acquire 函数里
-            try : 
-                acquisition_flag = 0 # 结束了采集
-                prophesee_cam.prophesee_tirgger_found()
-            except :
-                print("save is wrong")
+        elapsed = time.time() - start_time
+        acquisition_flag = 1
+        prophesee_thread.join()
+
+        total_frames = sum(st.get('grabbed', 0) for st in stats.values())
+        total_bytes = sum(st.get('bytes', 0) for st in stats.values())
+        for serial_number, st in stats.items():
+            print('camera %s: %d frames, %d incomplete, %d missing'
+                  % (serial_number, st.get('grabbed', 0), st.get('incomplete', 0), st.get('missing', 0)))
+            result &= bool(st.get('result', False))
+        print('total %d frames from %d cameras in %.2fs, %.2f fps, %.1f MB/s'
+              % (total_frames, len(cameras), elapsed, total_frames / elapsed, total_bytes / elapsed / 1e6))
+        if COMPRESS_CODEC:
+            stored_bytes = sum(st.get('stored_bytes', 0) for st in stats.values())
+            print('%s compressed to disk: %.1f MB/s, ratio %.2f'
+                  % (COMPRESS_CODEC, stored_bytes / elapsed / 1e6, total_bytes / max(stored_bytes, 1)))
+
+        # 将存放都放在了 acquire 函数里
+        try : 
+            acquisition_flag = 0 # 结束了采集
+            triggers = prophesee_cam.prophesee_tirgger_found()
+            # 按触发序号回填到每台相机的帧元数据, 缺失的帧在 meta/frame_trigger_map.txt 中 row 为 -1
+            for cam, nodemap, serial_number, cam_path in cameras:
+                try:
+                    table = map_triggers(cam_path, triggers['t'], TRIGGER_OFFSET, NUM_IMAGES)
+                    # FLIR 时钟 <-> EVK4 时钟的偏移和漂移, 存到 meta/clock_model.json
+                    clock = fit_trigger_map(table)
+                    if clock.count:
+                        clock.save(cam_path)
+                    print(clock.summary())
+                except Exception as ex:
+                    print('camera %s trigger map failed: %s' % (serial_number, ex))
+        except Exception as ex:
+            print('save is wrong: %s' % ex)
+    except PySpin.SpinnakerException as ex:
+        print('Error: %s' % ex)
+        result = False
+
+    for i, (cam, nodemap, serial_number, cam_path) in enumerate(cameras):
+        try:
             # Disable chunk data
             result &= disable_chunk_data(nodemap)
-        
             # Reset trigger
             result &= reset_trigger(nodemap)
-
-            
             # Deinitialize camera
             cam.DeInit()
-
         except PySpin.SpinnakerException as ex:
             print('Error: %s' % ex)
             result = False
             cam.DeInit()
-        
         print('Camera %d example complete... \n' % i)
 
+    cameras.clear()
     cam_list.Clear()
     del cam
     system.ReleaseInstance()
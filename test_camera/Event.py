@@ -22,6 +22,10 @@ from metavision_sdk_base import EventCDBuffer
 from metavision_sdk_cv import ActivityNoiseFilterAlgorithm, TrailFilterAlgorithm, SpatioTemporalContrastAlgorithm
 from metavision_sdk_core import PeriodicFrameGenerationAlgorithm, PolarityFilterAlgorithm, RoiFilterAlgorithm
 from metavision_sdk_ui import EventLoop, BaseWindow, MTWindow, UIAction, UIKeyEvent
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sync'))
+from lib.evk4 import extract_triggers
+from lib.refocus import refocus
+from lib.event_export import export_events, iter_dat_chunks
 
 def ensure_dir(path):
     if not os.path.exists(path):
@@ -59,103 +63,49 @@ def parse_args():
                                   'be opened.')
     return parser.parse_args()
 
-def save_time(input_path_dat):
+def save_time(input_path_dat, output="test.txt", fmt='txt'):
+    # 按块读取并整块写出, fmt 可选 'txt' / 'npy' / 'columns' (见 lib/event_export.py)
     record_dat = EventDatReader(input_path_dat)
     print(record_dat)
-    events = record_dat.load_n_events(record_dat.event_count())  # load the 10 next events
-    print('.................Open Txt.................')
-    with open("test.txt", "w+") as f:
-        for i in range(events.shape[0]):
-            # print(events[i][3]/1000000.0)
-            f.write('{}'.format(events[i][3]/1000000.0) +
-                    ' ' + '{}'.format(events[i][0]-roi_x0-1) +
-                    ' ' + '{}'.format(events[i][1]-roi_y0-1) +
-                    ' ' + '{}\n'.format(events[i][2]))
-        f.close()
-    print('.................Close Txt.................')
-    print(events)
-
-def e_refocus(raw_path,d=1.3,width=600,height=600,nameout="test",polarity: int = -1,do_time_shifting=True):
-    triggers = None
-    with RawReader(str(raw_path), do_time_shifting=do_time_shifting) as ev_data:
-        while not ev_data.is_done():
-            a = ev_data.load_n_events(1000000)
-        triggers = ev_data.get_ext_trigger_events()
+    print('.................Open %s.................' % output)
+    n = export_events(iter_dat_chunks(record_dat), output, fmt, origin=(roi_x0 + 1, roi_y0 + 1),
+                      count=record_dat.event_count())
+    print('.................Close %s, %d events.................' % (output, n))
+
+def e_refocus(raw_path,d=1.32,width=600,height=600,nameout="test",polarity: int = -1,do_time_shifting=True,
+              v=0.1775,fx=383.547):
+    """
+    重聚焦: 事件按块流式累加, 内存与录制长度无关.
+
+    :param d: 目标深度 m
+    :param v: 导轨速度 m/s
+    :param fx: 相机内参
+    """
+    # 只扫描触发字, 不解码全部事件
+    triggers = extract_triggers(raw_path, polarity=None, do_time_shifting=do_time_shifting)
     print(f"triggers num = {len(triggers)}")
-    try:
-        trigger_polar, trigger_time, cam = zip(*triggers)
-        index = (trigger_polar == 1)
-        trigger_time = trigger_time[index]
-        # wirte time to a txt file
-        with open(os.path.join('dataout', nameout, 'event', 'TimeStamps.txt'), "w+") as f:
-            for i in range(len(trigger_time)):
-                timestamp =trigger_time[i]
-                f.write('{}'.format(int(timestamp)/1000000000) +'\n')
-    except:
-         print(f"no trigger signal!")
-         exit()
+    trigger_time = triggers['t'][triggers['p'] == 1]
+    if len(trigger_time) == 0:
+        print(f"no trigger signal!")
+        exit()
+    # wirte time to a txt file
+    with open(os.path.join('dataout', nameout, 'event', 'TimeStamps.txt'), "w+") as f:
+        for timestamp in trigger_time:
+            f.write('{}'.format(int(timestamp)/1000000000) +'\n')
 
     if polarity in (0, 1): 
         triggers = triggers[triggers['p'] == polarity].copy()
-    else:
-        triggers = triggers.copy()
-    time_step = len(triggers) 
-    frame_t = np.array(triggers)
+    # 以中间的触发时刻为参考 (不平移)
+    ref_t = triggers['t'][len(triggers) // 2] if len(triggers) else 0
+
+    global roi_x0, roi_y0
     mv_iterator = EventsIterator(input_path=raw_path, delta_t=10000, start_ts=0,
                                  max_duration=1200000000)
-    x=[]
-    y=[]
-    p=[]
-    t=[]
-  
-    for evs in mv_iterator:
-        e_x, e_y, e_p, e_t = zip(*evs)
-        x.extend(list(e_x))
-        y.extend(list(e_y))
-        p.extend(list(e_p))
-        t.extend(list(e_t))
-    num_events = len(t)
-    global roi_x0, roi_y0
-    x=np.array(x)-roi_x0
-    y=np.array(y)-roi_y0
-    p=np.array(p)
-    t=np.array(t)
-
-    print(f"time interval = {(t.max() - t.min())/1e6}s")
-
-    d = 1.32 # 目标深度
-    fx = 383.547  # 相机内参
-    v = 0.1775 # 导轨速度
-    ref_t = t[int(0.5*num_events)]
-    dt = t - ref_t
-    dx = dt * v * fx / d
-    event_x = x + np.round(dx)
-    event_x = np.clip(event_x, 0, width-1)
-    time_step = 30  
-    minT = t.min()
-    maxT = t.max()
-    interval = (maxT - minT) / time_step
-
-    # convert events to event tensors
-    pos = np.zeros((time_step, height, width))
-    neg = np.zeros((time_step, height, width))
-    T,H,W = pos.shape
-    pos = pos.ravel()    #变成一维
-    neg = neg.ravel()    
-    ind = (t / interval).astype(int)
-    ind[ind == T] -= 1
-    event_x = x.astype(int)-x.min().astype(int)
-    event_y = y.astype(int)-y.min().astype(int)
-    pos_ind = p == 1
-    neg_ind = p == 0
-    np.add.at(pos, event_x[pos_ind] + event_y[pos_ind]*W + ind[pos_ind]*W*H, 1)
-    np.add.at(neg, event_x[neg_ind] + event_y[neg_ind]*W + ind[neg_ind]*W*H, 1)
-    pos = np.reshape(pos, (T,H,W))
-    neg = np.reshape(neg, (T,H,W))
-    sum_pos = np.sum(pos+neg,axis=0)
-    sum_pos[sum_pos>3*np.mean(sum_pos)]=np.mean(sum_pos)
-    sum_pos/= np.max(sum_pos)
-    cv2.imwrite(os.path.join(os.path.join('dataout', nameout, 'event'), 'test.png'), sum_pos*255)
+    engine = refocus(mv_iterator, width=width, height=height, v=v, fx=fx, d=d, ref_t=ref_t,
+                     origin=(roi_x0, roi_y0))
+    if engine.events:
+        print(f"time interval = {(engine.t_max - engine.t_min)/1e6}s, {engine.events} events")
+    cv2.imwrite(os.path.join(os.path.join('dataout', nameout, 'event'), 'test.png'), engine.normalized())
     print("OK")
 
 
@@ -7,6 +7,10 @@ import cv2
 from threading import Thread
 import numpy as np
 import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sync'))
+from lib.hdr_fusion import HDRFusion
+from lib.live_preview import LivePreview
+from lib.frame_pool import FramePool
 
 class TriggerType:
     SOFTWARE = 1
@@ -18,8 +22,14 @@ images_s = []
 timestamps_m = []
 timestamps_s = []
 MASTERNODE = None
-savestyle = 7
+savestyle = 7   # 8: 序列器 HDR, 每组曝光在线融合为一帧
 multfactor = 500
+HDR_WORKERS = 3     # 融合线程数
+HDR_PREVIEW = True  # 同时保存色调映射后的 png 预览
+PREVIEW_FPS = 10        # 实时预览帧率上限, 在独立线程中显示, 不影响采集
+PREVIEW_FACTOR = 2      # Bayer 超像素 (1/2) 之后再缩小的倍数
+PREVIEW_MODE = 'bin'    # 'bin' 合并 或 'stride' 抽取
+SAVE_POOL_SLOTS = 32    # savestyle 7 的帧缓存槽数, raw2npy + VNG + PNG 在写盘线程中完成, 槽满时采集线程等待
 ### 一些参数配置
 ## FLIR从相机
 CHOSEN_TRIGGER = TriggerType.HARDWARE
@@ -56,6 +66,24 @@ def ensure_dir(path):
     if not os.path.exists(path):
         os.makedirs(path)
 
+
+class BayerPngSink:
+    """savestyle 7 的写盘: 保存 bayer/<i>.raw 和 raw2npy + VNG 的 RGB/<i>.png, 在 FramePool 写盘线程中调用"""
+
+    def __init__(self, path, color_space, cam_name):
+        self.bayer_path = os.path.join(path, 'bayer')
+        self.rgb_path = os.path.join(path, 'RGB')
+        self.color_space = color_space
+        self.cam_name = cam_name
+        ensure_dir(self.bayer_path)
+        ensure_dir(self.rgb_path)
+
+    def __call__(self, frame, i):
+        frame.tofile(os.path.join(self.bayer_path, '%d.raw' % i))
+        npy = raw2npy(frame, self.cam_name)
+        res_RGB = cv2.cvtColor(npy, self.color_space)
+        cv2.imwrite(os.path.join(self.rgb_path, '%d.png' % i), res_RGB)
+
 class FLIRTYPE:
     MASTER = 0
     SLAVE = 1
@@ -650,7 +678,10 @@ class FLIR():
 
     def acquire_images(self):
         print('*** IMAGE ACQUISITION ***\n')
-        cv2.namedWindow("Image", cv2.WINDOW_NORMAL) 
+        preview = None
+        if savestyle == 7:
+            preview = LivePreview("Image", max_fps=PREVIEW_FPS, factor=PREVIEW_FACTOR, mode=PREVIEW_MODE,
+                                  bits=16, flip=True).start()
         time.sleep(2)
         try:
             result = True
@@ -666,6 +697,13 @@ class FLIR():
             acquisition_mode_continuous = node_acquisition_mode_continuous.GetValue()
             node_acquisition_mode.SetIntValue(acquisition_mode_continuous)
             self.displayValue('Acquisition mode','continuous')
+            hdr = None
+            pool = None
+            if savestyle == 7:
+                sink = BayerPngSink(os.path.join('dataout', name_out, 'Master'), self.ColorSpace, self.SaveImgFile)
+            if savestyle == 8:
+                hdr = HDRFusion(os.path.join('dataout', name_out, 'Master'), self.ExposureTime,
+                                num_workers=HDR_WORKERS, preview=HDR_PREVIEW, color_code=self.ColorSpace)
             self.cam.BeginAcquisition()
             for i in range(self.NUM_IMAGES):
                 try:
@@ -696,28 +734,28 @@ class FLIR():
                             self.Images.append(image_result)
                         elif savestyle == 7:
                             timeBegin = time.time()
-                            filename_bayer =  os.path.join('dataout', name_out, 'Master', 'bayer', '%d.raw' % i)
-                            ensure_dir(os.path.join('dataout', name_out, 'Master', 'bayer'))
                             res_bayer = image_result.GetNDArray()
-                            # ensure_dir(os.path.join('dataout', name_out, self.SaveImgFile, 'npy'))
-                            npy = raw2npy(res_bayer,self.SaveImgFile)
-                            # np.save(os.path.join('dataout', name_out, self.SaveImgFile, 'npy','%d.npy'% i),npy)
-                            # if name_out == 'test':
-                            res_RGB = cv2.cvtColor(npy,self.ColorSpace)
-                            #显示图片
-                            cv2.imshow("Image", res_RGB) 
-                            cv2.waitKey(1)
-                            filename_RGB =  os.path.join('dataout', name_out, 'Master', 'RGB', '%d.png' % i)
-                            ensure_dir(os.path.join('dataout', name_out, 'Master', 'RGB'))
-                            print('filename_RGB', filename_RGB)
-                            cv2.imwrite(filename_RGB, res_RGB)
+                            #显示图片 (预览线程中降采样显示)
+                            preview.offer(res_bayer)
+                            # 采集线程只拷贝到缓存池, raw / raw2npy / VNG / PNG 在写盘线程中完成
+                            if pool is None:
+                                pool = FramePool(SAVE_POOL_SLOTS, *res_bayer.shape, dtype=res_bayer.dtype)
+                                pool.start_writer(sink)
+                            slot = pool.get_free()
+                            np.copyto(pool.buffers[slot], res_bayer)
+                            pool.commit(slot, i)
+                            chunk_data = image_result.GetChunkData()
+                            timestamp = chunk_data.GetTimestamp()
+                            self.TimeStamps.append(timestamp)
                             timeEnd = time.time()
                             timeDelta = timeEnd - timeBegin
                             print("Save interval", timeDelta)
+                        elif savestyle == 8:
+                            # 按 chunk 曝光时间确定序列器状态, 与 raw2npy 一样左右翻转
                             chunk_data = image_result.GetChunkData()
                             timestamp = chunk_data.GetTimestamp()
-                            #saving
-                            res_bayer.tofile(filename_bayer)
+                            hdr.add(np.fliplr(image_result.GetNDArray()),
+                                    hdr.set_for_exposure(chunk_data.GetExposureTime()), timestamp)
                             self.TimeStamps.append(timestamp)
                         image_result.Release()
                     # if i==2:
@@ -726,10 +764,18 @@ class FLIR():
                     print('Error: %s' % ex)
                     result = False
             self.cam.EndAcquisition()
+            if hdr is not None:
+                hdr.close()
         except PySpin.SpinnakerException as ex:
             print('Error: %s' % ex)
             result = False
-        cv2.destroyAllWindows()
+        if pool is not None:
+            # 等待写盘线程写完剩余的帧
+            result &= pool.close()
+            print('written %d images, capture waits %d, max in flight %d'
+                  % (pool.written_count, pool.wait_count, pool.max_in_flight))
+        if preview is not None:
+            preview.stop()
         return result
 
     def save_images(self):
@@ -767,7 +813,8 @@ class FLIR():
         with open(os.path.join('dataout', name_out, 'Master', 'TimeStamps.txt'), "w+") as f:
             for i in range(len(self.TimeStamps)):
                 timestamp = self.TimeStamps[i]
-                expt = 16 if i%3==0 else 1 if i%3==1 else 4
+                # 序列器状态 i % NUM_SEQ 的曝光 (以基准为单位), 默认为 16 1 4
+                expt = self.ExposureTime[i % self.NUM_SEQ] / multfactor if multfactor else 0
                 f.write('{}'.format(int(timestamp)/1000000000) +
                         ' ' + '%d.jpg ' % i+'%.2f'% expt+'\n')
         configdict = {
@@ -0,0 +1,402 @@
+'''
+不需要相机的存储方式基准测试.
+
+用合成的 Bayer 帧按设定帧率模拟采集, 依次测试 FLIR.py 的各个 savestyle 以及 V2/V4 的保存方式,
+每种方式在独立子进程中运行, 输出帧率、MB/s、单帧耗时分位数、峰值内存和 CPU 占用, 结果写成 JSON.
+
+    python utils/bench_storage.py --frames 200 --fps 15 --width 2000 --height 1000 --out bench.json
+    python utils/bench_storage.py --list
+'''
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import platform
+from abc import ABC, abstractmethod
+import resource
+import tempfile
+import multiprocessing as mp
+import numpy as np
+import cv2 as cv
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sync'))
+
+from lib.frame_pool import FramePool, RawFileSink
+from lib.frame_container import ContainerSink
+from lib.frame_compress import CompressedSink
+from lib.pipeline_writer import PipelinedRecorder
+
+try:
+    import PySpin
+except ImportError:
+    PySpin = None
+
+VNG = cv.COLOR_BayerRG2RGB_VNG  # FLIR.py 的 ColorSpace
+
+
+def raw2npy(frame):
+    """与 FLIR.py 的 raw2npy 相同的运算 (16 位 -> 8 位, 左右翻转)"""
+    data_bytes = np.frombuffer(frame, dtype=np.uint8)
+    even = data_bytes[0::2]
+    odd = data_bytes[1::2]
+    bayer8_image = (even >> 4) | (odd << 0)
+    bayer8_image = bayer8_image.reshape(frame.shape)
+    return np.fliplr(bayer8_image)
+
+
+def to_bayer8(frame):
+    return raw2npy(frame) if frame.dtype == np.uint16 else frame
+
+
+class Strategy(ABC):
+    """on_frame 在模拟的采集线程中调用, finish 为采集结束后的收尾 (写盘等)"""
+    description = ''
+    requires = None
+
+    def __init__(self, path, height, width, dtype):
+        self.path = path
+        self.height = height
+        self.width = width
+        self.dtype = dtype
+
+    @abstractmethod
+    def on_frame(self, frame, i):
+        pass
+
+    def finish(self):
+        pass
+
+
+class KeepImagePtr(Strategy):
+    description = 'FLIR.py savestyle 1/6: keep every image, save JPEG after capture'
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.images = []
+
+    def on_frame(self, frame, i):
+        # ImagePtr 持有相机缓冲区, 这里用拷贝代替
+        self.images.append(frame.copy())
+
+    def finish(self):
+        for i, image in enumerate(self.images):
+            cv.imwrite(os.path.join(self.path, 'image-%d.jpg' % i), cv.cvtColor(to_bayer8(image), VNG))
+
+
+class OpenCVJpeg(Strategy):
+    description = 'FLIR.py savestyle 2: VNG + JPEG inline'
+
+    def on_frame(self, frame, i):
+        cv.imwrite(os.path.join(self.path, 'image-%d.jpg' % i), cv.cvtColor(to_bayer8(frame), VNG))
+
+
+class SpinnakerSave(Strategy):
+    description = 'FLIR.py savestyle 3: image_result.Save JPEG inline'
+    requires = 'PySpin'
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.pixel_format = PySpin.PixelFormat_BayerRG16 if self.dtype == np.uint16 else PySpin.PixelFormat_BayerRG8
+
+    def on_frame(self, frame, i):
+        image = PySpin.Image.Create(self.width, self.height, 0, 0, self.pixel_format, frame)
+        image.Save(os.path.join(self.path, 'image-%d.jpg' % i))
+
+
+class NDArrayList(Strategy):
+    description = 'FLIR.py savestyle 4: keep NDArray, raw + raw2npy + VNG PNG after capture'
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.images = []
+
+    def on_frame(self, frame, i):
+        self.images.append(frame.copy())
+
+    def finish(self):
+        for i, image in enumerate(self.images):
+            image.tofile(os.path.join(self.path, '%d.raw' % i))
+            cv.imwrite(os.path.join(self.path, '%d.png' % i), cv.cvtColor(to_bayer8(image), VNG))
+
+
+class GetDataList(Strategy):
+    description = 'FLIR.py savestyle 5: keep GetData bytes only'
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.images = []
+
+    def on_frame(self, frame, i):
+        self.images.append(frame.tobytes())
+
+
+class InlineRawPng(Strategy):
+    description = 'FLIR.py savestyle 7: raw2npy + VNG + PNG + raw inline'
+
+    def on_frame(self, frame, i):
+        res_rgb = cv.cvtColor(to_bayer8(frame), VNG)
+        cv.imwrite(os.path.join(self.path, '%d.png' % i), res_rgb)
+        frame.tofile(os.path.join(self.path, '%d.raw' % i))
+
+
+class NpyStack(Strategy):
+    description = 'V2: keep Bayer copies, np.save one stack after capture'
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.images = []
+
+    def on_frame(self, frame, i):
+        self.images.append(np.array(frame))
+
+    def finish(self):
+        np.save(os.path.join(self.path, 'image_bayer.npy'), np.array(self.images))
+
+
+class _PoolStrategy(Strategy):
+    """V4: FramePool + 写盘线程"""
+
+    @abstractmethod
+    def make_sink(self):
+        pass
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.pool = FramePool(16, self.height, self.width, dtype=self.dtype)
+        self.sink = self.make_sink()
+        self.pool.start_writer(self.sink)
+
+    def on_frame(self, frame, i):
+        slot = self.pool.get_free()
+        np.copyto(self.pool.buffers[slot], frame)
+        self.pool.commit(slot, i)
+
+    def finish(self):
+        self.pool.close()
+        if hasattr(self.sink, 'close'):
+            self.sink.close()
+
+
+class PoolRawFiles(_PoolStrategy):
+    description = 'V4: frame pool, one .raw per frame'
+
+    def make_sink(self):
+        return RawFileSink(self.path, (0, 0, self.width, self.height))
+
+
+class PoolContainer(_PoolStrategy):
+    description = 'V4: frame pool, single frames.frc container'
+
+    def make_sink(self):
+        return ContainerSink(self.path, (0, 0, self.width, self.height), capacity=100000,
+                             dtype=self.dtype, preallocate=False)
+
+
+class PoolCompressed(_PoolStrategy):
+    description = 'V4: frame pool, zlib-1 chunked frames.cfz'
+
+    def make_sink(self):
+        return CompressedSink(self.path, (0, 0, self.width, self.height), dtype=self.dtype, codec='zlib')
+
+
+class PipelinedPng(Strategy):
+    description = 'nosync camera_xavier: shared-memory slots, 3 PNG writer processes'
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        if self.dtype != np.uint8:
+            raise ValueError('pipelined recorder only handles 8-bit Bayer')
+        self.recorder = PipelinedRecorder(self.path, self.height, self.width, policy='block')
+
+    def on_frame(self, frame, i):
+        self.recorder.submit(i, frame, 0.0, i)
+
+    def finish(self):
+        self.recorder.close()
+
+
+STRATEGIES = {
+    'style1_imageptr': KeepImagePtr,
+    'style2_opencv_jpeg': OpenCVJpeg,
+    'style3_spinnaker_save': SpinnakerSave,
+    'style4_ndarray_list': NDArrayList,
+    'style5_getdata': GetDataList,
+    'style7_inline_raw_png': InlineRawPng,
+    'v2_npy_stack': NpyStack,
+    'v4_raw_files': PoolRawFiles,
+    'v4_container': PoolContainer,
+    'v4_compressed': PoolCompressed,
+    'pipelined_png': PipelinedPng,
+}
+
+
+def synthetic_frames(height, width, dtype, count=4, seed=0):
+    """带渐变和噪声的 Bayer 帧, 压缩率接近真实图像而不是纯随机数据"""
+    rng = np.random.default_rng(seed)
+    max_value = np.iinfo(dtype).max
+    y, x = np.mgrid[0:height, 0:width]
+    base = (np.sin(x / 97.0) + np.cos(y / 61.0) + 2) / 4 * max_value * 0.8
+    frames = []
+    for k in range(count):
+        noise = rng.normal(0, max_value * 0.02, (height, width))
+        frames.append(np.clip(base * (0.9 + 0.05 * k) + noise, 0, max_value).astype(dtype))
+    return frames
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def run_strategy(name, args, results):
+    """子进程中运行一种保存方式, 结果放入 results"""
+    dtype = np.uint16 if args.bits == 16 else np.uint8
+    frames = synthetic_frames(args.height, args.width, dtype)
+    frame_bytes = frames[0].nbytes
+    path = tempfile.mkdtemp(prefix='bench_%s_' % name, dir=args.dir)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    result = {'strategy': name, 'description': STRATEGIES[name].description}
+    try:
+        strategy = STRATEGIES[name](path, args.height, args.width, dtype)
+        period = 1.0 / args.fps if args.fps > 0 else 0.0
+        latencies = np.empty(args.frames)
+        late = 0
+        cpu_start = os.times()
+        start = time.perf_counter()
+        for i in range(args.frames):
+            due = start + i * period
+            now = time.perf_counter()
+            if now < due:
+                time.sleep(due - now)
+            elif period and now - due > period:
+                # 真实相机上这一帧会在缓冲区里等待或被丢弃
+                late += 1
+            t0 = time.perf_counter()
+            strategy.on_frame(frames[i % len(frames)], i)
+            latencies[i] = time.perf_counter() - t0
+        capture_time = time.perf_counter() - start
+        strategy.finish()
+        total_time = time.perf_counter() - start
+        cpu_end = os.times()
+
+        cpu = (cpu_end.user - cpu_start.user + cpu_end.system - cpu_start.system
+               + cpu_end.children_user - cpu_start.children_user
+               + cpu_end.children_system - cpu_start.children_system)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        peak_rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+        p50, p90, p99 = np.percentile(latencies, (50, 90, 99)) * 1000
+        result.update({
+            'ok': True,
+            'frames': args.frames,
+            'capture_s': capture_time,
+            'finish_s': total_time - capture_time,
+            'fps': args.frames / total_time,
+            'mb_s': args.frames * frame_bytes / total_time / 1e6,
+            'disk_mb': directory_size(path) / 1e6,
+            'late_frames': late,
+            'latency_ms': {'p50': p50, 'p90': p90, 'p99': p99, 'max': latencies.max() * 1000},
+            'peak_rss_mb': peak_rss,
+            'baseline_rss_mb': baseline_rss,  # 开始前 (含合成帧) 的峰值内存
+            'peak_rss_children_mb': peak_rss_children,
+            'cpu_percent': cpu / total_time * 100,
+        })
+    except Exception as ex:
+        result.update({'ok': False, 'error': str(ex)})
+    finally:
+        if not args.keep:
+            shutil.rmtree(path, ignore_errors=True)
+    results.put(result)
+
+
+def wait_result(name, p, results, timeout):
+    """等待子进程的结果; 子进程被 OOM 杀掉、段错误退出或超时时返回失败结果, 不会一直阻塞"""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return results.get(timeout=1.0)
+        except queue.Empty:
+            pass
+        if not p.is_alive():
+            # 结果可能在子进程退出前刚放入队列
+            try:
+                return results.get(timeout=1.0)
+            except queue.Empty:
+                return {'strategy': name, 'ok': False, 'exitcode': p.exitcode,
+                        'error': 'process exited with code %s' % p.exitcode}
+        if time.time() > deadline:
+            p.terminate()
+            p.join()
+            return {'strategy': name, 'ok': False, 'exitcode': p.exitcode,
+                    'error': 'timed out after %.0f s' % timeout}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark frame storage strategies without a camera.')
+    parser.add_argument('--strategies', nargs='*', default=None, help='names to run (default all)')
+    parser.add_argument('--list', action='store_true', help='list strategies and exit')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--fps', type=float, default=15.0, help='simulated trigger rate, 0 for as fast as possible')
+    parser.add_argument('--width', type=int, default=2000)
+    parser.add_argument('--height', type=int, default=1000)
+    parser.add_argument('--bits', type=int, default=8, choices=(8, 16))
+    parser.add_argument('--dir', default=None, help='where to write test data (default system temp)')
+    parser.add_argument('--keep', action='store_true', help='keep written data')
+    parser.add_argument('--out', default='bench_storage.json')
+    parser.add_argument('--timeout', type=float, default=600.0, help='seconds before a strategy is killed')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.list:
+        for name, cls in STRATEGIES.items():
+            print('%-24s %s' % (name, cls.description))
+        return True
+    names = args.strategies or list(STRATEGIES)
+    report = {
+        'machine': {'node': platform.node(), 'platform': platform.platform(), 'machine': platform.machine(),
+                    'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv.__version__,
+                    'cpus': os.cpu_count()},
+        'config': {'frames': args.frames, 'fps': args.fps, 'width': args.width, 'height': args.height,
+                   'bits': args.bits, 'dir': args.dir or tempfile.gettempdir()},
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': [],
+    }
+    for name in names:
+        if name not in STRATEGIES:
+            print('unknown strategy %s' % name)
+            continue
+        if STRATEGIES[name].requires == 'PySpin' and PySpin is None:
+            report['results'].append({'strategy': name, 'ok': False, 'error': 'PySpin not available'})
+            print('%-24s skipped (PySpin not available)' % name)
+            continue
+        # 每种方式单独一个进程, 峰值内存互不影响
+        results = mp.Queue()
+        p = mp.Process(target=run_strategy, args=(name, args, results))
+        p.start()
+        result = wait_result(name, p, results, args.timeout)
+        p.join()
+        report['results'].append(result)
+        if result['ok']:
+            print('%-24s %7.2f fps %8.1f MB/s  p50 %7.2f ms  p99 %7.2f ms  finish %6.2f s  rss %7.1f MB  cpu %5.1f%%  late %d'
+                  % (name, result['fps'], result['mb_s'], result['latency_ms']['p50'], result['latency_ms']['p99'],
+                     result['finish_s'], result['peak_rss_mb'], result['cpu_percent'], result['late_frames']))
+        else:
+            print('%-24s failed: %s' % (name, result['error']))
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results written to %s' % args.out)
+    return True
+
+
+if __name__ == '__main__':
+    if main():
+        sys.exit(0)
+    else:
+        sys.exit(1)